@@ -1,11 +1,26 @@
 import streamlit as st
-import graphviz
 from itertools import cycle
+from pathlib import Path
 import copy
 import json
-from collections import defaultdict
 import pandas as pd
 import altair as alt
+from power_tree import PowerTree
+from current_import import CURRENT_TABLE_COLUMNS, CurrentTableError, apply_current_rows, read_current_table
+from trace_import import BINARY_DTYPES, CURRENT_UNITS, TRACE_FORMATS, TraceInterval, TraceSource, mode_current_table, scan_trace
+from config_io import ConfigFormatError, ConfigValidationError, encode_config, parse_config
+from batch_engine import evaluate_use_cases
+from parallel import ExecutionBackend, default_workers, shutdown_pools
+from power_calc import EFFICIENCY_CURVE_KEY, SnapshotBuilder, evaluate_use_case
+from power_report import contribution_matrix, profile_battery_life, profile_breakdown, update_contribution_matrix, vsys_referred_contributions, vsys_voltage_of
+import profiling
+from result_cache import PowerResultCache, content_digest
+from tree_render import PowerTreeRenderCache, TreeDetail, power_tree_label_data
+from monte_carlo import DISTRIBUTIONS, MAX_SAMPLES as MAX_MC_SAMPLES, TOLERANCE_KINDS, Tolerance, run_monte_carlo, sample_histogram, summarize_samples
+from sensitivity import sensitivity_report
+from discharge import DEFAULT_SOC_CURVE, BatteryCurve, simulate_discharge
+from variants import COMPARISONS, DELTA_PCT_SUFFIX, VariantReportCache, compare_table, config_digest, regression_scores, worst_regressions
+from sweep import MAX_SWEEP_POINTS, PARAMETER_KINDS, POWER_SOURCE_FIELDS, SweepParameter, run_sweep, sweep_values
 
 # ===============================================================
 #  頁面設定 (必須是第一個執行的 Streamlit 指令)
@@ -67,6 +82,8 @@ else: # Light Theme
 # ---
 # 核心數據結構 (Core Data Structure)
 # ---
+# Debug 面板保留 (可匯出) 的 rerun 記錄數
+PROFILING_HISTORY = 20
 DEFAULT_COLORS = cycle(["#4CAF50", "#FF5722", "#607D8B", "#E91E63", "#9C27B0", "#03A9F4"])
 
 def initialize_data():
@@ -138,7 +155,6 @@ def initialize_data():
     component_nodes = [n for n in st.session_state.power_tree_data['nodes'] if n['type'] == 'component']
     power_source_nodes = [n for n in st.session_state.power_tree_data['nodes'] if n['type'] == 'power_source']
     all_comp_groups = set(n['group'] for n in component_nodes)
-    node_lookup = {(n['group'], n['endpoint']): n['id'] for n in component_nodes}
     
     # --- 2. 先初始化 Power Source Modes ---
     st.session_state.power_source_modes = {}
@@ -165,26 +181,7 @@ def initialize_data():
         {"Group": "Display Module", "Mode Name": "Idle mode", "Endpoint": "OVSS", "Current (uA)": 0, "Mode Note": "Display off"},
     ]
 
-    new_op_modes = defaultdict(dict)
-    for row in user_table_data:
-        group = row["Group"]
-        mode = row["Mode Name"]
-        endpoint = row["Endpoint"]
-        current = row["Current (uA)"]
-        note = row.get("Mode Note", "")
-        
-        node_id = node_lookup.get((group, endpoint))
-        if not node_id: continue
-        
-        if mode not in new_op_modes[group]:
-            all_node_ids_in_group = {n['id'] for n in component_nodes if n['group'] == group}
-            new_op_modes[group][mode] = {"currents_uA": {nid: 0.0 for nid in all_node_ids_in_group}, "note": note}
-        
-        new_op_modes[group][mode]["currents_uA"][node_id] = current
-        if note:
-            new_op_modes[group][mode]["note"] = note
-    
-    st.session_state.operating_modes = dict(new_op_modes)
+    apply_current_rows(st.session_state.operating_modes, component_nodes, [pd.DataFrame(user_table_data, columns=CURRENT_TABLE_COLUMNS)])
     
     # 3B. 為所有「其他」群組建立 "Default" 模式
     def get_default_current_uA(node):
@@ -289,256 +286,321 @@ def initialize_data():
     
     st.session_state.initialized = True
 
-initialize_data()
+# 側邊欄勾選「Profiling」時記錄這次 rerun 的各區段時間 (面板在頁面最後才填入)
+if st.session_state.get('profiling_enabled'):
+    profiling.start()
+else:
+    profiling.stop()
+
+with profiling.span("initialize_data"):
+    initialize_data()
 
 # ---
 # 核心功能函數 (Core Functions)
 # ---
 
-def get_node_by_id(node_id):
-    return next((n for n in st.session_state.power_tree_data['nodes'] if n['id'] == node_id), None)
-
-def apply_use_case(use_case_name_override=None):
-    if use_case_name_override:
-        active_uc_name = use_case_name_override
-    else:
-        active_uc_name = st.session_state.get('active_use_case', list(st.session_state.use_cases.keys())[0])
-        if active_uc_name not in st.session_state.use_cases:
-            active_uc_name = list(st.session_state.use_cases.keys())[0]
-            st.session_state.active_use_case = active_uc_name
-
-    active_uc = st.session_state.use_cases[active_uc_name]
-    
-    # --- 【已修改】 quiescent_current_uA ---
-    ps_settings = active_uc.get("power_sources", {})
-    for node in st.session_state.power_tree_data['nodes']:
-        if node['type'] == 'power_source':
-            ps_mode_name = ps_settings.get(node['id'], "On")
-            if ps_mode_name not in st.session_state.power_source_modes.get(node['id'], {}):
-                ps_mode_name = "On" 
-            
-            mode_params = st.session_state.power_source_modes[node['id']][ps_mode_name]
-            node['output_voltage'] = mode_params['output_voltage']
-            node['efficiency'] = mode_params['efficiency']
-            node['quiescent_current_uA'] = mode_params['quiescent_current_uA'] # <-- 已重命名
-
-    # --- 【已修改】 讀取 uA 並除以 1000 ---
-    comp_settings = active_uc.get("components", {}) 
-    for node in st.session_state.power_tree_data['nodes']:
-        if node['type'] == 'component':
-            group = node['group']
-            group_ratios = comp_settings.get(group)
-            
-            if group_ratios:
-                source_node = get_node_by_id(node.get('input_source_id'))
-                current_voltage = 0.0
-                if source_node:
-                    current_voltage = source_node.get('output_voltage', 0.0)
-
-                weighted_power = 0.0
-                
-                for mode_name, ratio in group_ratios.items():
-                    if ratio > 0:
-                        # 1. 讀取 uA
-                        current_uA = st.session_state.operating_modes.get(group, {}).get(
-                            mode_name, {}
-                        ).get('currents_uA', {}).get(node['id'], 0.0) # <-- 讀取 currents_uA
-                        
-                        # 2. 轉換為 mA (uA / 1000) 來計算 mW
-                        power_for_mode = current_voltage * (current_uA / 1000.0)
-                        
-                        weighted_power += power_for_mode * (ratio / 100.0)
-                
-                node['power_consumption'] = weighted_power
-            else:
-                node['power_consumption'] = 0.0
-
-def calculate_power(use_case_name_override=None):
-    apply_use_case(use_case_name_override)
+def get_power_tree():
+    """取得與 power_tree_data['nodes'] 同步的 PowerTree 索引 (讀取設定檔後會自動重建)"""
     nodes = st.session_state.power_tree_data['nodes']
-    
-    memo = {}
-
-    def recursive_power_calc(node_id, visited_nodes):
-        if node_id in memo:
-            return memo[node_id]
-        if node_id in visited_nodes:
-            st.error(f"檢測到循環依賴: {node_id}")
-            return 0
-        
-        visited_nodes.add(node_id)
-        node = get_node_by_id(node_id)
-        if not node: return 0
-        if node['type'] == 'component':
-            source = get_node_by_id(node.get('input_source_id'))
-            if source and source['output_voltage'] == 0:
-                return 0.0
-            return node.get('power_consumption', 0)
-        
-        total_downstream_power = sum(
-            recursive_power_calc(downstream_node['id'], visited_nodes.copy())
-            for downstream_node in nodes if downstream_node.get('input_source_id') == node_id
-        )
-        node['output_power_total'] = total_downstream_power
-        
-        efficiency = node.get('efficiency', 1.0)
-        input_power_from_load = total_downstream_power / efficiency if efficiency > 0 else 0
-        
-        input_source = get_node_by_id(node.get('input_source_id'))
-        input_voltage = input_source['output_voltage'] if input_source else node['output_voltage']
-        
-        # --- 【已修改】 讀取 uA 並除以 1000 ---
-        quiescent_current_uA = node.get('quiescent_current_uA', 0.0)
-        quiescent_power = input_voltage * (quiescent_current_uA / 1000.0) # <-- 除以 1000
-        
-        total_input_power = input_power_from_load + quiescent_power
-        node['input_power'] = total_input_power
-        
-        memo[node_id] = total_input_power
-        return total_input_power
+    tree = st.session_state.get('power_tree')
+    if tree is None or not tree.is_synced_with(nodes):
+        tree = PowerTree(nodes)
+        st.session_state.power_tree = tree
+    return tree
 
-    root_nodes = [n for n in nodes if n.get('input_source_id') is None]
-    total_system_power_mW = sum(recursive_power_calc(root['id'], set()) for root in root_nodes)
-    return total_system_power_mW
+def get_node_by_id(node_id):
+    return get_power_tree().get(node_id)
 
+@profiling.instrument()
+def get_model_snapshot():
+    """
+    目前 session_state 模型的唯讀快照 (供純計算核心 power_calc 使用)。
+    只有內容改變的群組 / 電源 / Use Case 會重新複製，模型沒有改變時回傳同一份 snapshot。
+    """
+    if 'snapshot_builder' not in st.session_state:
+        st.session_state.snapshot_builder = SnapshotBuilder()
+    return st.session_state.snapshot_builder.build(st.session_state)
+
+def resolve_active_use_case():
+    use_case_names = list(st.session_state.use_cases.keys())
+    active_uc_name = st.session_state.get('active_use_case', use_case_names[0])
+    if active_uc_name not in st.session_state.use_cases:
+        active_uc_name = use_case_names[0]
+        st.session_state.active_use_case = active_uc_name
+    return active_uc_name
+
+def get_current_config():
+    """目前 session 中的模型 (與「下載設定檔」的內容相同)"""
+    return {
+        'power_tree_data': st.session_state.power_tree_data,
+        'max_id': st.session_state.max_id,
+        'group_colors': st.session_state.group_colors,
+        'operating_modes': st.session_state.operating_modes,
+        'power_source_modes': st.session_state.power_source_modes,
+        'use_cases': st.session_state.use_cases,
+        'battery_capacity_mAh': st.session_state.battery_capacity_mAh,
+        'user_profiles': st.session_state.user_profiles,
+        'component_group_notes': st.session_state.component_group_notes,
+        'battery_note': st.session_state.battery_note,
+        'profile_dou_specs': st.session_state.profile_dou_specs # <-- 【新增】 確保 Spec 被儲存
+    }
 
-def get_vsys_referred_power_contributions(node_list):
+def current_config_key(config):
+    """目前設定的快取 key：snapshot 的 section 修訂編號，加上其餘 (很小的) 欄位的雜湊"""
+    model_sections = ('operating_modes', 'power_source_modes', 'use_cases')
+    other_fields = {key: value for key, value in config.items() if key not in model_sections}
+    other_fields['power_tree_data'] = {key: value for key, value in config['power_tree_data'].items() if key != 'nodes'}
+    return (tuple(get_model_snapshot().section_revisions().items()), content_digest(other_fields))
 
-    # 內部輔助函數 (保持不變)
-    def trace_power_to_root(load_mW, start_node_id):
-        current_node = get_node_by_id(start_node_id)
-        power = load_mW
-        while current_node and current_node.get('input_source_id') is not None:
-            parent_node = get_node_by_id(current_node.get('input_source_id'))
-            efficiency = current_node.get('efficiency', 1.0)
-            power = power / efficiency if efficiency > 0 else 0
-            current_node = parent_node
-        return power
+def get_config_downloads():
+    """
+    「儲存目前設定」的 (JSON 字串, .pwrm bytes, 錯誤訊息)。
+    大型模型編碼一次需要數百 ms，因此依 current_config_key 快取，模型沒有改變的 rerun 不會重新編碼。
+    """
+    config = get_current_config()
+    cache_key = current_config_key(config)
 
-    contributions = []
-    
-    # --- 1. 計算所有「元件負載」的 Vsys 參考功耗 ---
-    # (這部分已包含「工作功耗」+「效率損耗」)
-    component_nodes = [n for n in node_list if n['type'] == 'component']
-    for node in component_nodes:
-        if node.get('power_consumption', 0) > 0:
-            component_load_mW = node['power_consumption']
-            vsys_referred_power = trace_power_to_root(component_load_mW, node.get('input_source_id'))
-            
-            label = node['group'] # 以 Group 為單位
-            contributions.append({
-                "source": label, 
-                "power_mW": vsys_referred_power, 
-                "type": "Component Load"
-            })
-
-    # --- 2. 計算所有「靜態電流 (Iq) 損耗」的 Vsys 參考功耗 ---
-    power_source_nodes = [n for n in node_list if n['type'] == 'power_source']
-    for node in power_source_nodes:
-        
-        quiescent_current_uA = node.get('quiescent_current_uA', 0.0)
-        if quiescent_current_uA > 0:
-            parent_node = get_node_by_id(node.get('input_source_id'))
-            if parent_node:
-                input_voltage = parent_node.get('output_voltage', 0.0)
-                parent_id_to_trace_from = parent_node.get('id')
-            else:
-                input_voltage = node.get('output_voltage', 0.0) 
-                parent_id_to_trace_from = None 
-
-            iq_load_mW = input_voltage * (quiescent_current_uA / 1000.0) # 轉回 mW
-            vsys_referred_iq_power = trace_power_to_root(iq_load_mW, parent_id_to_trace_from)
-
-            if vsys_referred_iq_power > 0.0001:
-                label = f"{node['label']} (Iq Loss)"
-                contributions.append({
-                    "source": label,
-                    "power_mW": vsys_referred_iq_power,
-                    "type": "Quiescent Loss"
-                })
+    cached = st.session_state.get('config_downloads')
+    if cached is None or cached[0] != cache_key:
+        try:
+            downloads = (json.dumps(config, indent=4), encode_config(config), None)
+        except Exception as e:
+            downloads = ("{}", b"", str(e))
+        st.session_state.config_downloads = cached = (cache_key, *downloads)
+    return cached[1:]
 
+def get_sensitivity_report(snapshot, user_profiles, battery_capacity_mAh, vsys_voltage):
+    """
+    以 snapshot 的 section 修訂編號、Profile、電池容量與 Vsys 電壓快取的靈敏度報表，
+    只改變篩選條件 (multiselect) 的 rerun 不會重新計算。
+    """
+    cache_key = (
+        tuple(snapshot.section_revisions().items()), tuple(user_profiles), content_digest(user_profiles),
+        battery_capacity_mAh, vsys_voltage,
+    )
+    cached = st.session_state.get('sensitivity_report_cache')
+    if cached is None or cached[0] != cache_key:
+        cached = st.session_state.sensitivity_report_cache = (
+            cache_key, sensitivity_report(snapshot, user_profiles, battery_capacity_mAh, vsys_voltage)
+        )
+    return cached[1]
 
+def get_variant_cache():
+    if 'variant_report_cache' not in st.session_state:
+        st.session_state.variant_report_cache = VariantReportCache()
+    return st.session_state.variant_report_cache
 
-    if not contributions:
-        return pd.DataFrame(columns=["source", "power_mW", "type"])
-        
-    df = pd.DataFrame(contributions)
+def parse_variant_upload(uploaded_file):
+    """
+    讀取版本比較上傳的設定檔：回傳 (設定檔 dict 或 None, 錯誤訊息或 None, config_digest 或 None)，
+    依 file_id 快取解析結果與雜湊，每次 rerun 不會重新雜湊。
+    """
+    parsed = st.session_state.setdefault('variant_uploads', {})
+    if uploaded_file.file_id not in parsed:
+        try:
+            config = parse_config(uploaded_file.getvalue())
+            parsed[uploaded_file.file_id] = (config, None, config_digest(config))
+        except ConfigValidationError as e:
+            parsed[uploaded_file.file_id] = (None, f"設定檔有 {len(e.problems)} 個問題：" + "; ".join(e.problems), None)
+        except Exception as e:
+            parsed[uploaded_file.file_id] = (None, f"{type(e).__name__}: {e}", None)
+    return parsed[uploaded_file.file_id]
+
+def get_current_config_digest(config):
+    """目前設定的 config_digest，依 current_config_key 快取"""
+    cache_key = current_config_key(config)
+    cached = st.session_state.get('current_config_digest')
+    if cached is None or cached[0] != cache_key:
+        cached = st.session_state.current_config_digest = (cache_key, config_digest(config))
+    return cached[1]
+
+def commit_current_import(imported_modes, import_summary):
+    """以匯入後的 operating_modes 取代目前的資料，並清除會保留舊值的電流輸入框與備註"""
+    st.session_state.operating_modes = imported_modes
+    for group, mode_name, node_id in import_summary.updated_keys:
+        st.session_state.pop(f"current_{group}_{mode_name}_{node_id}", None)
+        st.session_state.pop(f"note_{group}_{mode_name}", None)
+    st.session_state.current_import_summary = import_summary
+    st.rerun()
+
+def get_result_cache():
+    if 'power_result_cache' not in st.session_state:
+        st.session_state.power_result_cache = PowerResultCache()
+    return st.session_state.power_result_cache
+
+def get_execution_backend():
+    """依側邊欄的 worker 數量設定取得 ExecutionBackend (設定改變時重建)"""
+    workers = st.session_state.get('compute_workers') or default_workers()
+    backend = st.session_state.get('execution_backend')
+    if backend is None or backend.workers != workers:
+        # 關閉其他 worker 數量的 pool，改設定後舊的 process 不會一直留著
+        shutdown_pools(keep=workers)
+        backend = ExecutionBackend(workers=workers)
+        st.session_state.execution_backend = backend
+    return backend
+
+@profiling.instrument()
+def get_use_case_results(use_case_names, snapshot):
+    """
+    以內容雜湊快取取得多個 Use Case 的 PowerResult。
+    只有輸入資料有變動的 Use Case 會重新計算 (多個時交給批次引擎一次算完)。
+    """
+    def compute_missing(missing_names):
+        if len(missing_names) == 1:
+            return {missing_names[0]: evaluate_use_case(snapshot, missing_names[0])}
+        return evaluate_use_cases(snapshot, missing_names, backend=get_execution_backend())
+
+    cache = get_result_cache()
+    # 單一電流修改：由修改前的快取結果沿上游路徑增量更新 (多筆修改則交給一般的快取流程重算)
+    pending_edits = st.session_state.pop('pending_current_edits', [])
+    if len(pending_edits) == 1:
+        updates = cache.apply_current_edit(snapshot, *pending_edits[0])
+        update_cached_contribution_matrix(snapshot, pending_edits[0][2], updates)
+    return cache.get_results(snapshot, use_case_names, compute_missing)
+
+def update_cached_contribution_matrix(snapshot, node_id, updates):
+    """
+    單一電流修改後只更新貢獻矩陣中受影響的格子 (見 power_report.update_contribution_matrix)，
+    並把這些 Use Case 的 key 換成修改後的 key；矩陣不是由修改前的結果建立時留給下次整個重建。
+    """
+    cached = st.session_state.get('contribution_matrix')
+    if cached is None or not updates:
+        return
+    matrix_key, matrix, source_types = cached
+    positions = {name: i for i, name in enumerate(matrix.index)}
+    new_key = list(matrix_key)
+    for update in updates:
+        i = positions.get(update.use_case)
+        if i is None or new_key[i] != update.old_key:
+            return
+        new_key[i] = update.new_key
+    matrix = matrix.copy()
+    changes = [(update.use_case, update.previous, update.updated) for update in updates]
+    if update_contribution_matrix(matrix, snapshot, node_id, changes):
+        st.session_state.contribution_matrix = (tuple(new_key), matrix, source_types)
+
+def record_current_edit(group, mode_name, node_id, widget_key):
+    """Component Management 電流輸入框的 on_change：立即寫回 operating_modes 並記錄這次修改"""
+    currents = st.session_state.operating_modes[group][mode_name].setdefault('currents_uA', {})
+    old_current_uA = currents.get(node_id)
+    currents[node_id] = st.session_state[widget_key]
+    st.session_state.setdefault('pending_current_edits', []).append(
+        (group, mode_name, node_id, old_current_uA, currents[node_id])
+    )
 
-    # --- 3. GroupBy (現在加總所有類型) ---
-    # 我們需要加總 Component Load (依群組) 和 Quiescent Loss (依節點)
-    df_components = df[df['type'] == 'Component Load']
-    df_losses = df[df['type'] == 'Quiescent Loss'] # 只選 Iq Loss
-    
-    if not df_components.empty:
-        df_components_grouped = df_components.groupby('source').agg(
-            power_mW=('power_mW', 'sum'),
-            type=('type', 'first')
-        ).reset_index()
-    else:
-        df_components_grouped = pd.DataFrame(columns=['source', 'power_mW', 'type'])
-    
-    # 將加總後的 Component 和「所有獨立的 Iq 損耗項」重新組合
-    final_df = pd.concat([df_components_grouped, df_losses], ignore_index=True)
-    
-    return final_df
+@profiling.instrument()
+def calculate_power(use_case_name_override=None, snapshot=None):
+    """計算單一 Use Case 並回傳 PowerResult (不會修改 session_state 中的節點 dict)"""
+    use_case_name = use_case_name_override or resolve_active_use_case()
+    snapshot = snapshot or get_model_snapshot()
+    return get_use_case_results([use_case_name], snapshot)[use_case_name]
 
-def calculate_average_profile_breakdown(profile_name):
+
+@profiling.instrument()
+def get_use_case_contribution_matrix(snapshot):
+    """
+    所有 Use Case 的 (use case × 貢獻來源) Vsys 功耗矩陣 (見 power_report.contribution_matrix)。
+    以所有 Use Case 的快取 key 判斷是否需要重建，因此切換 Profile 時直接重用；
+    單一電流修改由 update_cached_contribution_matrix 就地更新，key 也會一起更新。
+    """
+    use_case_names = list(snapshot.use_cases.keys())
+    digests = get_result_cache().digests
+    matrix_key = tuple(digests.use_case_key(snapshot, name) for name in use_case_names)
+    cached = st.session_state.get('contribution_matrix')
+    if cached is not None and cached[0] == matrix_key:
+        return cached[1], cached[2]
+
+    matrix, source_types = contribution_matrix(snapshot, get_use_case_results(use_case_names, snapshot), backend=get_execution_backend())
+    st.session_state.contribution_matrix = (matrix_key, matrix, source_types)
+    return matrix, source_types
+
+@profiling.instrument()
+def calculate_average_profile_breakdown(profile_name, snapshot=None):
     """
     計算一個 User Profile 的「加權平均」元件功耗佔比。
     """
     if profile_name not in st.session_state.user_profiles:
         return pd.DataFrame(columns=["source", "power_mW", "type"])
-    
-    profile_data = st.session_state.user_profiles[profile_name]
-    total_seconds = sum(profile_data.values())
-    if total_seconds == 0:
-        total_seconds = 86400 # 避免除以零
 
-    total_contributions = defaultdict(float)
-    contribution_types = {} # 用來儲存 "Component Load" vs "Quiescent Loss"
+    snapshot = snapshot or get_model_snapshot()
+    matrix, source_types = get_use_case_contribution_matrix(snapshot)
+    return profile_breakdown(matrix, source_types, st.session_state.user_profiles[profile_name])
 
-    # 1. 遍歷 Profile 中的所有 Use Case 及其秒數
-    for uc_name, seconds in profile_data.items():
-        if seconds <= 0:
+def normalize_use_case_settings(uc_settings, all_comp_groups, all_ps_nodes):
+    """
+    讓 Use Case 的設定與目前定義的模式一致：
+    補上缺少的 component mode (ratio 0)、移除已不存在的 mode，
+    電源模式不存在時改用該電源的第一個模式。
+    """
+    components = uc_settings.setdefault("components", {})
+    for group in all_comp_groups:
+        group_modes = list(st.session_state.operating_modes.get(group, {}).keys())
+        if not group_modes:
             continue
-        
-        # 2. 呼叫 calculate_power() 來為「這一個」Use Case 設定 power_tree 狀態
-        # (注意：這會呼叫 apply_use_case)
-        calculate_power(use_case_name_override=uc_name)
-        
-        # 3. 取得「這一個」Use Case 的功耗分佈
-        df_uc_breakdown = get_vsys_referred_power_contributions(st.session_state.power_tree_data['nodes'])
-        
-        # 4. 計算此 Use Case 中，每個元件貢獻的「能量」(mW-s)，並加總
-        for _, row in df_uc_breakdown.iterrows():
-            source_name = row['source']
-            power_mW = row['power_mW']
-            energy_mW_s = power_mW * seconds # (功耗 * 時間 = 能量)
-            
-            total_contributions[source_name] += energy_mW_s
-            
-            if source_name not in contribution_types:
-                contribution_types[source_name] = row['type']
-
-    if not total_contributions:
-         return pd.DataFrame(columns=["source", "power_mW", "type"])
-
-    # 5. 將總能量 (mW-s) 除以總時間 (s)，換算回「平均功耗 (mW)」
-    avg_contributions_data = []
-    for source, total_energy in total_contributions.items():
-        avg_power = total_energy / total_seconds
-        avg_contributions_data.append({
-            "source": source,
-            "power_mW": avg_power,
-            "type": contribution_types.get(source, "Unknown")
-        })
-        
-    return pd.DataFrame(avg_contributions_data)
+        current_ratios = components.get(group, {})
+        for mode in group_modes:
+            if mode not in current_ratios: current_ratios[mode] = 0
+        for mode in list(current_ratios.keys()):
+            if mode not in group_modes: del current_ratios[mode]
+        components[group] = current_ratios
+
+    power_sources = uc_settings.setdefault("power_sources", {})
+    for ps_node in all_ps_nodes:
+        ps_modes = list(st.session_state.power_source_modes.get(ps_node['id'], {}).keys())
+        if ps_modes:
+            current_ps_mode = power_sources.get(ps_node['id'], "On")
+            power_sources[ps_node['id']] = current_ps_mode if current_ps_mode in ps_modes else ps_modes[0]
+
+def render_sweep_parameter_inputs(key_prefix, snapshot):
+    """Parameter Sweep 的參數選擇與範圍輸入，回傳 SweepParameter (無法建立時回傳 None)"""
+    kind = st.selectbox("Parameter", options=list(PARAMETER_KINDS), format_func=PARAMETER_KINDS.get, key=f"{key_prefix}_kind")
+    target = ()
+    if kind == 'battery_capacity':
+        current_value = float(st.session_state.battery_capacity_mAh)
+    elif kind == 'power_source':
+        ps_nodes = sorted([n for n in snapshot.nodes if n['type'] == 'power_source'], key=lambda x: x['label'])
+        labels = {n['id']: n['label'] for n in ps_nodes}
+        col1, col2, col3 = st.columns(3)
+        ps_id = col1.selectbox("Power Source", options=list(labels), format_func=labels.get, key=f"{key_prefix}_ps")
+        ps_modes = snapshot.power_source_modes.get(ps_id, {})
+        if not ps_modes:
+            st.info("此電源沒有定義模式。")
+            return None
+        mode_name = col2.selectbox("Mode", options=list(ps_modes), key=f"{key_prefix}_ps_mode")
+        field_name = col3.selectbox("Field", options=list(POWER_SOURCE_FIELDS), key=f"{key_prefix}_ps_field")
+        target = (ps_id, mode_name, field_name)
+        current_value = float(ps_modes[mode_name].get(field_name, 0.0))
+    else:
+        groups = [g for g, modes in snapshot.operating_modes.items() if modes]
+        if not groups:
+            st.info("沒有可掃描的 Operating Mode。")
+            return None
+        col1, col2, col3 = st.columns(3)
+        group = col1.selectbox("Component Group", options=groups, key=f"{key_prefix}_group")
+        mode_name = col2.selectbox("Mode", options=list(snapshot.operating_modes[group]), key=f"{key_prefix}_mode")
+        group_nodes = sorted([n for n in snapshot.nodes if n['type'] == 'component' and n['group'] == group], key=lambda x: x['endpoint'])
+        if not group_nodes:
+            st.info("此群組沒有元件。")
+            return None
+        endpoints = {n['id']: n['endpoint'] for n in group_nodes}
+        node_id = col3.selectbox("Component", options=list(endpoints), format_func=endpoints.get, key=f"{key_prefix}_node")
+        target = (group, mode_name, node_id)
+        current_value = float(snapshot.operating_modes[group][mode_name].get('currents_uA', {}).get(node_id, 0.0))
+
+    # 預設範圍：目前數值的 ±20% (效率上限為 1.0)
+    default_stop = current_value * 1.2 if current_value > 0 else 1.0
+    if kind == 'power_source' and target[2] == 'efficiency':
+        default_stop = min(default_stop, 1.0)
+    col1, col2, col3 = st.columns(3)
+    start = col1.number_input("Start", value=current_value * 0.8, format="%.4f", key=f"{key_prefix}_start_{kind}_{target}")
+    stop = col2.number_input("Stop", value=default_stop, format="%.4f", key=f"{key_prefix}_stop_{kind}_{target}")
+    steps = col3.number_input("Steps", min_value=2, max_value=5000, value=50, step=1, key=f"{key_prefix}_steps")
+    return SweepParameter(kind, sweep_values(start, stop, steps), target)
 
 # ===============================================================
 #  側邊欄 UI (Sidebar UI)
 # ===============================================================
-with st.sidebar:
+with st.sidebar, profiling.span("Sidebar", "tab"):
     
     components.html(
     """
@@ -567,29 +629,25 @@ with st.sidebar:
         st.session_state.theme = selected_theme
         st.rerun()
 
+    with st.expander("Debug", expanded=False):
+        st.checkbox(
+            "Profiling", key="profiling_enabled",
+            help="記錄每次 rerun 中各 tab 與核心函數的時間與呼叫次數 (從下一次 rerun 開始)。"
+        )
+        profiling_panel = st.empty()
+
+    st.number_input(
+        "Worker Processes", min_value=1, max_value=256, value=default_workers(), step=1, key="compute_workers",
+        help="大型模型的批次計算、Sweep 與 Monte Carlo 使用的 process 數；計算量小時一律在目前的 process 中執行。"
+    )
+
     st.markdown("---")
     st.header("設定檔管理")
 
     with st.expander("儲存目前設定", expanded=False):
-        state_to_save = {
-            'power_tree_data': st.session_state.power_tree_data,
-            'max_id': st.session_state.max_id,
-            'group_colors': st.session_state.group_colors,
-            'operating_modes': st.session_state.operating_modes,
-            'power_source_modes': st.session_state.power_source_modes,
-            'use_cases': st.session_state.use_cases,
-            'battery_capacity_mAh': st.session_state.battery_capacity_mAh,
-            'user_profiles': st.session_state.user_profiles,
-            'component_group_notes': st.session_state.component_group_notes,
-            'battery_note': st.session_state.battery_note,
-            'profile_dou_specs': st.session_state.profile_dou_specs # <-- 【新增】 確保 Spec 被儲存
-        }
-        
-        try:
-            json_data = json.dumps(state_to_save, indent=4)
-        except Exception as e:
-            st.error(f"轉換 JSON 失敗: {e}")
-            json_data = "{}"
+        json_data, binary_data, save_error = get_config_downloads()
+        if save_error:
+            st.error(f"轉換 JSON 失敗: {save_error}")
 
         st.download_button(
            label="下載設定檔 (.json)",
@@ -598,36 +656,41 @@ with st.sidebar:
            mime='application/json',
         )
 
+        # 大型設定檔可以改用二進位格式 (檔案約為 JSON 的 1/10，內容與 JSON 完全相同)
+        st.download_button(
+           label="下載二進位設定檔 (.pwrm)",
+           data=binary_data,
+           file_name='power_model_config.pwrm',
+           mime='application/octet-stream',
+        )
+
     with st.expander("讀取設定檔", expanded=False):
         uploaded_file = st.file_uploader(
-            "上傳您的 .json 設定檔",
-            type=['json'],
+            "上傳您的 .json / .pwrm 設定檔",
+            type=['json', 'pwrm'],
             key="config_uploader"
         )
         
         if uploaded_file is not None:
             if st.button("確認載入此設定檔"):
                 try:
-                    file_content = uploaded_file.getvalue().decode("utf-8")
-                    loaded_data = json.loads(file_content)
-                    
-                    required_keys = ['power_tree_data', 'user_profiles']
-                    if not (all(key in loaded_data for key in required_keys) and ('device_modes' in loaded_data or 'use_cases' in loaded_data)):
-                        st.error("錯誤：上傳的檔案格式不正確或缺少必要的鍵。")
-                    else:
-                        if 'device_modes' in loaded_data and 'use_cases' not in loaded_data:
-                            loaded_data['use_cases'] = loaded_data.pop('device_modes')
-                            
-                        for key, value in loaded_data.items():
-                            st.session_state[key] = value
-                        
-                        st.session_state.initialized = True 
-                        st.success("設定已成功載入！頁面將自動刷新。")
-                        st.rerun()
+                    loaded_data = parse_config(uploaded_file.getvalue())
+                except ConfigValidationError as e:
+                    st.error(f"錯誤：設定檔有 {len(e.problems)} 個問題，未載入。")
+                    st.markdown("\n".join(f"- {problem}" for problem in e.problems))
+                except ConfigFormatError as e:
+                    st.error(f"錯誤：上傳的檔案格式不正確或缺少必要的鍵。({e})")
                 except json.JSONDecodeError:
                     st.error("錯誤：無法解析 JSON 檔案。請確認檔案內容是否為有效的 JSON 格式。")
                 except Exception as e:
                     st.error(f"讀取檔案時發生錯誤: {e}")
+                else:
+                    for key, value in loaded_data.items():
+                        st.session_state[key] = value
+                    
+                    st.session_state.initialized = True 
+                    st.success("設定已成功載入！頁面將自動刷新。")
+                    st.rerun()
 
 # === 側邊欄結束 ===
 
@@ -637,11 +700,16 @@ with st.sidebar:
 #  主內容頁面 (Main Content)
 # ===============================================================
 
-tabs = st.tabs(["Power Tree", "Component Management", "Power Source Management", "Use Case Management", "Battery Life Estimation", "Profile Breakdown"])
+tabs = st.tabs(["Power Tree", "Component Management", "Power Source Management", "Use Case Management", "Battery Life Estimation", "Profile Breakdown", "Variant Comparison"])
 
-calculate_power(st.session_state.active_use_case)
+cycle_nodes = get_power_tree().find_cycles()
+if cycle_nodes:
+    st.error(f"檢測到循環依賴: {', '.join(cycle_nodes)}")
 
-with tabs[0]:
+model_snapshot = get_model_snapshot()
+active_result = calculate_power(st.session_state.active_use_case, snapshot=model_snapshot)
+
+with tabs[0], profiling.span("Tab: Power Tree", "tab"):
     st.header("Power Consumption Analysis")
     
     st.subheader("Use Case Selection")
@@ -668,14 +736,38 @@ with tabs[0]:
     power_placeholder = st.empty()
     current_placeholder = st.empty()
     
-    with st.expander("Show / Hide Power Tree Visualizer", expanded=False):
+    # on_change="rerun" 讓 .open 反映展開狀態，收合時不需要產生圖表
+    power_tree_expander = st.expander("Show / Hide Power Tree Visualizer", expanded=False, key="power_tree_visualizer", on_change="rerun")
+    with power_tree_expander:
         st.markdown("### Power Tree")
+        # 細節層級：大型 Power Tree 只把有限數量的節點送進 layout engine
+        rail_options = [n['id'] for n in st.session_state.power_tree_data['nodes'] if n['type'] == 'power_source']
+        rail_labels = {n['id']: n['label'] for n in st.session_state.power_tree_data['nodes'] if n['type'] == 'power_source'}
+        lod_cols = st.columns(4)
+        with lod_cols[0]:
+            tree_focus_id = st.selectbox(
+                "Focus Rail", [None] + rail_options,
+                format_func=lambda x: "(All)" if x is None else rail_labels.get(x, x),
+                key="power_tree_focus"
+            )
+        with lod_cols[1]:
+            tree_min_power = st.number_input("Hide Branches Below (mW)", min_value=0.0, value=0.0, step=0.1, format="%.3f", key="power_tree_min_power")
+        with lod_cols[2]:
+            tree_max_nodes = st.number_input("Max Nodes", min_value=1, value=60, step=10, key="power_tree_max_nodes")
+        with lod_cols[3]:
+            tree_collapse_groups = st.checkbox("Collapse Groups", value=False, key="power_tree_collapse_groups")
+        tree_detail = TreeDetail(
+            focus_id=tree_focus_id,
+            collapse_groups=tree_collapse_groups,
+            min_power_mW=tree_min_power,
+            max_nodes=int(tree_max_nodes),
+        )
         graph_placeholder = st.empty()
     
     st.markdown("---")
     st.subheader("Vsys Power Consumption Distribution")
 
-    df_contributions = get_vsys_referred_power_contributions(st.session_state.power_tree_data['nodes'])
+    df_contributions = vsys_referred_contributions(active_result, model_snapshot)
 
     if not df_contributions.empty:
         total_calculated_power = df_contributions['power_mW'].sum()
@@ -737,7 +829,7 @@ with tabs[0]:
         
 
 # --- 【tabs[1]】(【已修改】標籤為 uA，儲存 uA) ---
-with tabs[1]:
+with tabs[1], profiling.span("Tab: Component Management", "tab"):
     st.header("Component Management")
     all_groups = sorted(list(set(n['group'] for n in st.session_state.power_tree_data['nodes'] if n['type'] == 'component')))
     
@@ -788,7 +880,9 @@ with tabs[1]:
                             min_value=0.0,
                             value=current_val_for_widget,
                             key=widget_key,
-                            format="%.3f"
+                            format="%.3f",
+                            on_change=record_current_edit,
+                            args=(selected_group, mode_name, node['id'], widget_key)
                         )
                         
                         mode_data['currents_uA'][node['id']] = st.session_state[widget_key]
@@ -848,6 +942,129 @@ with tabs[1]:
     st.markdown("---")
     st.subheader("Component & Group Settings")
 
+    with st.expander("📥 Bulk Import Currents (CSV / Excel)"):
+        st.caption(f"欄位：{' / '.join(CURRENT_TABLE_COLUMNS)} (Mode Note 可省略)。以 Group + Endpoint 對應元件；不存在的模式會自動建立。")
+        current_table_file = st.file_uploader("上傳量測電流表", type=['csv', 'xlsx'], key="current_table_uploader")
+        if current_table_file is not None and st.button("匯入電流表", key="import_current_table_btn", type="primary"):
+            # 先寫入副本，整份表格都讀取成功後才取代 operating_modes
+            imported_modes = copy.deepcopy(st.session_state.operating_modes)
+            try:
+                import_summary = apply_current_rows(
+                    imported_modes, st.session_state.power_tree_data['nodes'],
+                    read_current_table(current_table_file, current_table_file.name)
+                )
+            except CurrentTableError as e:
+                st.error(f"錯誤：{e}")
+            except Exception as e:
+                st.error(f"讀取電流表時發生錯誤: {e}")
+            else:
+                commit_current_import(imported_modes, import_summary)
+
+        import_summary = st.session_state.get('current_import_summary')
+        if import_summary is not None:
+            st.success(
+                f"已讀取 {import_summary.rows} 列，寫入 {import_summary.updated} 筆電流，"
+                f"新增 {len(import_summary.created_modes)} 個模式。"
+            )
+            if import_summary.created_modes:
+                st.markdown("新增的模式：" + "、".join(f"{group} / {mode}" for group, mode in import_summary.created_modes))
+            if import_summary.unmatched_count:
+                st.warning(f"{import_summary.unmatched_count} 列無法對應，未匯入 (以下最多列出 {len(import_summary.unmatched)} 列)。")
+                st.dataframe(import_summary.unmatched_frame(), width='stretch', hide_index=True)
+            if st.button("清除匯入摘要", key="clear_current_import_summary"):
+                del st.session_state.current_import_summary
+                st.rerun()
+
+    with st.expander("📈 Derive Mode Currents from a Power-Analyzer Trace"):
+        st.caption("分段讀取伺服器上的波形檔 (CSV 或 raw binary，數 GB 也只使用固定記憶體)，依標記的區間計算各模式的平均電流。")
+        trace_path = st.text_input("Trace File Path", key="trace_path", placeholder="/data/captures/run_01.bin")
+        col1, col2, col3 = st.columns(3)
+        trace_format = col1.selectbox("Format", options=list(TRACE_FORMATS), format_func=TRACE_FORMATS.get, key="trace_format")
+        trace_unit = col2.selectbox("Current Unit", options=list(CURRENT_UNITS), key="trace_unit")
+        trace_scale = col3.number_input("Scale (unit per raw value)", value=1.0, format="%.6g", key="trace_scale")
+        col1, col2, col3 = st.columns(3)
+        trace_sample_rate = col1.number_input("Sample Rate (Hz)", min_value=1.0, value=100000.0, step=1000.0, key="trace_sample_rate")
+        if trace_format == 'csv':
+            trace_current_column = col2.text_input("Current Column (空白 = 最後一欄)", key="trace_current_column")
+            trace_time_column = col3.text_input("Time Column (s，空白 = 依取樣率)", key="trace_time_column")
+            trace_source_args = dict(current_column=trace_current_column or None, time_column=trace_time_column or None)
+        else:
+            trace_dtype = col2.selectbox("Sample Type", options=BINARY_DTYPES, index=BINARY_DTYPES.index('float32'), key="trace_dtype")
+            trace_header = col3.number_input("Header Bytes", min_value=0, value=0, step=1, key="trace_header_bytes")
+            col1, col2, col3 = st.columns(3)
+            trace_channels = col1.number_input("Interleaved Channels", min_value=1, value=1, step=1, key="trace_channels")
+            trace_channel = col2.number_input("Channel", min_value=0, max_value=int(trace_channels) - 1, value=0, step=1, key="trace_channel")
+            trace_little_endian = col3.checkbox("Little Endian", value=True, key="trace_little_endian")
+            trace_source_args = dict(
+                dtype=trace_dtype, header_bytes=int(trace_header), channels=int(trace_channels),
+                channel=int(trace_channel), little_endian=trace_little_endian,
+            )
+
+        trace_groups = sorted(set(n['group'] for n in st.session_state.power_tree_data['nodes'] if n['type'] == 'component'))
+        col1, col2 = st.columns(2)
+        trace_group = col1.selectbox("Component Group", options=trace_groups, key="trace_group")
+        trace_endpoints = [n['endpoint'] for n in st.session_state.power_tree_data['nodes'] if n['type'] == 'component' and n.get('group') == trace_group]
+        trace_endpoint = col2.selectbox("Endpoint (量測的電源端點)", options=trace_endpoints, key="trace_endpoint")
+
+        st.markdown("###### Mode Intervals")
+        new_trace_modes = st.text_input("新模式名稱 (以逗號分隔，加入下表可選的模式；寫入時自動建立)", key="trace_new_modes")
+        trace_mode_options = list(st.session_state.operating_modes.get(trace_group, {})) + [
+            name.strip() for name in new_trace_modes.split(",") if name.strip()
+        ]
+        df_trace_intervals = st.data_editor(
+            pd.DataFrame(columns=["Mode Name", "Start (s)", "End (s)"]).astype({"Mode Name": str, "Start (s)": float, "End (s)": float}),
+            key="trace_interval_editor",
+            num_rows="dynamic",
+            hide_index=True,
+            column_config={
+                "Mode Name": st.column_config.SelectboxColumn(options=trace_mode_options),
+                "Start (s)": st.column_config.NumberColumn(min_value=0.0, format="%.6g"),
+                "End (s)": st.column_config.NumberColumn(min_value=0.0, format="%.6g"),
+            },
+        )
+        trace_intervals = [
+            TraceInterval(str(row[0]).strip(), float(row[1]), float(row[2]))
+            for row in df_trace_intervals.dropna().itertuples(index=False)
+            if str(row[0]).strip() and row[2] > row[1]
+        ]
+        trace_window_s = st.number_input("Averaging Window (s)", min_value=1e-4, value=1.0, format="%.4g", key="trace_window_s")
+
+        col1, col2 = st.columns(2)
+        analyze_trace = col1.button("Analyze Trace", key="trace_analyze_btn")
+        write_trace = col2.button("Write Mode Currents", key="trace_write_btn", type="primary", disabled=not trace_intervals)
+        if (analyze_trace or write_trace) and trace_path:
+            trace_source = TraceSource(
+                trace_path, trace_format, trace_sample_rate, trace_unit, trace_scale, **trace_source_args
+            )
+            try:
+                with st.spinner("讀取波形中..."):
+                    trace_scan = scan_trace(trace_source, trace_intervals, window_s=trace_window_s if analyze_trace else None)
+            except (OSError, ValueError) as e:
+                st.error(f"讀取波形失敗: {e}")
+            else:
+                df_trace_modes = mode_current_table(
+                    trace_scan, trace_intervals, trace_group, trace_endpoint, note=f"Trace: {Path(trace_path).name}"
+                )
+                if write_trace:
+                    imported_modes = copy.deepcopy(st.session_state.operating_modes)
+                    commit_current_import(imported_modes, apply_current_rows(
+                        imported_modes, st.session_state.power_tree_data['nodes'], [df_trace_modes]
+                    ))
+                st.markdown(
+                    f"{trace_scan.n_samples:,} samples，{trace_scan.start_s:.6g} s ~ {trace_scan.end_s:.6g} s"
+                )
+                if trace_scan.windows is not None and not trace_scan.windows.empty:
+                    st.altair_chart(
+                        alt.Chart(trace_scan.windows).mark_line().encode(
+                            x=alt.X("Time (s):Q"),
+                            y=alt.Y("Avg. Current (uA):Q", scale=alt.Scale(type="symlog")),
+                            tooltip=["Time (s)", alt.Tooltip("Avg. Current (uA):Q", format=".3f"), "Samples"],
+                        ).properties(height=300),
+                        use_container_width=True,
+                    )
+                if not df_trace_modes.empty:
+                    st.dataframe(df_trace_modes, width='stretch', hide_index=True)
+
     with st.expander("➕ Add New Component"):
         with st.form(key="add_comp_form", clear_on_submit=True):
             new_group = st.text_input("元件群組名稱", "New Group")
@@ -885,7 +1102,7 @@ with tabs[1]:
                     if new_group not in uc["components"]:
                         uc["components"][new_group] = {"Default": 100}
                 
-                st.session_state.power_tree_data['nodes'].append(new_node_data)
+                get_power_tree().add_node(new_node_data)
                 st.session_state.max_id += 1
                 st.success(f"已新增元件: {new_group} - {new_endpoint}")
                 st.rerun()
@@ -920,8 +1137,7 @@ with tabs[1]:
                 # --- 【已移除】「'Default' 模式電流」的相關邏輯 ---
 
                 if st.button("更新元件", key=f"update_comp_{selected_node_id}"):
-                    node_to_edit['endpoint'] = edited_endpoint
-                    node_to_edit['input_source_id'] = selected_ps_id_edit
+                    get_power_tree().update_node(selected_node_id, endpoint=edited_endpoint, input_source_id=selected_ps_id_edit)
                     
                     # --- 【已移除】更新 Default 電流的邏輯 ---
 
@@ -1000,7 +1216,7 @@ with tabs[1]:
                             new_node['group'] = new_group_name
                             new_nodes.append(new_node)
                         
-                        st.session_state.power_tree_data['nodes'].extend(new_nodes)
+                        get_power_tree().add_nodes(new_nodes)
 
                         modes_to_clone = copy.deepcopy(st.session_state.operating_modes.get(group_to_clone, {}))
                         new_op_modes = {}
@@ -1033,7 +1249,7 @@ with tabs[1]:
                         st.error(f"An error occurred during cloning: {e}")
 
 # --- 【tabs[2]】(【已修改】標籤為 uA) ---
-with tabs[2]:
+with tabs[2], profiling.span("Tab: Power Source Management", "tab"):
     st.header("Power Source Management")
     all_power_sources = sorted([n for n in st.session_state.power_tree_data['nodes'] if n['type'] == 'power_source'], key=lambda x: x['label'])
     
@@ -1065,6 +1281,9 @@ with tabs[2]:
                 key_eff = f"psm_eff_{selected_ps_id}_{mode_name}"
                 key_iq = f"psm_iq_{selected_ps_id}_{mode_name}"
                 key_note = f"psm_note_{selected_ps_id}_{mode_name}"
+                key_curve_on = f"psm_curve_on_{selected_ps_id}_{mode_name}"
+                key_curve = f"psm_curve_{selected_ps_id}_{mode_name}"
+                key_curve_base = f"psm_curve_base_{selected_ps_id}_{mode_name}"
 
                 if is_off_mode := params.get('output_voltage') == 0 and params.get('efficiency') == 0:
                     st.text_input("Output Voltage (V)", value="0.0 (Off)", disabled=True, key=key_v)
@@ -1087,6 +1306,38 @@ with tabs[2]:
                     params['output_voltage'] = st.session_state[key_v]
                     params['efficiency'] = st.session_state[key_eff] / 100.0
                     params['quiescent_current_uA'] = st.session_state[key_iq] # <-- 已修改
+
+                    # 效率隨負載變化：勾選後以曲線取代上面的固定效率 (輸出電流取 log 後線性內插)
+                    use_curve = st.checkbox(
+                        "Load-dependent efficiency curve", value=bool(params.get(EFFICIENCY_CURVE_KEY)), key=key_curve_on,
+                        help="效率依輸出電流查表 (電流軸為對數刻度，超出範圍時取端點)；上面的固定效率只在 Sweep / Monte Carlo 中作為整條曲線的基準。"
+                    )
+                    if use_curve:
+                        if key_curve_base not in st.session_state:
+                            curve_points = params.get(EFFICIENCY_CURVE_KEY) or [[0.01, params['efficiency']], [100.0, params['efficiency']]]
+                            st.session_state[key_curve_base] = pd.DataFrame(
+                                [(current_mA, efficiency * 100.0) for current_mA, efficiency in curve_points],
+                                columns=["Output Current (mA)", "Efficiency (%)"]
+                            )
+                        df_curve_edit = st.data_editor(
+                            st.session_state[key_curve_base],
+                            key=key_curve,
+                            num_rows="dynamic",
+                            hide_index=True,
+                            column_config={
+                                "Output Current (mA)": st.column_config.NumberColumn(min_value=0.0, format="%.4g"),
+                                "Efficiency (%)": st.column_config.NumberColumn(min_value=0.1, max_value=100.0, format="%.1f"),
+                            },
+                        )
+                        curve_points = [[float(current_mA), float(efficiency) / 100.0] for current_mA, efficiency in df_curve_edit.dropna().to_numpy()]
+                        if curve_points:
+                            params[EFFICIENCY_CURVE_KEY] = sorted(curve_points)
+                        else:
+                            st.warning("效率曲線沒有任何點，使用固定效率。")
+                            params.pop(EFFICIENCY_CURVE_KEY, None)
+                    else:
+                        params.pop(EFFICIENCY_CURVE_KEY, None)
+                        st.session_state.pop(key_curve_base, None)
                 
                 current_note_val = params.get("note", "")
                 st.text_area("Note", value=current_note_val, key=key_note)
@@ -1104,7 +1355,7 @@ with tabs[2]:
                                 if uc.get("power_sources", {}).get(selected_ps_id) == mode_name:
                                     uc["power_sources"][selected_ps_id] = new_name
                             
-                            old_keys = [key_v, key_eff, key_iq, key_note]
+                            old_keys = [key_v, key_eff, key_iq, key_note, key_curve_on, key_curve, key_curve_base]
                             for k in old_keys:
                                 if k in st.session_state: del st.session_state[k]
                             st.rerun()
@@ -1119,7 +1370,7 @@ with tabs[2]:
                                     uc["power_sources"][selected_ps_id] = fallback_mode
                             del st.session_state.power_source_modes[selected_ps_id][mode_name]
                             
-                            old_keys = [key_v, key_eff, key_iq, key_note]
+                            old_keys = [key_v, key_eff, key_iq, key_note, key_curve_on, key_curve, key_curve_base]
                             for k in old_keys:
                                 if k in st.session_state: del st.session_state[k]
                             st.rerun()
@@ -1172,7 +1423,7 @@ with tabs[2]:
                     if new_id not in uc["power_sources"]:
                         uc["power_sources"][new_id] = "On"
                 
-                st.session_state.power_tree_data['nodes'].append(new_node_data)
+                get_power_tree().add_node(new_node_data)
                 st.session_state.max_id += 1
                 st.success(f"已新增電源: {new_label}")
                 st.rerun()
@@ -1220,20 +1471,25 @@ with tabs[2]:
                 st.number_input("靜態電流 (uA)", min_value=0.0, format="%.3f", key=key_edit_iq) # <-- 已修改
 
                 if st.button("更新電源", key=f"update_ps_{selected_node_id}"):
-                    node_to_edit['label'] = edited_label
-                    node_to_edit['input_source_id'] = selected_ups_id_edit if selected_ups_id_edit else None
+                    get_power_tree().update_node(
+                        selected_node_id,
+                        label=edited_label,
+                        input_source_id=selected_ups_id_edit if selected_ups_id_edit else None
+                    )
                     
                     edited_output_voltage = st.session_state[key_edit_v]
                     edited_efficiency_percent = st.session_state[key_edit_eff]
                     edited_quiescent_current = st.session_state[key_edit_iq] # <-- 已修改
 
-                    existing_on_note = st.session_state.power_source_modes.get(selected_node_id, {}).get("On", {}).get("note", "")
+                    existing_on_mode = st.session_state.power_source_modes.get(selected_node_id, {}).get("On", {})
                     st.session_state.power_source_modes[selected_node_id]["On"] = {
                         "output_voltage": edited_output_voltage,
                         "efficiency": edited_efficiency_percent / 100.0,
                         "quiescent_current_uA": edited_quiescent_current, # <-- 已修改
-                        "note": existing_on_note
+                        "note": existing_on_mode.get("note", "")
                     }
+                    if existing_on_mode.get(EFFICIENCY_CURVE_KEY):
+                        st.session_state.power_source_modes[selected_node_id]["On"][EFFICIENCY_CURVE_KEY] = existing_on_mode[EFFICIENCY_CURVE_KEY]
                     
                     if "Off" in st.session_state.power_source_modes[selected_node_id]:
                         st.session_state.power_source_modes[selected_node_id]["Off"]["quiescent_current_uA"] = edited_quiescent_current # <-- 已修改
@@ -1248,126 +1504,133 @@ with tabs[2]:
             st.info("沒有可編輯的電源。")
 
 # --- 【tabs[3]】(Use Case Management) (保持不變) ---
-with tabs[3]:
+with tabs[3], profiling.span("Tab: Use Case Management", "tab"):
     st.header("Use Case Management")
     
     st.subheader("Edit Use Cases")
     num_use_cases = len(st.session_state.use_cases)
-    
-    for uc_name, uc_settings in list(st.session_state.use_cases.items()):
-        with st.expander(f"{uc_name}", expanded=False):
-            
-            st.markdown("#### Component Settings")
-            all_comp_groups = sorted(list(st.session_state.operating_modes.keys()))
-            
-            for group in all_comp_groups:
-                
-                group_modes = list(st.session_state.operating_modes.get(group, {}).keys())
-                if not group_modes:
-                    st.warning(f"'{group}' 尚未在 ] 中定義任何 Component Mode。")
-                    continue
-                
-                current_ratios = uc_settings.get("components", {}).get(group, {})
-                
-                with st.expander(f"**{group}**"):
-                
-                    for mode in group_modes:
-                        if mode not in current_ratios: current_ratios[mode] = 0
-                    for mode in list(current_ratios.keys()):
-                        if mode not in group_modes: del current_ratios[mode]
-                    
-                    for mode_name in group_modes:
-                        left_column, _ = st.columns([1, 3]) 
-                        with left_column:
-                            sub_col1, sub_col2, sub_col3 = st.columns([2, 1, 1])
-                            with sub_col1:
-                                st.markdown(f"<p style='padding-top: 8px; padding-left: 20px;'>{mode_name}</p>", unsafe_allow_html=True)
-                            with sub_col2:
-                                current_ratios[mode_name] = st.number_input(
-                                    f"Ratio for {mode_name}", min_value=0, max_value=100, 
-                                    value=current_ratios.get(mode_name, 0),
-                                    step=1, key=f"uc_ratio_{uc_name}_{group}_{mode_name}", label_visibility="collapsed"
-                                )
-                            with sub_col3:
-                                st.markdown("<p style='padding-top: 8px;'>%</p>", unsafe_allow_html=True)
-                    
-                    uc_settings["components"][group] = current_ratios
-
-            st.markdown("---")
-            st.markdown("#### Power Source Settings")
-            all_ps_nodes = sorted([n for n in st.session_state.power_tree_data['nodes'] if n['type'] == 'power_source'], key=lambda x: x['label'])
-            for ps_node in all_ps_nodes:
-                ps_modes = list(st.session_state.power_source_modes.get(ps_node['id'], {}).keys())
-                current_ps_mode = uc_settings.get("power_sources", {}).get(ps_node['id'], "On")
-                idx = ps_modes.index(current_ps_mode) if current_ps_mode in ps_modes else 0
-                
+    all_comp_groups = sorted(list(st.session_state.operating_modes.keys()))
+    all_ps_nodes = sorted([n for n in st.session_state.power_tree_data['nodes'] if n['type'] == 'power_source'], key=lambda x: x['label'])
+
+    # 讓每個 Use Case 的 ratio / 電源模式與目前定義的模式一致 (只處理資料，不建立 widget)
+    for uc_settings in st.session_state.use_cases.values():
+        normalize_use_case_settings(uc_settings, all_comp_groups, all_ps_nodes)
+
+    # 只為正在編輯的 Use Case 建立 widget，widget 數量不會隨 Use Case 數量增加
+    uc_names = list(st.session_state.use_cases.keys())
+    pending_uc = st.session_state.pop('uc_editor_pending', None)
+    if pending_uc in uc_names:
+        st.session_state.uc_editor_selector = pending_uc
+    elif st.session_state.get('uc_editor_selector') not in uc_names:
+        st.session_state.uc_editor_selector = st.session_state.get('active_use_case', uc_names[0])
+    uc_name = st.selectbox("Select Use Case to Edit", options=uc_names, key="uc_editor_selector")
+    uc_settings = st.session_state.use_cases[uc_name]
+
+    with st.container(border=True):
+        st.markdown("#### Component Settings")
+        missing_mode_groups = [g for g in all_comp_groups if not st.session_state.operating_modes.get(g)]
+        if missing_mode_groups:
+            st.warning(f"以下群組尚未定義任何 Component Mode: {', '.join(missing_mode_groups)}")
+
+        ratio_rows = [
+            {"Group": group, "Mode": mode_name, "Ratio (%)": uc_settings["components"][group][mode_name]}
+            for group in all_comp_groups
+            for mode_name in st.session_state.operating_modes.get(group, {})
+        ]
+        df_ratios = pd.DataFrame(ratio_rows, columns=["Group", "Mode", "Ratio (%)"])
+        edited_ratios = st.data_editor(
+            df_ratios,
+            key=f"uc_ratio_editor_{uc_name}",
+            width='stretch',
+            hide_index=True,
+            disabled=["Group", "Mode"],
+            column_config={
+                "Ratio (%)": st.column_config.NumberColumn("Ratio (%)", min_value=0, max_value=100, format="%g")
+            }
+        )
+        # 只寫回使用者改過的格子，讀入的小數比例 (例如 33.3) 不會在打開分頁時被改寫
+        for row, ratio in zip(ratio_rows, edited_ratios["Ratio (%)"]):
+            ratio = 0 if pd.isna(ratio) else ratio
+            if ratio != row["Ratio (%)"]:
+                uc_settings["components"][row["Group"]][row["Mode"]] = int(ratio) if float(ratio).is_integer() else float(ratio)
+
+        st.markdown("---")
+        st.markdown("#### Power Source Settings")
+        ps_columns = st.columns(3)
+        for i, ps_node in enumerate(all_ps_nodes):
+            ps_modes = list(st.session_state.power_source_modes.get(ps_node['id'], {}).keys())
+            current_ps_mode = uc_settings.get("power_sources", {}).get(ps_node['id'], "On")
+            idx = ps_modes.index(current_ps_mode) if current_ps_mode in ps_modes else 0
+
+            with ps_columns[i % 3]:
                 selected_ps_mode = st.selectbox(
                     f"{ps_node['label']}", options=ps_modes, index=idx, key=f"uc_ps_select_{uc_name}_{ps_node['id']}"
                 )
-                uc_settings["power_sources"][ps_node['id']] = selected_ps_mode
-            
-            
-            st.markdown("---") 
-            if st.button(f"Clone this Use Case", key=f"clone_uc_{uc_name}", type="secondary"):
-                new_uc_name = f"{uc_name} (Copy)"
-                counter = 2
-                while new_uc_name in st.session_state.use_cases:
-                    new_uc_name = f"{uc_name} (Copy {counter})"
-                    counter += 1
-                new_uc_settings = copy.deepcopy(uc_settings)
-                st.session_state.use_cases[new_uc_name] = new_uc_settings
-                for profile in st.session_state.user_profiles.values():
-                    profile[new_uc_name] = 0
-                st.success(f"Cloned '{uc_name}' to '{new_uc_name}'.")
-                st.rerun()
+            uc_settings["power_sources"][ps_node['id']] = selected_ps_mode
+
+        st.markdown("---") 
+        if st.button(f"Clone this Use Case", key=f"clone_uc_{uc_name}", type="secondary"):
+            new_uc_name = f"{uc_name} (Copy)"
+            counter = 2
+            while new_uc_name in st.session_state.use_cases:
+                new_uc_name = f"{uc_name} (Copy {counter})"
+                counter += 1
+            new_uc_settings = copy.deepcopy(uc_settings)
+            st.session_state.use_cases[new_uc_name] = new_uc_settings
+            for profile in st.session_state.user_profiles.values():
+                profile[new_uc_name] = 0
+            st.session_state.uc_editor_pending = new_uc_name
+            st.success(f"Cloned '{uc_name}' to '{new_uc_name}'.")
+            st.rerun()
 
-            
-            st.markdown("---")
-            st.markdown("##### Rename this Use Case")
-            
-            col1, col2 = st.columns([3, 1])
-            with col1:
-                new_uc_name_input = st.text_input(
-                    "New use case name", 
-                    value=uc_name, 
-                    key=f"rename_uc_text_{uc_name}",
-                    label_visibility="collapsed"
-                )
-            with col2:
-                if st.button("Rename", key=f"rename_uc_btn_{uc_name}"):
-                    if new_uc_name_input == uc_name:
-                        st.toast("Name is the same.")
-                    elif new_uc_name_input in st.session_state.use_cases:
-                        st.error(f"Error: The name '{new_uc_name_input}' already exists.")
-                    else:
-                        st.session_state.use_cases[new_uc_name_input] = st.session_state.use_cases.pop(uc_name)
-                        
-                        for profile in st.session_state.user_profiles.values():
-                            if uc_name in profile:
-                                profile[new_uc_name_input] = profile.pop(uc_name)
-                        
-                        if st.session_state.active_use_case == uc_name:
-                            st.session_state.active_use_case = new_uc_name_input
-                        
-                        st.success(f"Renamed '{uc_name}' to '{new_uc_name_input}'.")
-                        st.rerun()
+        
+        st.markdown("---")
+        st.markdown("##### Rename this Use Case")
+        
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            new_uc_name_input = st.text_input(
+                "New use case name", 
+                value=uc_name, 
+                key=f"rename_uc_text_{uc_name}",
+                label_visibility="collapsed"
+            )
+        with col2:
+            if st.button("Rename", key=f"rename_uc_btn_{uc_name}"):
+                if new_uc_name_input == uc_name:
+                    st.toast("Name is the same.")
+                elif new_uc_name_input in st.session_state.use_cases:
+                    st.error(f"Error: The name '{new_uc_name_input}' already exists.")
+                else:
+                    st.session_state.use_cases[new_uc_name_input] = st.session_state.use_cases.pop(uc_name)
+                    
+                    for profile in st.session_state.user_profiles.values():
+                        if uc_name in profile:
+                            profile[new_uc_name_input] = profile.pop(uc_name)
+                    
+                    if st.session_state.active_use_case == uc_name:
+                        st.session_state.active_use_case = new_uc_name_input
+                    
+                    st.session_state.uc_editor_pending = new_uc_name_input
+                    st.success(f"Renamed '{uc_name}' to '{new_uc_name_input}'.")
+                    st.rerun()
 
-            if num_use_cases > 1:
-                with st.expander(f"🗑️ Delete '{uc_name}'"):
-                    st.warning(f"此操作將永久刪除 '{uc_name}' Use Case，無法復原。")
-                    if st.button(f"確認永久刪除 '{uc_name}'", key=f"del_uc_confirm_{uc_name}", type="primary"):
-                        mode_to_delete = uc_name
-                        
-                        if st.session_state.active_use_case == mode_to_delete:
-                            del st.session_state.use_cases[mode_to_delete]
-                            st.session_state.active_use_case = list(st.session_state.use_cases.keys())[0]
-                        else:
-                            del st.session_state.use_cases[mode_to_delete]
+        if num_use_cases > 1:
+            with st.expander(f"🗑️ Delete '{uc_name}'"):
+                st.warning(f"此操作將永久刪除 '{uc_name}' Use Case，無法復原。")
+                if st.button(f"確認永久刪除 '{uc_name}'", key=f"del_uc_confirm_{uc_name}", type="primary"):
+                    mode_to_delete = uc_name
+                    
+                    if st.session_state.active_use_case == mode_to_delete:
+                        del st.session_state.use_cases[mode_to_delete]
+                        st.session_state.active_use_case = list(st.session_state.use_cases.keys())[0]
+                    else:
+                        del st.session_state.use_cases[mode_to_delete]
 
-                        for profile in st.session_state.user_profiles.values():
-                            if mode_to_delete in profile:
-                                del profile[mode_to_delete]
-                        st.rerun()
+                    for profile in st.session_state.user_profiles.values():
+                        if mode_to_delete in profile:
+                            del profile[mode_to_delete]
+                    st.rerun()
 
     with st.expander("➕ Add New Use Case", expanded=False):
         new_uc_name = st.text_input("New Use Case Name", key="new_uc_name")
@@ -1389,9 +1652,12 @@ with tabs[3]:
                 st.error(f"Use Case '{new_uc_name}' 已存在。")
 
 # --- 【tabs[4]】(【已修改】顯示 uA) ---
-with tabs[4]:
+with tabs[4], profiling.span("Tab: Battery Life Estimation", "tab"):
     st.header("Battery Life Estimation")
 
+    # 前面的 tab 可能已修改模型，這個 tab 與 Profile Breakdown 共用一份更新後的 snapshot
+    model_snapshot = get_model_snapshot()
+
     st.number_input("Battery Capacity (mAh)", min_value=0.0, value=st.session_state.battery_capacity_mAh, key="battery_capacity_input")
     st.session_state.battery_capacity_mAh = st.session_state.battery_capacity_input
 
@@ -1433,30 +1699,15 @@ with tabs[4]:
     st.markdown("---")
     st.subheader("2. Estimation Results Summary")
 
-    power_per_use_case = {uc: calculate_power(use_case_name_override=uc) for uc in st.session_state.use_cases}
-    vsys_node = get_node_by_id("battery")
-    vsys_voltage = vsys_node['output_voltage'] if vsys_node else 3.85
-
-    results_data = []
-    for profile_name, profile_data in st.session_state.user_profiles.items():
-        total_energy_mW_s = sum(power_per_use_case.get(uc_name, 0) * profile_data.get(uc_name, 0) for uc_name, seconds in profile_data.items())
-        total_seconds_in_profile = sum(profile_data.values())
-        
-        avg_power_mW = total_energy_mW_s / total_seconds_in_profile if total_seconds_in_profile > 0 else 0
-        avg_current_mA = avg_power_mW / vsys_voltage if vsys_voltage > 0 else 0
-        
-        if avg_current_mA > 0:
-            battery_life_days = (st.session_state.battery_capacity_mAh / avg_current_mA) / 24
-        else:
-            battery_life_days = 0 
+    # 以批次引擎一次計算所有 Use Case (有快取的 Use Case 不會重算)
+    use_case_results = get_use_case_results(list(st.session_state.use_cases), model_snapshot)
+    power_per_use_case = {uc: result.total_power_mW for uc, result in use_case_results.items()}
+    vsys_voltage = vsys_voltage_of(active_result)
 
-        profile_summary = {
-            "Profile": profile_name,
-            "Battery Life (Days)": battery_life_days,
-            "Avg. Power (mW)": avg_power_mW,
-            "Avg. Current (uA)": avg_current_mA * 1000.0
-        }
-        results_data.append(profile_summary)
+    results_data = [
+        profile_battery_life(profile_name, profile_data, power_per_use_case, st.session_state.battery_capacity_mAh, vsys_voltage)
+        for profile_name, profile_data in st.session_state.user_profiles.items()
+    ]
 
     if results_data:
         df_results = pd.DataFrame(results_data).set_index('Profile')
@@ -1486,6 +1737,259 @@ with tabs[4]:
     else:
         st.info("No User Profiles found. Add one below.")
 
+    st.markdown("---")
+    st.subheader("3. Parameter Sweep")
+
+    with st.expander("Sweep a parameter and plot battery life", expanded=False):
+        sweep_snapshot = model_snapshot
+        sweep_parameters = [render_sweep_parameter_inputs("sweep_1", sweep_snapshot)]
+        if st.checkbox("Add a second parameter (grid)", key="sweep_use_grid"):
+            st.markdown("###### Second Parameter")
+            sweep_parameters.append(render_sweep_parameter_inputs("sweep_2", sweep_snapshot))
+
+        if st.button("Run Sweep", key="run_sweep_btn", type="primary") and all(sweep_parameters):
+            n_points = 1
+            for parameter in sweep_parameters:
+                n_points *= len(parameter.values)
+            if n_points > MAX_SWEEP_POINTS:
+                st.error(f"掃描點數 {n_points} 超過上限 {MAX_SWEEP_POINTS}，請減少 Steps。")
+            else:
+                try:
+                    st.session_state.sweep_result = run_sweep(
+                        sweep_snapshot,
+                        st.session_state.user_profiles,
+                        st.session_state.battery_capacity_mAh,
+                        sweep_parameters,
+                        vsys_use_case=st.session_state.active_use_case,
+                        backend=get_execution_backend(),
+                    )
+                except ValueError as e:
+                    st.error(f"掃描失敗: {e}")
+
+        df_sweep = st.session_state.get('sweep_result')
+        if df_sweep is not None and not df_sweep.empty:
+            param_columns = [c for c in df_sweep.columns if c not in ("Profile", "Avg. Power (mW)", "Battery Life (Days)")]
+            # 參數名稱可能含有 '.' 等 Altair 欄位語法字元，畫圖時改用固定欄位名稱
+            plot_columns = [f"param_{i}" for i in range(len(param_columns))]
+            df_plot = df_sweep.rename(columns=dict(zip(param_columns, plot_columns)))
+            if len(param_columns) == 1:
+                sweep_chart = alt.Chart(df_plot).mark_line().encode(
+                    x=alt.X("param_0:Q", title=param_columns[0]),
+                    y=alt.Y("Battery Life (Days):Q"),
+                    color=alt.Color("Profile:N"),
+                    tooltip=[alt.Tooltip("param_0:Q", title=param_columns[0], format=".4f"), "Profile", alt.Tooltip("Battery Life (Days):Q", format=".2f")]
+                )
+            else:
+                sweep_profile = st.selectbox("Profile", options=list(df_plot["Profile"].unique()), key="sweep_profile")
+                sweep_chart = alt.Chart(df_plot[df_plot["Profile"] == sweep_profile]).mark_rect().encode(
+                    x=alt.X("param_0:O", title=param_columns[0], axis=alt.Axis(format=".3~f")),
+                    y=alt.Y("param_1:O", title=param_columns[1], axis=alt.Axis(format=".3~f")),
+                    color=alt.Color("Battery Life (Days):Q"),
+                    tooltip=[alt.Tooltip(f"{c}:Q", title=t, format=".4f") for c, t in zip(plot_columns, param_columns)] + [alt.Tooltip("Battery Life (Days):Q", format=".2f")]
+                )
+            st.altair_chart(sweep_chart.properties(height=400), use_container_width=True)
+            st.dataframe(df_sweep, width='stretch', hide_index=True)
+
+    st.markdown("---")
+    st.subheader("4. Discharge Simulation")
+
+    with st.expander("Simulate state of charge over days of use", expanded=False):
+        col1, col2, col3 = st.columns(3)
+        sim_days = col1.number_input("Simulated Days", min_value=1.0, max_value=3650.0, value=60.0, step=1.0, key="discharge_days")
+        sim_step_min = col2.number_input("Max Time Step (min)", min_value=1.0, max_value=1440.0, value=10.0, step=1.0, key="discharge_step_min")
+        use_soc_curve = col3.checkbox("Use voltage vs. SOC curve", value=False, key="discharge_use_curve")
+
+        soc_curve = None
+        cutoff_voltage = None
+        if use_soc_curve:
+            df_curve = st.data_editor(
+                pd.DataFrame([(soc * 100.0, voltage) for soc, voltage in DEFAULT_SOC_CURVE], columns=["SOC (%)", "Voltage (V)"]),
+                key="discharge_curve_editor",
+                num_rows="dynamic",
+                hide_index=True,
+                column_config={
+                    "SOC (%)": st.column_config.NumberColumn(min_value=0.0, max_value=100.0, format="%.1f"),
+                    "Voltage (V)": st.column_config.NumberColumn(min_value=0.0, format="%.3f"),
+                },
+            )
+            cutoff_voltage = st.number_input("Cutoff Voltage (V)", min_value=0.0, value=3.5, step=0.05, format="%.2f", key="discharge_cutoff_v")
+            curve_points = df_curve.dropna().to_numpy()
+            try:
+                soc_curve = BatteryCurve.from_points([(soc / 100.0, voltage) for soc, voltage in curve_points])
+            except ValueError as e:
+                st.error(f"電壓曲線錯誤: {e}")
+
+        if st.button("Run Simulation", key="run_discharge_btn", type="primary") and (soc_curve is not None or not use_soc_curve):
+            st.session_state.discharge_result = simulate_discharge(
+                model_snapshot,
+                st.session_state.user_profiles,
+                st.session_state.battery_capacity_mAh,
+                vsys_voltage,
+                curve=soc_curve,
+                cutoff_voltage=cutoff_voltage,
+                max_days=sim_days,
+                max_step_s=sim_step_min * 60.0,
+            )
+
+        discharge_result = st.session_state.get('discharge_result')
+        if discharge_result:
+            flat_life = {row["Profile"]: row["Battery Life (Days)"] for row in results_data}
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        "Profile": name,
+                        "Simulated Days to Cutoff": result.days_to_cutoff,
+                        "Flat-Average Estimate (Days)": flat_life.get(name),
+                        "Final SOC (%)": result.soc[-1] * 100.0,
+                    }
+                    for name, result in discharge_result.items()
+                ]),
+                column_config={
+                    "Simulated Days to Cutoff": st.column_config.NumberColumn(format="%.2f", help="空白表示在模擬期間內沒有到達 cutoff"),
+                    "Flat-Average Estimate (Days)": st.column_config.NumberColumn(format="%.2f"),
+                    "Final SOC (%)": st.column_config.NumberColumn(format="%.1f"),
+                },
+                width='stretch',
+                hide_index=True,
+            )
+            # 每個 Profile 最多畫 2000 個點
+            df_soc = pd.concat([result.to_frame(max_points=2000) for result in discharge_result.values()], ignore_index=True)
+            soc_chart = alt.Chart(df_soc).mark_line().encode(
+                x=alt.X("Time (Days):Q"),
+                y=alt.Y("SOC (%):Q", scale=alt.Scale(domain=[0, 100])),
+                color=alt.Color("Profile:N"),
+                tooltip=["Profile", alt.Tooltip("Time (Days):Q", format=".2f"), alt.Tooltip("SOC (%):Q", format=".1f"), alt.Tooltip("Battery Voltage (V):Q", format=".3f")]
+            )
+            st.altair_chart(soc_chart.properties(height=400), use_container_width=True)
+
+    st.markdown("---")
+    st.subheader("5. Monte Carlo Tolerance Analysis")
+
+    with st.expander("Battery life distribution under part-to-part spread", expanded=False):
+        if 'mc_tolerances' not in st.session_state:
+            st.session_state.mc_tolerances = []
+        mc_snapshot = model_snapshot
+
+        st.markdown("###### Add Tolerance")
+        col1, col2 = st.columns(2)
+        mc_kind = col1.selectbox("Parameter", options=list(TOLERANCE_KINDS), format_func=TOLERANCE_KINDS.get, key="mc_kind")
+        mc_distribution = col2.selectbox("Distribution", options=list(DISTRIBUTIONS), format_func=DISTRIBUTIONS.get, key="mc_distribution")
+        mc_target = None
+        if mc_kind == 'mode_current':
+            mc_all = st.checkbox("All component currents", value=True, key="mc_all_currents")
+            if mc_all:
+                mc_target = ()
+            else:
+                groups = [g for g, modes in mc_snapshot.operating_modes.items() if modes]
+                col1, col2, col3 = st.columns(3)
+                group = col1.selectbox("Component Group", options=groups, key="mc_group") if groups else None
+                if group:
+                    mode_name = col2.selectbox("Mode", options=list(mc_snapshot.operating_modes[group]), key="mc_mode")
+                    endpoints = {n['id']: n['endpoint'] for n in mc_snapshot.nodes if n['type'] == 'component' and n['group'] == group}
+                    node_id = col3.selectbox("Component", options=list(endpoints), format_func=endpoints.get, key="mc_node")
+                    if node_id:
+                        mc_target = (group, mode_name, node_id)
+        else:
+            col1, col2, col3 = st.columns(3)
+            field_name = col1.selectbox("Field", options=list(POWER_SOURCE_FIELDS), key="mc_ps_field")
+            ps_labels = {n['id']: n['label'] for n in mc_snapshot.nodes if n['type'] == 'power_source'}
+            ps_id = col2.selectbox("Power Source", options=[None] + list(ps_labels), format_func=lambda x: "(All)" if x is None else ps_labels[x], key="mc_ps")
+            if ps_id is None:
+                mc_target = (field_name,)
+            elif mc_snapshot.power_source_modes.get(ps_id):
+                mode_name = col3.selectbox("Mode", options=list(mc_snapshot.power_source_modes[ps_id]), key="mc_ps_mode")
+                mc_target = (ps_id, mode_name, field_name)
+
+        col1, col2 = st.columns(2)
+        if mc_distribution == 'min_typ_max':
+            mc_params = (
+                col1.number_input("Min (% below typ)", min_value=0.0, max_value=100.0, value=10.0, step=1.0, key="mc_low"),
+                col2.number_input("Max (% above typ)", min_value=0.0, value=10.0, step=1.0, key="mc_high"),
+            )
+        else:
+            label = "σ (% of typ)" if mc_distribution == 'normal' else "Spread (± % of typ)"
+            mc_params = (col1.number_input(label, min_value=0.0, value=5.0, step=0.5, key="mc_spread"),)
+        if st.button("Add Tolerance", key="mc_add_btn") and mc_target is not None:
+            st.session_state.mc_tolerances.append(Tolerance(mc_kind, mc_distribution, tuple(mc_params), mc_target))
+            st.rerun()
+
+        for i, tolerance in enumerate(st.session_state.mc_tolerances):
+            col1, col2 = st.columns([5, 1])
+            col1.write(tolerance.label)
+            if col2.button("Remove", key=f"mc_remove_{i}"):
+                st.session_state.mc_tolerances.pop(i)
+                st.rerun()
+
+        col1, col2 = st.columns(2)
+        mc_samples = col1.number_input("Samples", min_value=100, max_value=MAX_MC_SAMPLES, value=20000, step=1000, key="mc_samples")
+        mc_seed = col2.number_input("Random Seed", min_value=0, value=0, step=1, key="mc_seed")
+        if st.button("Run Monte Carlo", key="run_mc_btn", type="primary"):
+            if not st.session_state.mc_tolerances:
+                st.warning("請先新增至少一項公差。")
+            else:
+                try:
+                    st.session_state.mc_result = run_monte_carlo(
+                        mc_snapshot,
+                        st.session_state.user_profiles,
+                        st.session_state.battery_capacity_mAh,
+                        st.session_state.mc_tolerances,
+                        mc_samples,
+                        seed=int(mc_seed),
+                        vsys_use_case=st.session_state.active_use_case,
+                        backend=get_execution_backend(),
+                    )
+                except ValueError as e:
+                    st.error(f"Monte Carlo 失敗: {e}")
+
+        df_mc = st.session_state.get('mc_result')
+        if df_mc is not None and not df_mc.empty:
+            st.dataframe(
+                summarize_samples(df_mc, st.session_state.profile_dou_specs).set_index("Profile"),
+                column_config={"Meets DOU Spec": st.column_config.ProgressColumn("Meets DOU Spec", format="%.3f", min_value=0, max_value=1)},
+                width='stretch',
+            )
+            # 直方圖先以 numpy 分箱，只把箱子送到圖表 (不受 Altair 5000 列的限制)
+            mc_chart = alt.Chart(sample_histogram(df_mc)).mark_bar(opacity=0.6).encode(
+                x=alt.X("Battery Life From (Days):Q", title="Battery Life (Days)"),
+                x2="Battery Life To (Days):Q",
+                y=alt.Y("Samples:Q", stack=None),
+                color=alt.Color("Profile:N"),
+                tooltip=["Profile", alt.Tooltip("Battery Life From (Days):Q", format=".2f"), alt.Tooltip("Battery Life To (Days):Q", format=".2f"), "Samples"]
+            )
+            st.altair_chart(mc_chart.properties(height=400), use_container_width=True)
+
+    st.markdown("---")
+    st.subheader("6. Sensitivity Report")
+
+    # on_change="rerun" 讓 .open 反映展開狀態，收合時不計算
+    sensitivity_expander = st.expander("Which currents and efficiencies matter most", expanded=False, key="sensitivity_report", on_change="rerun")
+    with sensitivity_expander:
+        if sensitivity_expander.open:
+            df_sensitivity = get_sensitivity_report(
+                model_snapshot, st.session_state.user_profiles, st.session_state.battery_capacity_mAh, vsys_voltage
+            )
+            col1, col2 = st.columns(2)
+            sens_profiles = col1.multiselect("Profiles", options=list(st.session_state.user_profiles), default=list(st.session_state.user_profiles), key="sens_profiles")
+            sens_kinds = col2.multiselect("Parameters", options=list(df_sensitivity["Parameter"].unique()), default=list(df_sensitivity["Parameter"].unique()), key="sens_kinds")
+            df_sensitivity = df_sensitivity[df_sensitivity["Profile"].isin(sens_profiles) & df_sensitivity["Parameter"].isin(sens_kinds)]
+            st.caption("依「參數增加 1% 時電池壽命的變化」絕對值排序；點選欄位標題可重新排序。")
+            st.dataframe(
+                df_sensitivity,
+                column_config={
+                    "Value": st.column_config.NumberColumn(format="%.4g"),
+                    "d(Days)/d(Value)": st.column_config.NumberColumn(format="%.4g"),
+                    "Days per +1%": st.column_config.NumberColumn(format="%.4f"),
+                },
+                width='stretch',
+                hide_index=True,
+            )
+            st.download_button(
+                label="下載靈敏度報表 (.csv)",
+                data=df_sensitivity.to_csv(index=False).encode("utf-8"),
+                file_name="battery_life_sensitivity.csv",
+                mime="text/csv",
+            )
+
     st.markdown("---")
     st.subheader("Edit Use Case Seconds")
 
@@ -1571,7 +2075,7 @@ with tabs[4]:
 
 
 # --- 【tabs[5]】(新增的 Profile Breakdown) ---
-with tabs[5]:
+with tabs[5], profiling.span("Tab: Profile Breakdown", "tab"):
     st.header("Average Power Breakdown per Profile")
     
     # 1. 讓使用者選擇要分析哪一個 Profile
@@ -1584,7 +2088,7 @@ with tabs[5]:
     
     if selected_profile:
         # 2. 呼叫新函數，計算加權平均
-        df_avg_contributions = calculate_average_profile_breakdown(selected_profile)
+        df_avg_contributions = calculate_average_profile_breakdown(selected_profile, model_snapshot)
         
         # 3. 渲染圖表和表格 (邏輯同 tabs[0])
         if not df_avg_contributions.empty:
@@ -1642,74 +2146,143 @@ with tabs[5]:
             st.info(f"No power consumption data found for profile '{selected_profile}'.")
 
 
+with tabs[6], profiling.span("Tab: Variant Comparison", "tab"):
+    st.header("Variant Comparison")
+    st.caption("一次上傳多份設定檔 (.json / .pwrm)，並排比較電池壽命、Use Case 功耗與各功耗來源，相對於基準版本退步的項目以紅色標示。")
+
+    variant_files = st.file_uploader(
+        "上傳要比較的設定檔", type=['json', 'pwrm'], accept_multiple_files=True, key="variant_uploader"
+    )
+    include_current = st.checkbox("Include the current model as a variant", value=True, key="variant_include_current")
+
+    variant_configs = {}
+    variant_digests = {}
+    if include_current:
+        variant_configs["Current Model"] = get_current_config()
+        variant_digests["Current Model"] = get_current_config_digest(variant_configs["Current Model"])
+    for uploaded in variant_files or []:
+        config, error, digest = parse_variant_upload(uploaded)
+        if error:
+            st.error(f"{uploaded.name}: {error}")
+            continue
+        name = uploaded.name
+        suffix = 2
+        while name in variant_configs:
+            name = f"{uploaded.name} ({suffix})"
+            suffix += 1
+        variant_configs[name] = config
+        variant_digests[name] = digest
+
+    if len(variant_configs) < 2:
+        st.info("至少需要兩個版本才能比較。")
+    else:
+        variant_entries = get_variant_cache().get_reports(
+            variant_configs, backend=get_execution_backend(), digests=variant_digests
+        )
+        variant_reports = {}
+        for name, (report, error) in variant_entries.items():
+            if error:
+                st.error(f"{name}: 計算失敗 ({error})")
+            else:
+                variant_reports[name] = report
+
+        if len(variant_reports) >= 2:
+            col1, col2 = st.columns([2, 1])
+            baseline = col1.selectbox("Baseline", options=list(variant_reports), key="variant_baseline")
+            regression_threshold = col2.number_input(
+                "Highlight changes above (%)", min_value=0.0, value=1.0, step=0.5, key="variant_threshold"
+            ) / 100.0
+
+            st.markdown("##### Biggest Regressions")
+            df_regressions = worst_regressions(variant_reports, baseline, top_n=10)
+            if df_regressions.empty:
+                st.success(f"所有版本都沒有比 '{baseline}' 差的項目。")
+            else:
+                st.dataframe(
+                    df_regressions,
+                    column_config={
+                        "Baseline": st.column_config.NumberColumn(format="%.3f"),
+                        "Value": st.column_config.NumberColumn(format="%.3f"),
+                        "Δ": st.column_config.NumberColumn(format="%+.3f"),
+                        "Δ%": st.column_config.NumberColumn(format="percent"),
+                    },
+                    width='stretch',
+                    hide_index=True,
+                )
+
+            def style_regressions(wide, comparison):
+                """Δ% 超過門檻的儲存格：退步為紅色、改善為綠色"""
+                scores = regression_scores(wide, comparison)
+                styles = pd.DataFrame('', index=wide.index, columns=wide.columns)
+                styles[scores.columns] = scores.map(
+                    lambda score: 'background-color: #D32F2F; color: white;' if score > regression_threshold
+                    else 'background-color: #2E7D32; color: white;' if score < -regression_threshold else ''
+                )
+                return styles
+
+            comparison_titles = {
+                'battery_life': "Battery Life per Profile (Days)",
+                'use_cases': "Total Power per Use Case (mW)",
+                'breakdown': "Average Power per Source and Profile (mW, Vsys-Referred)",
+            }
+            for comparison in COMPARISONS:
+                st.markdown(f"##### {comparison_titles[comparison]}")
+                df_wide = compare_table(variant_reports, baseline, comparison)
+                pct_columns = [c for c in df_wide.columns if c.endswith(DELTA_PCT_SUFFIX)]
+                value_columns = [c for c in df_wide.columns if c not in pct_columns]
+                st.dataframe(
+                    df_wide.style.apply(style_regressions, comparison=comparison, axis=None).format(
+                        {**{c: "{:.3f}" for c in value_columns}, **{c: "{:+.1%}" for c in pct_columns}}, na_rep="-"
+                    ),
+                    width='stretch',
+                )
+
 # ---
 # 在所有狀態更新後，執行最終的計算與渲染
 # ---
-total_power = calculate_power(st.session_state.active_use_case)
+model_snapshot = get_model_snapshot()
+active_result = calculate_power(st.session_state.active_use_case, snapshot=model_snapshot)
+total_power = active_result.total_power_mW
 
 power_placeholder.write(f"<strong>Total System Power:</strong> {total_power:.2f} mW", unsafe_allow_html=True)
-vsys_node = get_node_by_id("battery")
-if vsys_node and vsys_node.get('output_voltage', 0) > 0:
-    current_mA = total_power / vsys_node['output_voltage']
+vsys_voltage = active_result.output_voltage.get("battery", 0)
+if vsys_voltage > 0:
+    current_mA = total_power / vsys_voltage
     # 【已修改】顯示 uA，並顯示到整數
     current_placeholder.write(f"<strong>Total Vsys Current:</strong> {current_mA * 1000.0:.0f} uA", unsafe_allow_html=True)
 
-# 繪製 Power Tree
-if st.session_state.theme == "Dark":
-    graph_bgcolor = "black"
-    edge_color = "white"
-    font_color = "#CCCCCC"
-    table_border_color = "white"
-else: # Light theme
-    graph_bgcolor = "white"
-    edge_color = "black"
-    font_color = "#555555"
-    table_border_color = "black"
-
-dot = graphviz.Digraph(comment='Power Tree')
-dot.attr(rankdir='LR', splines='line', ranksep='0.5', nodesep='0.15', center='true', bgcolor=graph_bgcolor)
-dot.attr('edge', color=edge_color, fontname='Arial', fontsize='10', fontcolor=font_color)
-
-nodes = st.session_state.power_tree_data['nodes']
-for node in [n for n in nodes if n['type'] == 'power_source']:
-    pin_str = f"Pin: {node.get('input_power', 0):.2f}mW" if node.get('input_source_id') else "Pin: N/A"
-    pout_str = f"Pout: {node.get('output_power_total', 0):.2f}mW"
-    eff_str = f"eff: {node.get('efficiency', 1.0) * 100:.0f}%" if node.get('efficiency', 0) > 0 else "eff: N/A"
-    # 【已修改】顯示 uA
-    iq_str = f"Iq: {node.get('quiescent_current_uA', 0.0):.1f}uA"
-    
-    pin_pout_str = f'{pin_str} &nbsp;|&nbsp; {pout_str}'
-    details_html = f"{pin_pout_str}<BR/>{eff_str}<BR/>{iq_str}"
-    
-    table = (f'<TABLE BORDER="0" CELLBORDER="1" CELLSPACING="0" CELLPADDING="5" COLOR="{table_border_color}">'
-             f'<TR><TD BGCOLOR="#2196F3" ALIGN="CENTER"><B><FONT COLOR="white">{node["label"]}</FONT></B></TD></TR>'
-             f'<TR><TD ALIGN="CENTER" BGCOLOR="#FFFFFF"><FONT COLOR="black">{details_html}</FONT></TD></TR>'
-             f'</TABLE>')
-    dot.node(node['id'], label=f'<{table}>', shape='none')
-
-with dot.subgraph(name='cluster_components') as c:
-    c.attr(rank='sink', style='invis')
-    components = [n for n in nodes if n['type'] == 'component']
-    components.sort(key=lambda x: x['group'])
-    for node in components:
-        group_color = st.session_state.group_colors.get(node['group'], "#CCCCCC")
-        power_details = f"Power: {node.get('power_consumption', 0):.2f}mW"
-        combined_details = f'{node["endpoint"]}<BR/>{power_details}'
-        table = (f'<TABLE BORDER="0" CELLBORDER="1" CELLSPACING="0" CELLPADDING="5" COLOR="{table_border_color}">'
-               f'<TR><TD BGCOLOR="{group_color}" ALIGN="CENTER"><B><FONT COLOR="white">{node["group"]}</FONT></B></TD></TR>'
-               f'<TR><TD ALIGN="CENTER" BGCOLOR="#FFFFFF"><FONT COLOR="black">{combined_details}</FONT></TD></TR>'
-               f'</TABLE>')
-        c.node(node['id'], label=f'<{table}>', shape='none')
-
-for node in nodes:
-    if node.get('input_source_id'):
-        source = get_node_by_id(node['input_source_id'])
-        if source:
-            voltage = source.get('output_voltage', 0)
-            power = node.get('input_power', 0) if node['type'] == 'power_source' else node.get('power_consumption', 0)
-            current_mA = power / voltage if voltage > 0 else 0
-            # 【已修改】邊線顯示 uA
-            edge_label = f"{voltage:.2f} V\n{current_mA * 1000.0:.1f} uA"
-            dot.edge(node['input_source_id'], node['id'], label=edge_label, tailport='e', headport='w')
-
-graph_placeholder.graphviz_chart(dot)
+# 繪製 Power Tree (只有在 Visualizer 展開時才產生；內容沒有變化時直接使用快取的 DOT source)
+if power_tree_expander.open:
+    if 'power_tree_render_cache' not in st.session_state:
+        st.session_state.power_tree_render_cache = PowerTreeRenderCache()
+    with profiling.span("Power Tree: label data", "render"):
+        label_data = power_tree_label_data(model_snapshot, active_result, st.session_state.theme, st.session_state.group_colors, tree_detail)
+    with profiling.span("Power Tree: graphviz", "render"):
+        graph_placeholder.graphviz_chart(st.session_state.power_tree_render_cache.get_dot(label_data))
+
+# 效能分析面板：這次 rerun 的所有區段都已記錄，最後才填入側邊欄
+rerun_profile = profiling.stop()
+if rerun_profile is not None:
+    profiling_history = st.session_state.setdefault('profiling_history', [])
+    profiling_history.append(rerun_profile)
+    del profiling_history[:-PROFILING_HISTORY]
+    with profiling_panel.container():
+        st.markdown(f"**This rerun:** {rerun_profile.total_ms:.1f} ms")
+        st.dataframe(
+            rerun_profile.summary(),
+            column_config={
+                "Total (ms)": st.column_config.NumberColumn(format="%.2f"),
+                "Max (ms)": st.column_config.NumberColumn(format="%.2f"),
+                "Share": st.column_config.ProgressColumn(format="%.2f", min_value=0, max_value=1),
+            },
+            hide_index=True,
+        )
+        if rerun_profile.counts:
+            st.caption("Calls this rerun: " + ", ".join(f"{name} × {count}" for name, count in rerun_profile.counts.most_common()))
+        st.download_button(
+            label=f"下載最近 {len(profiling_history)} 次 rerun 的 trace (.json)",
+            data=profiling.chrome_trace(profiling_history),
+            file_name="power_model_trace.json",
+            mime="application/json",
+            help="可用 chrome://tracing 或 https://ui.perfetto.dev 開啟",
+        )
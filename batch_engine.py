@@ -0,0 +1,337 @@
+"""
+批次計算引擎 (Vectorized Batch Engine)
+
+將 power tree 與所有 Use Case 編譯成 NumPy 矩陣一次：
+  - mode-current matrix : (operating mode × component) 電流 (uA)
+  - ratio matrix        : (use case × operating mode) 使用比例
+  - power source mode   : 每個 use case 對每個電源選用的模式 (電壓 / 效率 / Iq)
+  - incidence matrix    : component → rail、rail → 上游 rail 的連接關係
+  - efficiency curves   : 每個電源模式的「效率 vs 輸出電流」內插表，補齊成相同點數 (P × K)
+之後以向量化方式同時計算所有 Use Case 的功耗，計算語意與 calculate_power 相同。
+
+evaluate() 的所有參數都可以帶額外的前置 batch 維度 (例如 sweep / Monte Carlo 的樣本)，
+結果的 shape 會是 (..., U) 或 (..., U, S)。
+"""
+from dataclasses import dataclass
+from functools import cached_property
+
+import numpy as np
+
+from parallel import IN_PROCESS, split_evenly
+from power_calc import EFFICIENCY_CURVE_KEY, MIN_CURVE_CURRENT_mA, EfficiencyCurve, PowerResult
+from power_tree import PowerTree
+
+# 編譯 + 計算的實測成本：每個 (Use Case × 節點) 約 0.45 ~ 0.7 us (以編譯的 Python 迴圈為主)
+SECONDS_PER_USE_CASE_NODE = 5e-7
+# 帶 batch 維度的 evaluate() 每批的記憶體上限，以及每個點約需的 (U × (C + S)) 陣列數 (實測 2.5 ~ 3.6)
+BATCH_MEMORY_BYTES = 256 * 1024 ** 2
+BATCH_ARRAYS_PER_POINT = 4
+
+
+def interpolate_efficiency(curve_log_current, curve_efficiency, mode, output_current_mA):
+    """
+    向量化的效率曲線內插：mode 為每個元素所用的電源模式索引，output_current_mA 可帶前置 batch 維度。
+    每個元素只比較自己那條曲線的 K 個點，成本為 O(K)。
+    """
+    x = np.log10(np.maximum(output_current_mA, MIN_CURVE_CURRENT_mA))
+    xs = curve_log_current[mode]
+    ys = curve_efficiency[mode]
+    xs, ys = np.broadcast_to(xs, x.shape + xs.shape[-1:]), np.broadcast_to(ys, x.shape + ys.shape[-1:])
+    right = np.clip((xs <= x[..., np.newaxis]).sum(axis=-1), 1, xs.shape[-1] - 1)[..., np.newaxis]
+    x0 = np.take_along_axis(xs, right - 1, axis=-1)[..., 0]
+    x1 = np.take_along_axis(xs, right, axis=-1)[..., 0]
+    y0 = np.take_along_axis(ys, right - 1, axis=-1)[..., 0]
+    y1 = np.take_along_axis(ys, right, axis=-1)[..., 0]
+    span = x1 - x0
+    t = np.clip(np.divide(x - x0, span, out=np.zeros_like(x), where=span > 0), 0.0, 1.0)
+    return y0 + t * (y1 - y0)
+
+
+@dataclass
+class BatchResult:
+    compiled: "CompiledModel"
+    total_power_mW: np.ndarray       # (..., U)
+    component_power_mW: np.ndarray   # (..., U, C)
+    rail_output_power_mW: np.ndarray # (..., U, S)
+    rail_input_power_mW: np.ndarray  # (..., U, S)
+    rail_voltage: np.ndarray         # (..., U, S)
+    rail_efficiency: np.ndarray      # (..., U, S)
+    rail_iq_uA: np.ndarray           # (..., U, S)
+
+    def total_power_by_use_case(self):
+        """{use case 名稱: 總功耗 (mW)} (僅適用於沒有 batch 維度的結果)"""
+        return dict(zip(self.compiled.use_case_names, self.total_power_mW.tolist()))
+
+    def to_power_results(self):
+        """轉換成每個 Use Case 一個 PowerResult (與 evaluate_use_case 的輸出相同格式)"""
+        compiled = self.compiled
+        reachable = [s for level, _ in compiled.rail_levels for s in level.tolist()]
+        reachable_ids = [compiled.rail_ids[s] for s in reachable]
+        results = {}
+        for u, uc_name in enumerate(compiled.use_case_names):
+            results[uc_name] = PowerResult(
+                use_case=uc_name,
+                total_power_mW=float(self.total_power_mW[u]),
+                power_consumption=dict(zip(compiled.component_ids, self.component_power_mW[u].tolist())),
+                output_voltage=dict(zip(compiled.rail_ids, self.rail_voltage[u].tolist())),
+                efficiency=dict(zip(compiled.rail_ids, self.rail_efficiency[u].tolist())),
+                quiescent_current_uA=dict(zip(compiled.rail_ids, self.rail_iq_uA[u].tolist())),
+                output_power_total=dict(zip(reachable_ids, self.rail_output_power_mW[u, reachable].tolist())),
+                input_power=dict(zip(reachable_ids, self.rail_input_power_mW[u, reachable].tolist())),
+            )
+        return results
+
+
+class CompiledModel:
+    """編譯後的矩陣模型；請使用 compile_model() 建立"""
+
+    def __init__(self, nodes, power_source_modes, operating_modes, use_cases, tree=None, use_case_names=None):
+        tree = tree or PowerTree(nodes)
+        self.use_case_names = list(use_cases.keys()) if use_case_names is None else list(use_case_names)
+
+        components = [n for n in nodes if n['type'] == 'component']
+        rails = [n for n in nodes if n['type'] == 'power_source']
+        self.component_ids = [n['id'] for n in components]
+        self.component_groups = [n.get('group') for n in components]
+        self.rail_ids = [n['id'] for n in rails]
+        self.rail_labels = [n.get('label', n['id']) for n in rails]
+        component_index = {node_id: i for i, node_id in enumerate(self.component_ids)}
+        rail_index = {node_id: i for i, node_id in enumerate(self.rail_ids)}
+
+        # --- 1. Mode-current matrix (M × C) ---
+        self.mode_keys = [(group, mode) for group, modes in operating_modes.items() for mode in modes]
+        mode_index = {key: i for i, key in enumerate(self.mode_keys)}
+        self.mode_currents_uA = np.zeros((len(self.mode_keys), len(components)))
+        for m, (group, mode) in enumerate(self.mode_keys):
+            for node_id, current_uA in operating_modes[group][mode].get('currents_uA', {}).items():
+                c = component_index.get(node_id)
+                if c is not None and self.component_groups[c] == group:
+                    self.mode_currents_uA[m, c] = current_uA
+
+        # --- 2. Ratio matrix (U × M)，只計入 ratio > 0 的模式 (與 apply_use_case 相同) ---
+        self.ratios = np.zeros((len(self.use_case_names), len(self.mode_keys)))
+        for u, uc_name in enumerate(self.use_case_names):
+            for group, group_ratios in use_cases[uc_name].get('components', {}).items():
+                for mode, ratio in (group_ratios or {}).items():
+                    m = mode_index.get((group, mode))
+                    if m is not None and ratio > 0:
+                        self.ratios[u, m] = ratio / 100.0
+
+        # --- 3. Power source modes (P) 與每個 use case 的模式選擇 (U × S) ---
+        self.ps_mode_keys = []
+        ps_mode_params = []
+        ps_mode_index = {}
+        first_ps_mode = {}
+        for rail in rails:
+            modes = power_source_modes.get(rail['id'])
+            if not modes:
+                # 沒有定義模式的電源使用節點本身的參數
+                modes = {"On": rail}
+            first_ps_mode[rail['id']] = len(self.ps_mode_keys)
+            for mode_name, params in modes.items():
+                ps_mode_index[(rail['id'], mode_name)] = len(self.ps_mode_keys)
+                self.ps_mode_keys.append((rail['id'], mode_name))
+                ps_mode_params.append(params)
+        self.ps_mode_voltage = np.array([p.get('output_voltage', 0.0) for p in ps_mode_params], dtype=float)
+        self.ps_mode_efficiency = np.array([p.get('efficiency', 1.0) for p in ps_mode_params], dtype=float)
+        self.ps_mode_iq_uA = np.array([p.get('quiescent_current_uA', 0.0) for p in ps_mode_params], dtype=float)
+
+        # 效率曲線補齊成相同點數 (重複最後一點)，沒有曲線的模式不使用此表
+        curves = [
+            EfficiencyCurve.from_points(params[EFFICIENCY_CURVE_KEY]) if params.get(EFFICIENCY_CURVE_KEY) else None
+            for params in ps_mode_params
+        ]
+        self.ps_mode_has_curve = np.array([curve is not None for curve in curves], dtype=bool)
+        n_points = max([len(curve.log_current) for curve in curves if curve is not None], default=2)
+        self.curve_log_current = np.zeros((len(curves), n_points))
+        self.curve_efficiency = np.ones((len(curves), n_points))
+        for p, curve in enumerate(curves):
+            if curve is not None:
+                pad = n_points - len(curve.log_current)
+                self.curve_log_current[p] = curve.log_current + curve.log_current[-1:] * pad
+                self.curve_efficiency[p] = curve.efficiency + curve.efficiency[-1:] * pad
+
+        self.rail_mode = np.zeros((len(self.use_case_names), len(rails)), dtype=np.intp)
+        for u, uc_name in enumerate(self.use_case_names):
+            ps_settings = use_cases[uc_name].get('power_sources', {})
+            for s, rail_id in enumerate(self.rail_ids):
+                p = ps_mode_index.get((rail_id, ps_settings.get(rail_id, "On")))
+                if p is None:
+                    p = ps_mode_index.get((rail_id, "On"), first_ps_mode[rail_id])
+                self.rail_mode[u, s] = p
+
+        # --- 4. Incidence matrices ---
+        # component → rail (C × S)，只有接在 rail 上的元件才有電壓
+        self.component_rail = np.array([rail_index.get(n.get('input_source_id'), -1) for n in components], dtype=np.intp)
+        self.component_load = np.zeros((len(components), len(rails)))
+        attached = np.flatnonzero(self.component_rail >= 0)
+        self.component_load[attached, self.component_rail[attached]] = 1.0
+
+        # rail → 上游 rail；根節點的輸入電壓為自身輸出電壓
+        self.rail_parent = np.array([rail_index.get(n.get('input_source_id'), -1) for n in rails], dtype=np.intp)
+        self.rail_is_root = np.array([n.get('input_source_id') is None for n in rails])
+
+        # 每個 use case 的每個 rail 是否由效率曲線決定效率 (U × S)
+        self.rail_has_curve = self.ps_mode_has_curve[self.rail_mode]
+
+        # 依拓撲深度分層 (由深到淺)，每一層一次向量化計算；無法到達的 rail 不列入
+        depth = {}
+        for node_id in tree.topological_order():
+            parent_id = tree.parent.get(node_id)
+            depth[node_id] = depth[parent_id] + 1 if parent_id is not None else 0
+        levels = {}
+        for s, rail_id in enumerate(self.rail_ids):
+            if rail_id in depth:
+                levels.setdefault(depth[rail_id], []).append(s)
+        self.rail_levels = []
+        for d in sorted(levels, reverse=True):
+            level = np.array(levels[d], dtype=np.intp)
+            parent_incidence = np.zeros((len(level), len(rails)))
+            has_parent = self.rail_parent[level] >= 0
+            parent_incidence[np.flatnonzero(has_parent), self.rail_parent[level][has_parent]] = 1.0
+            self.rail_levels.append((level, parent_incidence))
+        self.root_rails = np.array([s for s in range(len(rails)) if self.rail_is_root[s] and self.rail_ids[s] in depth], dtype=np.intp)
+
+    @cached_property
+    def base_component_currents_uA(self):
+        """編譯時的各 Use Case 元件電流 (U × C) = ratio × mode 電流"""
+        return np.matmul(self.ratios, self.mode_currents_uA)
+
+    def component_currents_uA(self, modes, components, values):
+        """
+        mode 電流矩陣中 (modes[k], components[k]) 換成 values[..., k] 時各 Use Case 的元件電流 (..., U, C)。
+        每一格只影響一個元件的一欄：由基準元件電流加上 ratio[:, m] × (新值 - 原值) 得到，
+        不需要建立帶 batch 維度的 M × C 矩陣。(modes[k], components[k]) 不可重複。
+        """
+        modes = np.asarray(modes, dtype=np.intp)
+        components = np.asarray(components, dtype=np.intp)
+        values = np.asarray(values, dtype=float)
+        base = self.base_component_currents_uA
+        currents = np.broadcast_to(base, values.shape[:-1] + base.shape).copy()
+        delta = values - self.mode_currents_uA[modes, components]
+        for c in np.unique(components):
+            k = np.flatnonzero(components == c)
+            currents[..., c] += np.matmul(delta[..., k], self.ratios[:, modes[k]].T)
+        return currents
+
+    def points_per_batch(self, n_changes=0, memory_bytes=None):
+        """
+        一次 evaluate() 最多帶幾個 batch 點：每個點約需 BATCH_ARRAYS_PER_POINT 個 (U × (C + S)) 的 float64 陣列，
+        n_changes 為 component_currents_uA 改變的格數 (每個點另需 U × n_changes)。
+        """
+        memory_bytes = BATCH_MEMORY_BYTES if memory_bytes is None else memory_bytes
+        n_use_cases = max(len(self.use_case_names), 1)
+        per_point = 8 * n_use_cases * (BATCH_ARRAYS_PER_POINT * (len(self.component_ids) + len(self.rail_ids)) + n_changes)
+        return max(int(memory_bytes // per_point), 1)
+
+    def evaluate(self, mode_currents_uA=None, ps_mode_voltage=None, ps_mode_efficiency=None, ps_mode_iq_uA=None,
+                 component_currents_uA=None):
+        """
+        一次計算所有 Use Case 的功耗。
+        參數為 None 時使用編譯時的數值；可傳入帶前置 batch 維度的陣列：
+          mode_currents_uA (..., M, C)、ps_mode_* (..., P)
+        component_currents_uA (..., U, C) 直接指定各 Use Case 的元件電流 (取代 ratio × mode 電流，
+        例如 component_currents_uA() 只改變少數 mode 電流的結果)。
+        有效率曲線的模式，效率在由深到淺的逐層計算中由該層的輸出電流查表 (上游的負載在此之後才計算)；
+        此時傳入的 ps_mode_efficiency 視為整條曲線的倍率 (傳入值 / 編譯時的效率)，讓 sweep / Monte Carlo 仍然適用。
+        """
+        currents = self.mode_currents_uA if mode_currents_uA is None else mode_currents_uA
+        pm_v = self.ps_mode_voltage if ps_mode_voltage is None else ps_mode_voltage
+        pm_eff = self.ps_mode_efficiency if ps_mode_efficiency is None else ps_mode_efficiency
+        pm_iq = self.ps_mode_iq_uA if ps_mode_iq_uA is None else ps_mode_iq_uA
+
+        # 各 use case 下每個電源的電壓 / 效率 / Iq (..., U, S)
+        voltage = pm_v[..., self.rail_mode]
+        efficiency = pm_eff[..., self.rail_mode]
+        iq_uA = pm_iq[..., self.rail_mode]
+
+        # 元件功耗 (..., U, C) = 上游電壓 × Σ(ratio × mode current) / 1000
+        if component_currents_uA is None:
+            component_current_uA = np.matmul(self.ratios, currents)
+        else:
+            component_current_uA = component_currents_uA
+        attached = self.component_rail >= 0
+        component_voltage = np.where(attached, voltage[..., np.where(attached, self.component_rail, 0)], 0.0)
+        component_power = component_voltage * component_current_uA / 1000.0
+
+        # Iq 損耗使用上游電壓 (根節點使用自身電壓)
+        has_parent = self.rail_parent >= 0
+        input_voltage = np.where(has_parent, voltage[..., np.where(has_parent, self.rail_parent, 0)], voltage)
+        iq_power = input_voltage * iq_uA / 1000.0
+        inv_efficiency = np.divide(1.0, efficiency, out=np.zeros_like(efficiency), where=efficiency > 0)
+
+        # 只有部分參數帶 batch 維度時 (例如只掃描效率)，負載也要展開成相同的 shape
+        load = np.matmul(component_power, self.component_load)
+        load = np.broadcast_to(load, np.broadcast_shapes(load.shape, inv_efficiency.shape, iq_power.shape)).copy()
+        output_power = np.zeros_like(load)
+        input_power = np.zeros_like(load)
+        use_curves = self.rail_has_curve.any()
+        if use_curves:
+            efficiency = np.broadcast_to(efficiency, load.shape).copy()
+            inv_efficiency = np.broadcast_to(inv_efficiency, load.shape).copy()
+            curve_scale = None
+            if ps_mode_efficiency is not None:
+                curve_scale = np.divide(
+                    pm_eff, self.ps_mode_efficiency, out=np.ones(np.broadcast_shapes(np.shape(pm_eff), self.ps_mode_efficiency.shape)),
+                    where=self.ps_mode_efficiency > 0
+                )[..., self.rail_mode]
+        for level, parent_incidence in self.rail_levels:
+            level_output = load[..., level]
+            if use_curves and self.rail_has_curve[:, level].any():
+                level_voltage = voltage[..., level]
+                level_current = np.divide(level_output, level_voltage, out=np.zeros(np.broadcast_shapes(level_output.shape, level_voltage.shape)), where=level_voltage > 0)
+                curve_efficiency = interpolate_efficiency(
+                    self.curve_log_current, self.curve_efficiency, self.rail_mode[:, level], level_current
+                )
+                if curve_scale is not None:
+                    curve_efficiency = curve_efficiency * curve_scale[..., level]
+                level_efficiency = np.where(self.rail_has_curve[:, level], curve_efficiency, efficiency[..., level])
+                efficiency[..., level] = level_efficiency
+                inv_efficiency[..., level] = np.divide(1.0, level_efficiency, out=np.zeros_like(level_efficiency), where=level_efficiency > 0)
+            level_input = level_output * inv_efficiency[..., level] + iq_power[..., level]
+            output_power[..., level] = level_output
+            input_power[..., level] = level_input
+            load = load + np.matmul(level_input, parent_incidence)
+
+        total_power = input_power[..., self.root_rails].sum(axis=-1)
+        return BatchResult(
+            compiled=self,
+            total_power_mW=total_power,
+            component_power_mW=component_power,
+            rail_output_power_mW=output_power,
+            rail_input_power_mW=input_power,
+            rail_voltage=voltage,
+            rail_efficiency=efficiency,
+            rail_iq_uA=iq_uA,
+        )
+
+
+def compile_model(snapshot, use_case_names=None):
+    """將 ModelSnapshot 編譯成矩陣模型 (可只編譯部分 Use Case)"""
+    return CompiledModel(
+        list(snapshot.nodes),
+        snapshot.power_source_modes,
+        snapshot.operating_modes,
+        snapshot.use_cases,
+        tree=snapshot.tree,
+        use_case_names=use_case_names,
+    )
+
+
+def _evaluate_chunk(snapshot, use_case_names):
+    return compile_model(snapshot, use_case_names).evaluate().to_power_results()
+
+
+def evaluate_use_cases(snapshot, use_case_names=None, backend=None):
+    """
+    以批次引擎計算多個 Use Case，回傳 {名稱: PowerResult}。
+    backend 為 parallel.ExecutionBackend 時，Use Case 分段交給多個 process 各自編譯與計算。
+    """
+    use_case_names = list(snapshot.use_cases) if use_case_names is None else list(use_case_names)
+    backend = backend or IN_PROCESS
+    work = len(use_case_names) * len(snapshot.nodes) * SECONDS_PER_USE_CASE_NODE
+    chunks = split_evenly(use_case_names, backend.worker_count(len(use_case_names), work, _evaluate_chunk))
+    results = {}
+    for chunk_results in backend.map(_evaluate_chunk, chunks, context=snapshot, work=work):
+        results.update(chunk_results)
+    return results
@@ -0,0 +1,304 @@
+"""
+效能基準測試 (Benchmark Suite)
+
+以亂數產生與 session_state 相同格式的大型模型 (N 個 rail、M 個端點、U 個 Use Case、P 個 Profile、指定深度)，
+量測核心計算與整頁計算流程的時間，輸出 JSON 報表；可與先前的報表比較，找出變慢的 hot path。
+
+量測項目：
+  - calculate_power                       : power_calc.evaluate_use_case (單一 Use Case)
+  - calculate_power (all use cases)       : 逐一計算所有 Use Case
+  - batch_engine                          : batch_engine.evaluate_use_cases (所有 Use Case 一次計算)
+  - vsys_referred_contributions           : 單一 Use Case 的 Vsys 功耗分佈
+  - contribution_matrix                   : 所有 Use Case 的 (use case × 來源) 矩陣
+  - calculate_average_profile_breakdown   : 一個 Profile 的平均功耗分佈 (矩陣已建立)
+  - power_tree_label_data / graphviz_build: Power Tree 的顯示資料與 DOT source (需要 graphviz 套件)
+  - full_page                             : 沒有快取時一次 rerun 的計算 (快照 → 所有 Use Case → 電池壽命 → 分佈 → Power Tree)
+
+用法：
+    python benchmark.py                                   # 預設的 small / medium / large 三組
+    python benchmark.py --rails 200 --endpoints 3000 --use-cases 80 --depth 8 -o bench.json
+    python benchmark.py -o new.json --baseline old.json   # 任何項目變慢超過 --threshold 倍時回傳 1
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from dataclasses import asdict, dataclass
+
+import numpy as np
+
+from batch_engine import evaluate_use_cases
+from config_io import validate_config
+from power_calc import ModelSnapshot, evaluate_use_case
+from power_report import (
+    contribution_matrix, profile_battery_life, profile_breakdown, vsys_referred_contributions, vsys_voltage_of,
+)
+
+# 名稱: (rails, endpoints, use cases, profiles, depth)
+PRESETS = {
+    'small': (15, 40, 36, 3, 3),
+    'medium': (60, 300, 60, 5, 5),
+    'large': (200, 2000, 100, 8, 8),
+}
+DEFAULT_THRESHOLD = 1.25
+
+
+@dataclass(frozen=True)
+class SyntheticSpec:
+    rails: int = 60
+    endpoints: int = 300
+    use_cases: int = 60
+    profiles: int = 5
+    depth: int = 5
+    group_size: int = 4          # 每個元件群組的端點數
+    modes_per_group: int = 4
+    seed: int = 0
+
+    @property
+    def name(self):
+        return f"{self.rails}r-{self.endpoints}e-{self.use_cases}u-{self.profiles}p-d{self.depth}"
+
+
+def synthetic_config(spec):
+    """產生與 session_state / 設定檔相同格式的模型 (可直接用 ModelSnapshot.from_state 或 validate_config)"""
+    rng = np.random.default_rng(spec.seed)
+    depth = max(int(spec.depth), 1)
+
+    # rail 依序分配到 1 ~ depth 層，上游為上一層的隨機 rail，確保樹的深度剛好為 depth
+    nodes = [{"id": "battery", "label": "Vsys", "type": "power_source", "output_voltage": 3.85,
+              "efficiency": 1.0, "quiescent_current_uA": 2.0, "input_source_id": None}]
+    rails_by_depth = {0: ["battery"]}
+    for i in range(1, max(int(spec.rails), 1)):
+        level = 1 + (i - 1) % depth
+        parent_level = level - 1 if rails_by_depth.get(level - 1) else 0
+        parent_id = rails_by_depth[parent_level][rng.integers(len(rails_by_depth[parent_level]))]
+        rail_id = f"rail_{i}"
+        nodes.append({
+            "id": rail_id, "label": f"Rail {i}", "type": "power_source",
+            "output_voltage": float(rng.choice([0.8, 1.0, 1.2, 1.8, 3.0, 3.3])),
+            "efficiency": float(rng.uniform(0.6, 0.95)), "quiescent_current_uA": float(rng.uniform(0.5, 50.0)),
+            "input_source_id": parent_id,
+        })
+        rails_by_depth.setdefault(level, []).append(rail_id)
+    rail_ids = [n['id'] for n in nodes]
+
+    groups = {}
+    for i in range(int(spec.endpoints)):
+        group = f"Group {i // max(int(spec.group_size), 1)}"
+        node_id = f"ep_{i}"
+        nodes.append({
+            "id": node_id, "type": "component", "group": group, "endpoint": f"EP{i}",
+            "input_source_id": rail_ids[rng.integers(len(rail_ids))],
+        })
+        groups.setdefault(group, []).append(node_id)
+
+    power_source_modes = {}
+    for n in nodes[:len(rail_ids)]:
+        power_source_modes[n['id']] = {
+            "On": {"output_voltage": n['output_voltage'], "efficiency": n['efficiency'],
+                   "quiescent_current_uA": n['quiescent_current_uA'], "note": ""},
+            "Off": {"output_voltage": 0.0, "efficiency": 0.0, "quiescent_current_uA": n['quiescent_current_uA'], "note": ""},
+        }
+
+    # 電流以 log-uniform 分佈涵蓋 sleep (0.1 uA) ~ active (50 mA)
+    operating_modes = {
+        group: {
+            f"Mode {m}": {"currents_uA": {node_id: float(10 ** rng.uniform(-1, 4.7)) for node_id in node_ids}, "note": ""}
+            for m in range(max(int(spec.modes_per_group), 1))
+        }
+        for group, node_ids in groups.items()
+    }
+
+    use_cases = {}
+    for u in range(max(int(spec.use_cases), 1)):
+        components = {}
+        for group, modes in operating_modes.items():
+            mode_names = list(modes)
+            ratios = {mode: 0 for mode in mode_names}
+            first, second = rng.choice(len(mode_names), size=2, replace=len(mode_names) < 2)
+            split = int(rng.integers(0, 101))
+            ratios[mode_names[first]] += split
+            ratios[mode_names[second]] += 100 - split
+            components[group] = ratios
+        power_sources = {rail_id: ("Off" if rail_id != "battery" and rng.random() < 0.1 else "On") for rail_id in rail_ids}
+        use_cases[f"Use Case {u}"] = {"components": components, "power_sources": power_sources}
+
+    use_case_names = list(use_cases)
+    user_profiles = {}
+    for p in range(max(int(spec.profiles), 1)):
+        seconds = rng.dirichlet(np.ones(len(use_case_names))) * 86400
+        user_profiles[f"Profile {p}"] = {name: int(s) for name, s in zip(use_case_names, seconds)}
+
+    return {
+        'power_tree_data': {"nodes": nodes},
+        'max_id': len(nodes),
+        'group_colors': {group: "#4CAF50" for group in groups},
+        'operating_modes': operating_modes,
+        'power_source_modes': power_source_modes,
+        'use_cases': use_cases,
+        'battery_capacity_mAh': 300.0,
+        'user_profiles': user_profiles,
+        'component_group_notes': {group: "" for group in groups},
+        'battery_note': "",
+        'profile_dou_specs': {name: 7.0 for name in user_profiles},
+    }
+
+
+def time_call(fn, repeat=5, min_time_s=0.05):
+    """量測 fn() 的時間：每一輪至少執行 min_time_s，回傳每次呼叫的 min / median / mean 秒數"""
+    start = time.perf_counter()
+    fn()
+    single = time.perf_counter() - start
+    number = max(1, int(min_time_s / single)) if single > 0 else 1000
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return {"repeat": repeat, "number": number, "min_s": min(samples),
+            "median_s": statistics.median(samples), "mean_s": statistics.fmean(samples)}
+
+
+def _tree_render():
+    """tree_render 需要 graphviz 套件；沒有安裝時回傳 None (相關項目標記為略過)"""
+    try:
+        import tree_render
+    except ImportError:
+        return None
+    return tree_render
+
+
+def full_page_compute(config, tree_render=None):
+    """沒有任何快取時，一次 rerun 中 app.py 執行的計算 (與各 tab 的呼叫順序相同)"""
+    snapshot = ModelSnapshot.from_state(config)
+    results = evaluate_use_cases(snapshot)
+    active_result = next(iter(results.values()))
+    vsys_voltage = vsys_voltage_of(active_result)
+    power_per_use_case = {name: result.total_power_mW for name, result in results.items()}
+    for profile_name, profile_data in config['user_profiles'].items():
+        profile_battery_life(profile_name, profile_data, power_per_use_case, config['battery_capacity_mAh'], vsys_voltage)
+    vsys_referred_contributions(active_result, snapshot)
+    matrix, source_types = contribution_matrix(snapshot, results)
+    for profile_data in config['user_profiles'].values():
+        profile_breakdown(matrix, source_types, profile_data)
+    if tree_render is not None:
+        label_data = tree_render.power_tree_label_data(snapshot, active_result, "Dark", config['group_colors'])
+        tree_render.build_power_tree_dot(label_data)
+
+
+def run_benchmarks(spec, repeat=5, min_time_s=0.05):
+    """對一組 SyntheticSpec 執行所有量測，回傳 {name, spec, results: {項目: 時間統計 或 {"skipped": 原因}}}"""
+    config = synthetic_config(spec)
+    problems = validate_config(config)
+    if problems:
+        raise ValueError(f"合成模型不合法: {problems[:3]}")
+    snapshot = ModelSnapshot.from_state(config)
+    use_case_names = list(snapshot.use_cases)
+    first_use_case = use_case_names[0]
+    first_profile = next(iter(config['user_profiles'].values()))
+    results = evaluate_use_cases(snapshot)
+    first_result = results[first_use_case]
+    matrix, source_types = contribution_matrix(snapshot, results)
+    tree_render = _tree_render()
+
+    cases = {
+        "calculate_power": lambda: evaluate_use_case(snapshot, first_use_case),
+        "calculate_power (all use cases)": lambda: [evaluate_use_case(snapshot, name) for name in use_case_names],
+        "batch_engine": lambda: evaluate_use_cases(snapshot),
+        "vsys_referred_contributions": lambda: vsys_referred_contributions(first_result, snapshot),
+        "contribution_matrix": lambda: contribution_matrix(snapshot, results),
+        "calculate_average_profile_breakdown": lambda: profile_breakdown(matrix, source_types, first_profile),
+        "full_page": lambda: full_page_compute(config, tree_render),
+    }
+    if tree_render is not None:
+        label_data = tree_render.power_tree_label_data(snapshot, first_result, "Dark", config['group_colors'])
+        cases["power_tree_label_data"] = lambda: tree_render.power_tree_label_data(snapshot, first_result, "Dark", config['group_colors'])
+        cases["graphviz_build"] = lambda: tree_render.build_power_tree_dot(label_data)
+
+    timings = {name: time_call(fn, repeat, min_time_s) for name, fn in cases.items()}
+    if tree_render is None:
+        timings["power_tree_label_data"] = timings["graphviz_build"] = {"skipped": "graphviz 未安裝"}
+    return {"name": spec.name, "spec": asdict(spec), "results": timings}
+
+
+def benchmark_report(specs, repeat=5, min_time_s=0.05):
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "benchmarks": [run_benchmarks(spec, repeat, min_time_s) for spec in specs],
+    }
+
+
+def compare_reports(report, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    與 baseline 報表比較相同名稱的模型與項目 (以 min_s 比較，受雜訊影響最小)，
+    回傳 [(模型, 項目, baseline 秒數, 目前秒數, 倍率)]，只列出變慢超過 threshold 倍的項目。
+    """
+    baseline_results = {bench["name"]: bench["results"] for bench in baseline.get("benchmarks", [])}
+    regressions = []
+    for bench in report["benchmarks"]:
+        for case, timing in bench["results"].items():
+            before = baseline_results.get(bench["name"], {}).get(case, {})
+            if "min_s" not in timing or not before.get("min_s"):
+                continue
+            ratio = timing["min_s"] / before["min_s"]
+            if ratio > threshold:
+                regressions.append((bench["name"], case, before["min_s"], timing["min_s"], ratio))
+    return regressions
+
+
+def _format_seconds(seconds):
+    return f"{seconds * 1e3:10.3f} ms" if seconds >= 1e-3 else f"{seconds * 1e6:10.1f} us"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the power model hot paths on synthetic power trees.")
+    parser.add_argument("--preset", choices=sorted(PRESETS), action="append", help="model size preset (repeatable; default: all)")
+    parser.add_argument("--rails", type=int, help="number of power sources (custom model; overrides --preset)")
+    parser.add_argument("--endpoints", type=int, default=300, help="number of component endpoints (custom model)")
+    parser.add_argument("--use-cases", type=int, default=60, help="number of use cases (custom model)")
+    parser.add_argument("--profiles", type=int, default=5, help="number of user profiles (custom model)")
+    parser.add_argument("--depth", type=int, default=5, help="power tree depth (custom model)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the synthetic model")
+    parser.add_argument("--repeat", type=int, default=5, help="timing rounds per case (default: 5)")
+    parser.add_argument("-o", "--output", help="write the JSON report to this file")
+    parser.add_argument("--baseline", help="compare against a previous JSON report")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"slowdown ratio counted as a regression (default: {DEFAULT_THRESHOLD})")
+    args = parser.parse_args(argv)
+
+    if args.rails:
+        specs = [SyntheticSpec(args.rails, args.endpoints, args.use_cases, args.profiles, args.depth, seed=args.seed)]
+    else:
+        specs = [SyntheticSpec(*PRESETS[name], seed=args.seed) for name in (args.preset or PRESETS)]
+
+    report = benchmark_report(specs, repeat=args.repeat)
+    for bench in report["benchmarks"]:
+        print(bench["name"])
+        for case, timing in bench["results"].items():
+            value = _format_seconds(timing["min_s"]) if "min_s" in timing else f"  skipped ({timing['skipped']})"
+            print(f"  {case:40s}{value}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Report: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_reports(report, json.load(f), args.threshold)
+        for name, case, before, after, ratio in regressions:
+            print(f"[REGRESSION] {name} / {case}: {_format_seconds(before).strip()} -> {_format_seconds(after).strip()} ({ratio:.2f}x)",
+                  file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
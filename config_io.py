@@ -0,0 +1,459 @@
+"""
+設定檔讀寫 (JSON / 二進位 .pwrm)
+
+JSON 格式與原本側邊欄的「下載設定檔」相同。
+二進位格式把所有「值全部是數字的 dict」(currents_uA、ratio、user_profiles 的秒數…)
+抽出成欄位式 (columnar) 資料：key 以字串表 + uint32 索引儲存，數值以 float64 / int64 陣列儲存，
+相同 key 組合 (例如每個 Use Case 的 ratio dict) 只儲存一次，同一組 key 的 dict 的數值連續存放成一個區塊。
+值全部是這種 dict 的 dict (例如 Use Case 的 components) 整個存成一個 table。
+其餘結構 (skeleton) 仍是 JSON，數值 dict / table 的位置以一個標記 dict 代替。
+讀取時欄位以 numpy 一次轉換，每個區塊以 zip 直接組回 dict，
+key 順序、int / float 型別都與 JSON 完全相同 (json.dumps 的結果一致)。
+
+主要的好處是檔案大小 (約為 JSON 的 1/10)；讀取時間受限於建立相同數量的 Python dict，
+只比 json.loads 快約 1.1 ~ 1.3 倍。
+
+檔案結構 (little-endian)：
+    MAGIC (4 bytes) | version (uint16) | reserved (uint16) | CRC32 (uint32) | payload 長度 (uint64) | payload
+payload 為 zlib 壓縮後的多個區段，每個區段前有 uint64 長度。
+
+讀入的設定檔會先轉換成目前的 schema (migrate_config)，
+再一次檢查所有參照關係 (validate_config)，把所有問題一起回報，
+避免錯誤的檔案寫進 session_state 之後才在計算途中出現 KeyError 或循環錯誤。
+"""
+import json
+import struct
+import sys
+import zlib
+from array import array
+from collections.abc import Hashable
+from itertools import repeat
+
+import numpy as np
+
+from power_calc import EFFICIENCY_CURVE_KEY
+from power_tree import PowerTree
+
+MAGIC = b'PWRM'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHHIQ')
+SECTION_LENGTH = struct.Struct('<Q')
+
+# skeleton 中代表「第 n 個數值 dict」的標記 key
+LEAF_MARKER = '\x00leaf'
+# skeleton 中代表「第 n 個 table (值全部是數值 dict 的 dict)」的標記 key
+TABLE_MARKER = '\x00table'
+LEAF_FLOAT = 0
+LEAF_INT = 1
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+REQUIRED_KEYS = ('power_tree_data', 'user_profiles')
+
+
+class ConfigFormatError(ValueError):
+    """設定檔無法解析 (格式、版本或 checksum 錯誤)"""
+
+
+class ConfigValidationError(ConfigFormatError):
+    """設定檔內容有錯誤；problems 為所有問題的說明"""
+
+    def __init__(self, problems):
+        self.problems = list(problems)
+        super().__init__(f"設定檔有 {len(self.problems)} 個問題：" + "；".join(self.problems))
+
+
+def _leaf_kind(d):
+    """
+    dict 的值全部是 float 回傳 LEAF_FLOAT，全部是 int64 範圍內的 int 回傳 LEAF_INT，否則 None
+    (key 必須全部是不含 \\x00 的字串，才能放進字串表)
+    """
+    if not d:
+        return None
+    value_types = set(map(type, d.values()))
+    if value_types == {float}:
+        kind = LEAF_FLOAT
+    elif value_types == {int} and INT64_MIN <= min(d.values()) and max(d.values()) <= INT64_MAX:
+        kind = LEAF_INT
+    else:
+        return None
+    if set(map(type, d)) != {str} or '\x00' in ''.join(d):
+        return None
+    return kind
+
+
+def _to_le_bytes(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def encode_config(config):
+    """把設定檔 dict 編碼成二進位 .pwrm 格式"""
+    strings = {}
+    shapes = {}
+    shape_sizes = []
+    key_index = array('I')
+    blocks = {}        # (kind, shape id) → [數值..., 依 leaf 順序逐列排列]
+    leaf_refs = []     # 第 n 個 leaf → (kind, shape id, 區塊內的列)
+    markers = []       # 與 leaf_refs 對應的 skeleton 標記 (全部 leaf 確定後才填入最終編號)
+    tables = []        # [shape id, leaf 編號...]
+
+    def shape_id(keys):
+        if keys not in shapes:
+            shapes[keys] = len(shapes)
+            shape_sizes.append(len(keys))
+            key_index.append(len(keys))
+            key_index.extend(strings.setdefault(key, len(strings)) for key in keys)
+        return shapes[keys]
+
+    def add_leaf(obj, kind):
+        block_key = (kind, shape_id(tuple(obj)))
+        block = blocks.setdefault(block_key, [])
+        leaf_refs.append((*block_key, len(block) // len(obj)))
+        block.extend(obj.values())
+        markers.append({LEAF_MARKER: None})
+        return len(leaf_refs) - 1
+
+    def strip(obj):
+        if isinstance(obj, dict):
+            kind = _leaf_kind(obj)
+            if kind is not None:
+                return markers[add_leaf(obj, kind)]
+            if obj and set(map(type, obj)) == {str} and '\x00' not in ''.join(obj):
+                kinds = [_leaf_kind(value) if isinstance(value, dict) else None for value in obj.values()]
+                if None not in kinds:
+                    # 值全部是數值 dict 的 dict (例如 Use Case 的 components) 整個存成一個 table
+                    tables.append([shape_id(tuple(obj)), *map(add_leaf, obj.values(), kinds)])
+                    return {TABLE_MARKER: len(tables) - 1}
+            return {key: strip(value) for key, value in obj.items()}
+        if isinstance(obj, list):
+            return [strip(value) for value in obj]
+        return obj
+
+    skeleton = strip(config)
+
+    # 同一種 (kind, shape) 的 leaf 連續存放，讀取時整個區塊一次轉換；leaf 的最終編號依區塊順序重排
+    block_info = array('I')
+    floats = array('d')
+    ints = array('q')
+    offsets = {}
+    leaf_count = 0
+    for (kind, shape), values in blocks.items():
+        count = len(values) // shape_sizes[shape]
+        offsets[kind, shape] = leaf_count
+        leaf_count += count
+        block_info.extend((kind, shape, count))
+        (floats if kind == LEAF_FLOAT else ints).extend(values)
+    final_ids = [offsets[kind, shape] + row for kind, shape, row in leaf_refs]
+    for marker, leaf_id in zip(markers, final_ids):
+        marker[LEAF_MARKER] = leaf_id
+    table_index = array('I')
+    for shape, *leaf_ids in tables:
+        table_index.append(shape)
+        table_index.extend(final_ids[i] for i in leaf_ids)
+
+    sections = [
+        json.dumps(skeleton, separators=(',', ':')).encode('utf-8'),
+        '\x00'.join(strings).encode('utf-8'),
+        _to_le_bytes(key_index),
+        _to_le_bytes(block_info),
+        _to_le_bytes(floats),
+        _to_le_bytes(ints),
+        _to_le_bytes(table_index),
+    ]
+    payload = zlib.compress(b''.join(SECTION_LENGTH.pack(len(s)) + s for s in sections), 6)
+    return HEADER.pack(MAGIC, FORMAT_VERSION, 0, zlib.crc32(payload), len(payload)) + payload
+
+
+def decode_config(data):
+    """解析二進位 .pwrm 格式，回傳與原本 JSON 完全相同的 dict"""
+    if len(data) < HEADER.size:
+        raise ConfigFormatError("檔案太短，不是有效的 .pwrm 設定檔")
+    magic, version, _, checksum, payload_length = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ConfigFormatError("不是 .pwrm 設定檔")
+    if version > FORMAT_VERSION:
+        raise ConfigFormatError(f"不支援的 .pwrm 版本 {version} (目前支援到 {FORMAT_VERSION})")
+    payload = data[HEADER.size:HEADER.size + payload_length]
+    if len(payload) != payload_length or zlib.crc32(payload) != checksum:
+        raise ConfigFormatError("檔案 checksum 不符，可能已損毀")
+
+    raw = zlib.decompress(payload)
+    sections = []
+    offset = 0
+    while offset < len(raw):
+        (length,) = SECTION_LENGTH.unpack_from(raw, offset)
+        offset += SECTION_LENGTH.size
+        sections.append(raw[offset:offset + length])
+        offset += length
+    skeleton, string_blob, key_bytes, block_bytes, float_bytes, int_bytes, table_bytes = sections
+
+    strings = string_blob.decode('utf-8').split('\x00')
+    key_index = np.frombuffer(key_bytes, dtype='<u4').tolist()
+    shapes = []
+    pos = 0
+    while pos < len(key_index):
+        size = key_index[pos]
+        shapes.append(tuple(strings[i] for i in key_index[pos + 1:pos + 1 + size]))
+        pos += 1 + size
+
+    # 每個區塊是同一組 key 的 leaf 依序排列的數值：欄位整個以 numpy 一次轉成 Python 數值，
+    # 每個區塊再以 map(dict, map(zip, ...)) 一次組回 count 個 dict，沒有逐個 leaf 的 Python 迴圈。
+    # zip(shape, values) 在 shape 用完時就停止，因此每個 dict 剛好從欄位取走 len(shape) 個數值
+    columns = (
+        iter(np.frombuffer(float_bytes, dtype='<f8').tolist()),
+        iter(np.frombuffer(int_bytes, dtype='<i8').tolist()),
+    )
+    leaves = []
+    for kind, shape_id, count in np.frombuffer(block_bytes, dtype='<u4').reshape(-1, 3).tolist():
+        leaves.extend(map(dict, map(zip, repeat(shapes[shape_id], count), repeat(columns[kind], count))))
+
+    table_index = np.frombuffer(table_bytes, dtype='<u4').tolist()
+    tables = []
+    pos = 0
+    while pos < len(table_index):
+        shape = shapes[table_index[pos]]
+        tables.append(dict(zip(shape, map(leaves.__getitem__, table_index[pos + 1:pos + 1 + len(shape)]))))
+        pos += 1 + len(shape)
+
+    def restore(d):
+        if len(d) == 1:
+            if LEAF_MARKER in d:
+                return leaves[d[LEAF_MARKER]]
+            if TABLE_MARKER in d:
+                return tables[d[TABLE_MARKER]]
+        return d
+
+    return json.loads(skeleton, object_hook=restore)
+
+
+def is_binary_config(data):
+    return data[:len(MAGIC)] == MAGIC
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_key(value):
+    """可以當作 dict key / id 參照的值 (JSON 的 list / dict 不行)"""
+    return isinstance(value, Hashable)
+
+
+def _structure_problems(config):
+    """migrate_config 之前的最外層結構檢查 (型別錯誤時無法繼續轉換)"""
+    problems = []
+    power_tree_data = config['power_tree_data']
+    nodes = power_tree_data.get('nodes') if isinstance(power_tree_data, dict) else None
+    if not isinstance(nodes, list) or not all(isinstance(n, dict) and 'id' in n for n in nodes):
+        problems.append("power_tree_data.nodes 必須是含有 id 的節點 list")
+    for key in ('use_cases', 'device_modes', 'user_profiles', 'power_source_modes', 'operating_modes'):
+        if key in config and not isinstance(config[key], dict):
+            problems.append(f"{key} 必須是 dict")
+    return problems
+
+
+def migrate_config(config):
+    """
+    把舊版 schema 的設定檔轉換成目前的格式 (直接修改並回傳 config)：
+      - device_modes → use_cases
+      - 沒有 power_source_modes 時，由節點上的 output_voltage / efficiency / Iq 建立 "On" / "Off" 模式
+      - 沒有 operating_modes 時，由節點上的 power_consumption 換算成 "Default" 模式電流
+      - 補上後來新增的欄位 (notes、battery_note、profile_dou_specs…)
+    型別錯誤的項目 (模式不是 dict、id 是 list…) 直接略過，留給 validate_config 一起回報。
+    """
+    if 'device_modes' in config and 'use_cases' not in config:
+        config['use_cases'] = config.pop('device_modes')
+
+    nodes = config['power_tree_data']['nodes']
+    power_sources = [n for n in nodes if n.get('type') == 'power_source' and _is_key(n['id'])]
+    components = [
+        n for n in nodes
+        if n.get('type') == 'component' and all(_is_key(n.get(key)) for key in ('id', 'group', 'input_source_id'))
+    ]
+
+    if 'power_source_modes' not in config:
+        config['power_source_modes'] = {
+            ps.get('id'): {
+                "On": {
+                    "output_voltage": ps.get('output_voltage', 0.0), "efficiency": ps.get('efficiency', 1.0),
+                    "quiescent_current_uA": ps.get('quiescent_current_uA', 0.0), "note": ps.get('note', ""),
+                },
+                "Off": {"output_voltage": 0.0, "efficiency": 0.0, "quiescent_current_uA": ps.get('quiescent_current_uA', 0.0), "note": "Device is off"},
+            }
+            for ps in power_sources
+        }
+    for modes in config['power_source_modes'].values():
+        if isinstance(modes, dict):
+            for params in modes.values():
+                if isinstance(params, dict):
+                    params.setdefault('note', "")
+
+    if 'operating_modes' not in config:
+        on_voltage = {
+            ps_id: modes["On"].get("output_voltage", 1.0)
+            for ps_id, modes in config['power_source_modes'].items()
+            if isinstance(modes, dict) and isinstance(modes.get("On"), dict)
+        }
+        operating_modes = {}
+        for node in components:
+            voltage = on_voltage.get(node.get('input_source_id'), 0.0)
+            power = node.get('power_consumption', 0.0)
+            current_uA = power / voltage * 1000.0 if _is_number(power) and _is_number(voltage) and voltage else 0.0
+            group_modes = operating_modes.setdefault(node.get('group'), {"Default": {"currents_uA": {}, "note": "Default operating mode."}})
+            group_modes["Default"]["currents_uA"][node.get('id')] = current_uA
+        config['operating_modes'] = operating_modes
+
+    for use_case in config['use_cases'].values():
+        if isinstance(use_case, dict):
+            use_case.setdefault('components', {})
+            use_case.setdefault('power_sources', {})
+
+    if 'max_id' not in config:
+        # 新節點 id 為 node_{max_id + 1}，取現有 node_N 中最大的 N
+        suffixes = [n['id'][len('node_'):] for n in nodes if isinstance(n['id'], str) and n['id'].startswith('node_')]
+        config['max_id'] = max((int(s) for s in suffixes if s.isdigit()), default=len(nodes))
+    config.setdefault('group_colors', {})
+    config.setdefault('component_group_notes', {n.get('group'): "" for n in components})
+    config.setdefault('battery_note', "")
+    config.setdefault('profile_dou_specs', {name: 7.0 for name in config['user_profiles']})
+    return config
+
+
+def _is_efficiency_curve(curve):
+    """[[輸出電流 (mA) >= 0, 效率 (0 ~ 1]], ...]；空 list 表示不使用曲線"""
+    return isinstance(curve, list) and all(
+        isinstance(point, (list, tuple)) and len(point) == 2 and all(_is_number(v) for v in point)
+        and point[0] >= 0 and 0 < point[1] <= 1
+        for point in curve
+    )
+
+
+def validate_config(config):
+    """
+    一次檢查設定檔的參照完整性，回傳所有問題 (空 list 表示沒有問題)：
+    節點 id 唯一、input_source_id 存在、沒有循環、電源模式參數 (含效率曲線) 與電流皆為數值、
+    Use Case 參照的模式 / 電源模式存在、Profile 參照的 Use Case 存在。
+    config 需要先經過 migrate_config。
+    """
+    problems = []
+    nodes = config['power_tree_data']['nodes']
+
+    node_ids = set()
+    power_source_ids = set()
+    for node in nodes:
+        node_id = node['id']
+        if not _is_key(node_id):
+            problems.append(f"節點 id 格式不正確: {node_id!r}")
+            continue
+        if node_id in node_ids:
+            problems.append(f"節點 id 重複: {node_id}")
+        node_ids.add(node_id)
+        if node.get('type') == 'power_source':
+            power_source_ids.add(node_id)
+        elif node.get('type') == 'component':
+            if 'group' not in node:
+                problems.append(f"元件 {node_id} 沒有 group")
+            elif not _is_key(node['group']):
+                problems.append(f"元件 {node_id} 的 group 格式不正確: {node['group']!r}")
+        else:
+            problems.append(f"節點 {node_id} 的 type 不正確: {node.get('type')!r}")
+    # id 或 input_source_id 格式不正確的節點不參與參照與循環檢查
+    linked_nodes = [node for node in nodes if _is_key(node['id'])]
+    for node in list(linked_nodes):
+        source_id = node.get('input_source_id')
+        if not _is_key(source_id):
+            problems.append(f"節點 {node['id']} 的 input_source_id 格式不正確: {source_id!r}")
+            linked_nodes.remove(node)
+        elif source_id is not None and source_id not in node_ids:
+            problems.append(f"節點 {node['id']} 的 input_source_id 不存在: {source_id}")
+    cycle_nodes = PowerTree(linked_nodes).find_cycles()
+    if cycle_nodes:
+        problems.append(f"檢測到循環依賴: {', '.join(cycle_nodes)}")
+
+    power_source_modes = config['power_source_modes']
+    for ps_id in [n['id'] for n in linked_nodes if n.get('type') == 'power_source']:
+        modes = power_source_modes.get(ps_id)
+        if not isinstance(modes, dict) or "On" not in modes:
+            problems.append(f"電源 {ps_id} 沒有 'On' 模式")
+            continue
+        for mode_name, params in modes.items():
+            for field in ('output_voltage', 'efficiency', 'quiescent_current_uA'):
+                if not _is_number(params.get(field) if isinstance(params, dict) else None):
+                    problems.append(f"電源 {ps_id} 模式 '{mode_name}' 的 {field} 不是數值")
+            curve = params.get(EFFICIENCY_CURVE_KEY) if isinstance(params, dict) else None
+            if curve is not None and not _is_efficiency_curve(curve):
+                problems.append(f"電源 {ps_id} 模式 '{mode_name}' 的效率曲線格式不正確 (需要 [[輸出電流 mA, 效率 0~1], ...])")
+
+    operating_modes = config['operating_modes']
+    for group, modes in operating_modes.items():
+        for mode_name, mode_data in (modes.items() if isinstance(modes, dict) else ()):
+            currents = mode_data.get('currents_uA', {}) if isinstance(mode_data, dict) else None
+            if not isinstance(currents, dict):
+                problems.append(f"群組 '{group}' 模式 '{mode_name}' 的 currents_uA 格式不正確")
+                continue
+            for node_id, current in currents.items():
+                if not _is_number(current):
+                    problems.append(f"群組 '{group}' 模式 '{mode_name}' 節點 {node_id} 的電流不是數值: {current!r}")
+
+    # 計算時會被忽略的參照 (ratio 為 0 的模式、已刪除的電源、時間為 0 的 Use Case) 不視為錯誤，
+    # 只回報會讓結果悄悄變成 0 或退回 'On' 模式的參照
+    for uc_name, use_case in config['use_cases'].items():
+        components = use_case.get('components') if isinstance(use_case, dict) else None
+        ps_settings = use_case.get('power_sources') if isinstance(use_case, dict) else None
+        if not isinstance(components, dict) or not isinstance(ps_settings, dict):
+            problems.append(f"Use Case '{uc_name}' 格式不正確")
+            continue
+        for group, ratios in components.items():
+            if not isinstance(ratios, dict):
+                problems.append(f"Use Case '{uc_name}' 的 {group} 比例格式不正確")
+                continue
+            group_modes = operating_modes.get(group)
+            for mode_name, ratio in ratios.items():
+                if not _is_number(ratio):
+                    problems.append(f"Use Case '{uc_name}' 的 {group} / {mode_name} 比例不是數值: {ratio!r}")
+                elif ratio > 0 and not (isinstance(group_modes, dict) and mode_name in group_modes):
+                    problems.append(f"Use Case '{uc_name}' 參照的模式不存在: {group} / {mode_name}")
+        for ps_id, ps_mode in ps_settings.items():
+            modes = power_source_modes.get(ps_id)
+            if ps_id in power_source_ids and not (isinstance(modes, dict) and _is_key(ps_mode) and ps_mode in modes):
+                problems.append(f"Use Case '{uc_name}' 參照的電源模式不存在: {ps_id} / {ps_mode}")
+
+    for profile_name, seconds in config['user_profiles'].items():
+        if not isinstance(seconds, dict):
+            problems.append(f"Profile '{profile_name}' 格式不正確")
+            continue
+        for uc_name, value in seconds.items():
+            if not _is_number(value):
+                problems.append(f"Profile '{profile_name}' 的 {uc_name} 時間不是數值: {value!r}")
+            elif value > 0 and uc_name not in config['use_cases']:
+                problems.append(f"Profile '{profile_name}' 參照的 Use Case 不存在: {uc_name}")
+    return problems
+
+
+def parse_config(data):
+    """
+    解析上傳 / 讀入的設定檔內容 (bytes，JSON 或 .pwrm 皆可)：
+    檢查必要的鍵、轉換舊版 schema，再檢查所有參照關係。
+    有任何問題時以 ConfigValidationError 一次回報全部。
+    """
+    if is_binary_config(data):
+        config = decode_config(data)
+    else:
+        config = json.loads(data.decode('utf-8'))
+    if not isinstance(config, dict):
+        raise ConfigFormatError("設定檔格式不正確")
+    missing = [key for key in REQUIRED_KEYS if key not in config]
+    if 'device_modes' not in config and 'use_cases' not in config:
+        missing.append('use_cases')
+    if missing:
+        raise ConfigFormatError(f"設定檔缺少必要的鍵: {', '.join(missing)}")
+
+    problems = _structure_problems(config)
+    if problems:
+        raise ConfigValidationError(problems)
+    problems = validate_config(migrate_config(config))
+    if problems:
+        raise ConfigValidationError(problems)
+    return config
@@ -0,0 +1,156 @@
+"""
+電流量測表批次匯入 (Bulk Current Table Import)
+
+讀取實驗室匯出的 CSV / Excel 電流表，欄位與 initialize_data 的預設表格相同：
+  Group / Mode Name / Endpoint / Current (uA) / Mode Note (可省略)
+以 (Group, Endpoint) → node id 對應到元件，一次寫入 operating_modes[group][mode]['currents_uA']：
+已存在的模式只更新表格中出現的電流，不存在的模式會以該群組所有元件電流為 0 建立。
+
+檔案分段讀取 (CSV 使用 pandas 的 chunksize，Excel 使用 openpyxl 的 read-only 模式)，
+數千、數萬列的表格不需要一次載入，也不會像逐一修改輸入框那樣每一列觸發一次 rerun。
+對應不到的列 (找不到元件、電流不是數值…) 不會寫入，而是列在 ImportSummary.unmatched 中。
+"""
+import io
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+CURRENT_TABLE_COLUMNS = ["Group", "Mode Name", "Endpoint", "Current (uA)", "Mode Note"]
+REQUIRED_COLUMNS = CURRENT_TABLE_COLUMNS[:4]
+CHUNK_ROWS = 50_000
+# 摘要中最多保留幾筆對應不到的列 (總數仍會完整計算)
+MAX_UNMATCHED_DETAILS = 1000
+
+
+class CurrentTableError(ValueError):
+    """電流表無法讀取或缺少必要欄位"""
+
+
+@dataclass
+class ImportSummary:
+    rows: int = 0
+    updated: int = 0                                          # 寫入的電流筆數
+    created_modes: list = field(default_factory=list)         # [(group, mode)]
+    updated_keys: set = field(default_factory=set)            # {(group, mode, node id)}
+    unmatched_count: int = 0
+    unmatched: list = field(default_factory=list)             # 前 MAX_UNMATCHED_DETAILS 筆
+
+    def unmatched_frame(self):
+        return pd.DataFrame(self.unmatched, columns=["Row", "Group", "Mode Name", "Endpoint", "Current (uA)", "Reason"])
+
+
+def endpoint_lookup(nodes):
+    """(group, endpoint) → 元件 node id"""
+    return {(n['group'], n['endpoint']): n['id'] for n in nodes if n['type'] == 'component'}
+
+
+def _normalize_columns(df):
+    """欄位名稱忽略大小寫與前後空白；缺少必要欄位時丟出 CurrentTableError"""
+    canonical = {name.lower(): name for name in CURRENT_TABLE_COLUMNS}
+    df = df.rename(columns=lambda c: canonical.get(str(c).strip().lower(), c))
+    missing = [name for name in REQUIRED_COLUMNS if name not in df.columns]
+    if missing:
+        raise CurrentTableError(f"缺少必要欄位: {', '.join(missing)}")
+    if "Mode Note" not in df.columns:
+        df["Mode Note"] = ""
+    return df[CURRENT_TABLE_COLUMNS]
+
+
+def _read_excel_chunks(source, chunk_rows):
+    try:
+        from openpyxl import load_workbook
+    except ImportError as e:
+        raise CurrentTableError("讀取 Excel 檔需要安裝 openpyxl") from e
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
+
+
+def read_current_table(source, filename, chunk_rows=CHUNK_ROWS):
+    """
+    依副檔名分段讀取電流表，逐段產生欄位已正規化的 DataFrame。
+    source 可以是路徑、bytes 或 file-like (例如 st.file_uploader 的 UploadedFile)。
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    suffix = str(filename).lower().rsplit('.', 1)[-1]
+    if suffix in ('xlsx', 'xlsm'):
+        chunks = _read_excel_chunks(source, chunk_rows)
+    elif suffix in ('csv', 'txt'):
+        try:
+            chunks = pd.read_csv(source, chunksize=chunk_rows, skipinitialspace=True, encoding='utf-8-sig')
+        except (pd.errors.EmptyDataError, UnicodeDecodeError) as e:
+            raise CurrentTableError(f"無法讀取 CSV: {e}") from e
+    else:
+        raise CurrentTableError(f"不支援的檔案格式: .{suffix} (支援 .csv / .xlsx)")
+    for chunk in chunks:
+        yield _normalize_columns(chunk)
+
+
+def _text(series):
+    return series.fillna("").astype(str).str.strip()
+
+
+def apply_current_rows(operating_modes, nodes, chunks, summary=None):
+    """
+    將電流表 (DataFrame 的 iterable) 一次寫入 operating_modes (直接修改傳入的 dict)，回傳 ImportSummary。
+    同一個 (group, mode, endpoint) 出現多次時以最後一列為準；Mode Note 只在非空白時覆寫。
+    """
+    summary = summary or ImportSummary()
+    lookup = endpoint_lookup(nodes)
+    group_node_ids = {}
+    for n in nodes:
+        if n['type'] == 'component':
+            group_node_ids.setdefault(n['group'], []).append(n['id'])
+
+    for chunk in chunks:
+        groups = _text(chunk["Group"]).tolist()
+        modes = _text(chunk["Mode Name"]).tolist()
+        endpoints = _text(chunk["Endpoint"]).tolist()
+        notes = _text(chunk["Mode Note"]).tolist()
+        raw_currents = chunk["Current (uA)"].tolist()
+        currents = pd.to_numeric(chunk["Current (uA)"], errors='coerce').tolist()
+
+        for i, (group, mode, endpoint, current, note) in enumerate(zip(groups, modes, endpoints, currents, notes)):
+            node_id = lookup.get((group, endpoint))
+            if node_id is None:
+                reason = "找不到元件 (Group / Endpoint)"
+            elif not mode:
+                reason = "缺少 Mode Name"
+            elif pd.isna(current):
+                reason = "電流不是數值"
+            elif current < 0:
+                reason = "電流為負數"
+            else:
+                reason = None
+            if reason:
+                summary.unmatched_count += 1
+                if len(summary.unmatched) < MAX_UNMATCHED_DETAILS:
+                    # 列號與試算表相同 (第 1 列為標題)
+                    summary.unmatched.append((summary.rows + i + 2, group, mode, endpoint, raw_currents[i], reason))
+                continue
+
+            group_modes = operating_modes.setdefault(group, {})
+            if mode not in group_modes:
+                group_modes[mode] = {"currents_uA": {nid: 0.0 for nid in group_node_ids[group]}, "note": note}
+                summary.created_modes.append((group, mode))
+            group_modes[mode].setdefault("currents_uA", {})[node_id] = float(current)
+            if note:
+                group_modes[mode]["note"] = note
+            summary.updated_keys.add((group, mode, node_id))
+            summary.updated += 1
+        summary.rows += len(chunk)
+    return summary
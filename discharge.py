@@ -0,0 +1,258 @@
+"""
+電池放電模擬 (Battery Discharge Simulation)
+
+把 Profile 中每個 Use Case 的秒數依序排成時間軸，一天接著一天重複播放，
+追蹤電池的 state of charge (SOC)，輸出 SOC 隨時間的曲線與放電到 cutoff 的天數。
+
+電池電壓只影響 battery 節點：下游 rail 的電壓固定，因此 battery 的輸出功率 (下游 rail 的輸入 +
+直接接在 battery 的元件功耗) 對電池電壓是一次函數 out_a + out_b × V，以批次引擎在兩個電壓各計算一次即可得到。
+Vsys 功耗再由 battery 自己的效率與 Iq 得到：效率固定時 P(V) 仍是一次函數；
+battery 的模式設定了效率曲線時，效率由每一步的輸出電流 (輸出功率 / V) 查表 (見 BatteryLoad)，
+之後模擬只需要陣列運算。
+
+沒有電壓曲線時電壓固定，放電量是一次 cumsum；
+有 SOC → 電壓曲線時，以「整條時間軸的 cumsum → 由 SOC 查電壓 → 重新計算電流」反覆逼近，
+每一輪都是向量化運算，通常幾輪內就收斂。
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from batch_engine import compile_model, interpolate_efficiency
+
+# 一般鋰電池 (3.85 V 標稱) 的 SOC → 開路電壓曲線，供介面預設使用
+DEFAULT_SOC_CURVE = (
+    (0.0, 3.30), (0.05, 3.55), (0.10, 3.65), (0.20, 3.72), (0.40, 3.80),
+    (0.60, 3.88), (0.80, 4.00), (0.90, 4.10), (1.0, 4.35),
+)
+MAX_ITERATIONS = 50
+VOLTAGE_TOLERANCE = 1e-6
+SECONDS_PER_DAY = 86400.0
+
+
+@dataclass(frozen=True)
+class BatteryCurve:
+    """電池電壓對 SOC (0 ~ 1) 的曲線，兩點之間線性內插"""
+    soc: tuple
+    voltage: tuple
+
+    @classmethod
+    def from_points(cls, points):
+        points = sorted((float(soc), float(voltage)) for soc, voltage in points)
+        if len(points) < 2:
+            raise ValueError("電壓曲線至少需要兩個點")
+        return cls(tuple(p[0] for p in points), tuple(p[1] for p in points))
+
+    def voltage_at(self, soc):
+        return np.interp(np.clip(soc, 0.0, 1.0), self.soc, self.voltage)
+
+
+@dataclass
+class DischargeResult:
+    """單一 Profile 的放電模擬結果 (陣列長度相同，時間單位為天)"""
+    profile: str
+    time_days: np.ndarray
+    soc: np.ndarray
+    voltage: np.ndarray
+    days_to_cutoff: float   # 模擬期間內沒有到達 cutoff 時為 NaN
+    iterations: int
+
+    def to_frame(self, max_points=None):
+        """SOC 曲線的 DataFrame；max_points 用來降低畫圖的點數"""
+        step = max(1, int(np.ceil(len(self.time_days) / max_points))) if max_points else 1
+        index = np.unique(np.r_[np.arange(0, len(self.time_days), step), len(self.time_days) - 1])
+        return pd.DataFrame({
+            "Profile": self.profile,
+            "Time (Days)": self.time_days[index],
+            "SOC (%)": self.soc[index] * 100.0,
+            "Battery Voltage (V)": self.voltage[index],
+        })
+
+
+@dataclass(frozen=True)
+class BatteryLoad:
+    """
+    每個 Use Case 的 Vsys 功耗對電池電壓的模型 (陣列依 use_case_names 的順序，最後多一個全為 0 的項目，
+    給 Profile 中不存在的 Use Case 使用)：
+        P(V) = other_mW + output(V) / efficiency + Iq × V，output(V) = out_a + out_b × V
+    curve_mode >= 0 的 Use Case，efficiency 由該電源模式的效率曲線在輸出電流 output(V) / V 查表。
+    """
+    use_case_names: tuple
+    other_mW: np.ndarray      # 其他根節點的功耗 (與電池電壓無關)
+    out_a: np.ndarray
+    out_b: np.ndarray
+    efficiency: np.ndarray
+    iq_uA: np.ndarray
+    curve_mode: np.ndarray    # battery 模式的曲線索引，-1 表示效率固定
+    curve_log_current: np.ndarray
+    curve_efficiency: np.ndarray
+
+    def index_of(self, names):
+        """Use Case 名稱 → 陣列索引 (不存在的名稱對應到最後的 0 項)"""
+        index = {name: i for i, name in enumerate(self.use_case_names)}
+        return np.array([index.get(name, -1) for name in names], dtype=np.intp)
+
+    def power_mW(self, use_case_index, voltage):
+        """每一步的 Vsys 功耗 (mW)；use_case_index 與 voltage 為相同長度的陣列"""
+        output = self.out_a[use_case_index] + self.out_b[use_case_index] * voltage
+        efficiency = self.efficiency[use_case_index]
+        curve_mode = self.curve_mode[use_case_index]
+        has_curve = curve_mode >= 0
+        if has_curve.any():
+            current_mA = np.divide(output, voltage, out=np.zeros_like(output), where=voltage > 0)
+            curve_efficiency = interpolate_efficiency(
+                self.curve_log_current, self.curve_efficiency, np.maximum(curve_mode, 0), current_mA
+            )
+            efficiency = np.where(has_curve, curve_efficiency, efficiency)
+        inv_efficiency = np.divide(1.0, efficiency, out=np.zeros_like(efficiency), where=efficiency > 0)
+        return self.other_mW[use_case_index] + output * inv_efficiency + voltage * self.iq_uA[use_case_index] / 1000.0
+
+
+def battery_load(snapshot, use_case_names, nominal_voltage):
+    """
+    建立 BatteryLoad：battery 所有非關閉 (電壓 > 0) 的模式電壓同時換成 V，在 V 與 V + 1 各計算一次，
+    由 battery rail 的輸出功率得到 out_a、out_b。battery 關閉或不存在的 Use Case 功耗固定。
+    """
+    compiled = compile_model(snapshot, use_case_names)
+    n_use_cases = len(compiled.use_case_names)
+    battery = compiled.rail_ids.index('battery') if 'battery' in compiled.rail_ids else None
+    battery_modes = [
+        p for p, (rail_id, _) in enumerate(compiled.ps_mode_keys)
+        if rail_id == 'battery' and compiled.ps_mode_voltage[p] > 0
+    ]
+    voltages = np.repeat(compiled.ps_mode_voltage[np.newaxis], 2, axis=0)
+    voltages[0, battery_modes] = nominal_voltage
+    voltages[1, battery_modes] = nominal_voltage + 1.0
+    result = compiled.evaluate(ps_mode_voltage=voltages)
+
+    other = result.total_power_mW[0].copy()
+    out_a = np.zeros(n_use_cases)
+    out_b = np.zeros(n_use_cases)
+    efficiency = np.ones(n_use_cases)
+    iq_uA = np.zeros(n_use_cases)
+    curve_mode = np.full(n_use_cases, -1, dtype=np.intp)
+    if battery is not None:
+        mode = compiled.rail_mode[:, battery]
+        # battery 關閉 (電壓 0) 或無法到達時整個功耗視為與電壓無關
+        on = (compiled.ps_mode_voltage[mode] > 0) & np.isin(battery, compiled.root_rails)
+        output = result.rail_output_power_mW[..., battery]
+        out_b[on] = output[1, on] - output[0, on]
+        out_a[on] = output[0, on] - out_b[on] * nominal_voltage
+        other[on] -= result.rail_input_power_mW[0, on, battery]
+        efficiency[on] = compiled.ps_mode_efficiency[mode[on]]
+        iq_uA[on] = compiled.ps_mode_iq_uA[mode[on]]
+        curve_mode[on] = np.where(compiled.ps_mode_has_curve[mode[on]], mode[on], -1)
+
+    def padded(values, pad):
+        return np.r_[values, pad].astype(values.dtype)
+
+    return BatteryLoad(
+        use_case_names=tuple(compiled.use_case_names),
+        other_mW=padded(other, 0.0),
+        out_a=padded(out_a, 0.0),
+        out_b=padded(out_b, 0.0),
+        efficiency=padded(efficiency, 1.0),
+        iq_uA=padded(iq_uA, 0.0),
+        curve_mode=padded(curve_mode, -1),
+        curve_log_current=compiled.curve_log_current,
+        curve_efficiency=compiled.curve_efficiency,
+    )
+
+
+def _profile_timeline(profile_data, max_days, max_step_s):
+    """
+    Profile 的時間軸：回傳 (每一步的 Use Case 名稱索引, 每一步的秒數, Use Case 名稱)。
+    每個 Use Case 依 profile 的順序連續播放，超過 max_step_s 的區段切成多步，整個週期重複到 max_days。
+    """
+    names = [name for name, seconds in profile_data.items() if seconds > 0]
+    durations = np.array([profile_data[name] for name in names], dtype=float)
+    if not names:
+        return np.zeros(0, dtype=np.intp), np.zeros(0), names
+
+    pieces = np.maximum(np.ceil(durations / max_step_s), 1).astype(np.intp)
+    cycle_index = np.repeat(np.arange(len(names)), pieces)
+    cycle_dt = np.repeat(durations / pieces, pieces)
+    n_cycles = int(np.ceil(max_days * SECONDS_PER_DAY / durations.sum()))
+    step_index = np.tile(cycle_index, n_cycles)
+    step_dt = np.tile(cycle_dt, n_cycles)
+
+    # 只保留開始時間在 max_days 之前的步驟
+    start = np.cumsum(step_dt) - step_dt
+    keep = start < max_days * SECONDS_PER_DAY
+    return step_index[keep], step_dt[keep], names
+
+
+def _first_crossing(time_days, values, threshold):
+    """values 第一次 <= threshold 的時間 (兩點之間線性內插)，沒有時回傳 NaN"""
+    below = np.flatnonzero(values <= threshold)
+    if below.size == 0:
+        return np.nan
+    i = below[0]
+    if i == 0:
+        return float(time_days[0])
+    v0, v1 = values[i - 1], values[i]
+    fraction = (v0 - threshold) / (v0 - v1) if v0 != v1 else 1.0
+    return float(time_days[i - 1] + fraction * (time_days[i] - time_days[i - 1]))
+
+
+def simulate_profile(profile_name, profile_data, load, battery_capacity_mAh, nominal_voltage,
+                     curve=None, cutoff_voltage=None, max_days=365.0, max_step_s=600.0):
+    """
+    模擬單一 Profile 的放電。load 為 battery_load 建立的 BatteryLoad。
+    沒有 curve 時電池電壓固定為 nominal_voltage；cutoff_voltage 只在有 curve 時使用。
+    """
+    step_index, step_dt, names = _profile_timeline(profile_data, max_days, max_step_s)
+    step_use_case = load.index_of(names)[step_index]
+    time_days = np.r_[0.0, np.cumsum(step_dt)] / SECONDS_PER_DAY
+    capacity_mAs = float(battery_capacity_mAh) * 3600.0
+
+    def soc_for(step_voltage):
+        power_mW = load.power_mW(step_use_case, step_voltage)
+        current_mA = np.divide(power_mW, step_voltage, out=np.zeros_like(step_voltage), where=step_voltage > 0)
+        used_mAs = np.r_[0.0, np.cumsum(current_mA * step_dt)]
+        return 1.0 - used_mAs / capacity_mAs if capacity_mAs > 0 else np.zeros_like(used_mAs)
+
+    iterations = 1
+    if curve is None:
+        soc = soc_for(np.full(len(step_dt), float(nominal_voltage)))
+        voltage = np.full(len(soc), float(nominal_voltage))
+    else:
+        # 每一步的電壓取該步開始時的 SOC，反覆更新直到電壓不再改變
+        step_voltage = np.full(len(step_dt), curve.voltage_at(1.0))
+        soc = soc_for(step_voltage)
+        for iterations in range(1, MAX_ITERATIONS + 1):
+            new_voltage = curve.voltage_at(soc[:-1])
+            converged = np.max(np.abs(new_voltage - step_voltage), initial=0.0) < VOLTAGE_TOLERANCE
+            step_voltage = new_voltage
+            soc = soc_for(step_voltage)
+            if converged:
+                break
+        voltage = curve.voltage_at(soc)
+
+    days_to_cutoff = _first_crossing(time_days, soc, 0.0)
+    if curve is not None and cutoff_voltage is not None:
+        days_to_cutoff = np.fmin(days_to_cutoff, _first_crossing(time_days, voltage, cutoff_voltage))
+
+    if not np.isnan(days_to_cutoff):
+        end = np.searchsorted(time_days, days_to_cutoff, side='right')
+        cutoff_soc = np.interp(days_to_cutoff, time_days, soc)
+        cutoff_v = np.interp(days_to_cutoff, time_days, voltage)
+        time_days = np.r_[time_days[:end], days_to_cutoff]
+        soc = np.r_[soc[:end], cutoff_soc]
+        voltage = np.r_[voltage[:end], cutoff_v]
+
+    return DischargeResult(profile_name, time_days, soc, voltage, float(days_to_cutoff), iterations)
+
+
+def simulate_discharge(snapshot, user_profiles, battery_capacity_mAh, nominal_voltage,
+                       curve=None, cutoff_voltage=None, max_days=365.0, max_step_s=600.0):
+    """模擬所有 Profile 的放電，回傳 {Profile 名稱: DischargeResult}"""
+    load = battery_load(snapshot, list(snapshot.use_cases), nominal_voltage)
+    return {
+        profile_name: simulate_profile(
+            profile_name, profile_data, load, battery_capacity_mAh, nominal_voltage,
+            curve=curve, cutoff_voltage=cutoff_voltage, max_days=max_days, max_step_s=max_step_s,
+        )
+        for profile_name, profile_data in user_profiles.items()
+    }
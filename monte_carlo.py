@@ -0,0 +1,209 @@
+"""
+Monte Carlo 公差分析 (Monte Carlo Tolerance Analysis)
+
+為元件電流 (currents_uA)、電源模式的 efficiency 與 quiescent_current_uA 指定分佈，
+抽樣大量樣本後以批次引擎 (帶前置 batch 維度) 一次計算，
+得到每個 Profile 電池壽命的分佈 (百分位數、直方圖、達到 DOU spec 的比例)。
+
+分佈都以「相對於目前數值」的百分比表示，因此同一個設定可以套用在單一項目或所有項目：
+  - normal      : 標準差 = 目前數值 × sigma %
+  - uniform     : 目前數值 × (1 ± spread %)
+  - min_typ_max : 三角分佈，typ = 目前數值，min / max = 目前數值 × (1 - low %) / (1 + high %)
+每個項目、每個樣本各自獨立抽樣 (零件之間的差異)。
+
+樣本分批計算以限制記憶體用量；各批交給 ExecutionBackend (計算量夠大時平行處理)，
+每批使用由 seed 衍生的獨立亂數序列，結果與 worker 數量無關。
+"""
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from batch_engine import compile_model
+from power_report import profile_battery_life_batch
+from parallel import IN_PROCESS
+from sweep import POWER_SOURCE_FIELDS, batch_vsys_voltage, evaluation_work
+
+DISTRIBUTIONS = {
+    'normal': "Normal (σ %)",
+    'uniform': "Uniform (± %)",
+    'min_typ_max': "Min / Typ / Max (triangular)",
+}
+TOLERANCE_KINDS = {
+    'mode_current': "Operating Mode Current (uA)",
+    'power_source': "Power Source Mode Parameter",
+}
+PERCENTILES = (1, 5, 50, 95, 99)
+# 每批樣本數上限 (實際的批次大小另受 CompiledModel.points_per_batch 的記憶體上限限制)
+CHUNK_SIZE = 2000
+MAX_SAMPLES = 200000
+
+
+@dataclass
+class Tolerance:
+    """
+    一項公差設定。target 依 kind 而定 (空 tuple 表示該類型的所有項目)：
+      mode_current : (group, 模式名稱, component id)
+      power_source : (power source id, 模式名稱, 'efficiency' 或 'quiescent_current_uA')
+                     或 (field,) 表示所有電源模式的該欄位
+    params：normal → (sigma %,)、uniform → (spread %,)、min_typ_max → (low %, high %)
+    """
+    kind: str
+    distribution: str
+    params: tuple
+    target: tuple = field(default_factory=tuple)
+
+    @property
+    def label(self):
+        target = "/".join(str(part) for part in self.target) if self.target else "all"
+        return f"{self.kind}:{target} {self.distribution}{self.params}"
+
+
+def _relative_samples(rng, tolerance, shape):
+    """抽出相對於目前數值的倍率 (平均約為 1)"""
+    if tolerance.distribution == 'normal':
+        return rng.normal(1.0, tolerance.params[0] / 100.0, size=shape)
+    if tolerance.distribution == 'uniform':
+        spread = tolerance.params[0] / 100.0
+        return rng.uniform(1.0 - spread, 1.0 + spread, size=shape)
+    if tolerance.distribution == 'min_typ_max':
+        low, high = tolerance.params[0] / 100.0, tolerance.params[1] / 100.0
+        if low == 0 and high == 0:
+            return np.ones(shape)
+        return rng.triangular(1.0 - low, 1.0, 1.0 + high, size=shape)
+    raise ValueError(f"未知的分佈: {tolerance.distribution}")
+
+
+def _resolve_targets(compiled, tolerance):
+    """
+    把 Tolerance 換算成 evaluate() 參數名稱與要抽樣的索引：
+    回傳 (參數名稱, 索引 tuple)，mode_current 的索引為 (mode 索引 array, component 索引 array)。
+    """
+    if tolerance.kind == 'mode_current':
+        if tolerance.target:
+            group, mode_name, node_id = tolerance.target
+            m = np.array([compiled.mode_keys.index((group, mode_name))])
+            c = np.array([compiled.component_ids.index(node_id)])
+        else:
+            m, c = np.nonzero(compiled.mode_currents_uA)
+        return 'mode_currents_uA', (m, c)
+    if tolerance.kind == 'power_source':
+        field_name = tolerance.target[-1] if tolerance.target else None
+        if field_name not in POWER_SOURCE_FIELDS:
+            raise ValueError(f"無法分析的電源參數: {field_name}")
+        name = 'ps_mode_efficiency' if field_name == 'efficiency' else 'ps_mode_iq_uA'
+        if len(tolerance.target) == 3:
+            ps_id, mode_name, _ = tolerance.target
+            p = np.array([compiled.ps_mode_keys.index((ps_id, mode_name))])
+        else:
+            p = np.flatnonzero(getattr(compiled, name))
+        return name, (p,)
+    raise ValueError(f"未知的公差類型: {tolerance.kind}")
+
+
+def _current_cells(compiled, resolved):
+    """
+    所有 mode_current 公差涵蓋的 (m, c) 格子 (不重複)：回傳 (mode 索引, component 索引, 每個公差在格子中的位置)。
+    只有這些格子需要抽樣，不需要建立 N × M × C 的電流陣列。
+    """
+    n_components = compiled.mode_currents_uA.shape[1]
+    flat = [index[0] * n_components + index[1] for _, (name, index) in resolved if name == 'mode_currents_uA']
+    if not flat:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), []
+    cells, inverse = np.unique(np.concatenate(flat), return_inverse=True)
+    positions = np.split(inverse, np.cumsum([len(f) for f in flat])[:-1])
+    return cells // n_components, cells % n_components, positions
+
+
+def _sample_battery_life(context, item):
+    """一批樣本的電池壽命 (n_samples × Profile)；也是 ExecutionBackend 的工作函數"""
+    compiled, resolved, current_cells, user_profiles, battery_capacity_mAh, vsys_use_case = context
+    n_samples, seed = item
+    rng = np.random.default_rng(seed)
+    cell_modes, cell_components, cell_positions = current_cells
+    currents = np.repeat(compiled.mode_currents_uA[cell_modes, cell_components][np.newaxis], n_samples, axis=0)
+    positions = iter(cell_positions)
+    overrides = {}
+    for tolerance, (name, index) in resolved:
+        factors = _relative_samples(rng, tolerance, (n_samples, len(index[0])))
+        if name == 'mode_currents_uA':
+            position = next(positions)
+            currents[:, position] = currents[:, position] * factors
+            continue
+        if name not in overrides:
+            overrides[name] = np.repeat(getattr(compiled, name)[np.newaxis], n_samples, axis=0)
+        values = overrides[name]
+        values[(slice(None),) + index] = values[(slice(None),) + index] * factors
+
+    # 電流與 Iq 不會是負數，效率介於 0 ~ 1
+    if len(cell_modes):
+        np.maximum(currents, 0.0, out=currents)
+        overrides['component_currents_uA'] = compiled.component_currents_uA(cell_modes, cell_components, currents)
+    if 'ps_mode_iq_uA' in overrides:
+        np.maximum(overrides['ps_mode_iq_uA'], 0.0, out=overrides['ps_mode_iq_uA'])
+    if 'ps_mode_efficiency' in overrides:
+        np.clip(overrides['ps_mode_efficiency'], 0.0, 1.0, out=overrides['ps_mode_efficiency'])
+
+    batch = compiled.evaluate(**overrides)
+    total_power = np.broadcast_to(batch.total_power_mW, (n_samples, len(compiled.use_case_names)))
+    vsys_voltage = batch_vsys_voltage(compiled, batch, n_samples, vsys_use_case)
+    _, battery_life_days = profile_battery_life_batch(
+        total_power, vsys_voltage, battery_capacity_mAh, user_profiles, compiled.use_case_names
+    )
+    return battery_life_days
+
+
+def run_monte_carlo(snapshot, user_profiles, battery_capacity_mAh, tolerances, n_samples,
+                    seed=None, vsys_use_case=None, backend=None, chunk_size=CHUNK_SIZE):
+    """
+    抽樣 n_samples 組參數並計算每個 Profile 的電池壽命。
+    backend：parallel.ExecutionBackend，樣本很多時各批交給多個 process 計算。
+    回傳 DataFrame：每個 Profile 一欄，每個樣本一列 (電池壽命天數)。
+    """
+    n_samples = int(n_samples)
+    if not 0 < n_samples <= MAX_SAMPLES:
+        raise ValueError(f"樣本數必須介於 1 ~ {MAX_SAMPLES}")
+    compiled = compile_model(snapshot)
+    resolved = [(tolerance, _resolve_targets(compiled, tolerance)) for tolerance in tolerances]
+
+    current_cells = _current_cells(compiled, resolved)
+
+    # 每批的樣本數同時受記憶體上限限制 (每個樣本約需數個 U × (C + S) 的陣列)
+    chunk_size = min(chunk_size, compiled.points_per_batch(len(current_cells[0])))
+    chunk_sizes = [min(chunk_size, n_samples - start) for start in range(0, n_samples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    context = (compiled, resolved, current_cells, user_profiles, battery_capacity_mAh, vsys_use_case)
+    chunks = (backend or IN_PROCESS).map(
+        _sample_battery_life, list(zip(chunk_sizes, seeds)), context=context,
+        work=evaluation_work(compiled, n_samples, len(current_cells[0])),
+    )
+    return pd.DataFrame(np.concatenate(chunks, axis=0), columns=list(user_profiles.keys()))
+
+
+def summarize_samples(df_samples, dou_specs=None):
+    """每個 Profile 的平均、標準差、百分位數，以及電池壽命達到 DOU spec 的比例"""
+    dou_specs = dou_specs or {}
+    rows = []
+    for profile_name in df_samples.columns:
+        samples = df_samples[profile_name].to_numpy()
+        row = {"Profile": profile_name, "Mean (Days)": samples.mean(), "Std (Days)": samples.std()}
+        for q, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES)):
+            row[f"P{q} (Days)"] = value
+        if profile_name in dou_specs:
+            row["Meets DOU Spec"] = float(np.mean(samples >= dou_specs[profile_name]))
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def sample_histogram(df_samples, bins=50):
+    """每個 Profile 電池壽命的直方圖 (長格式：Profile / 區間起點 / 區間終點 / 樣本數)"""
+    frames = []
+    for profile_name in df_samples.columns:
+        counts, edges = np.histogram(df_samples[profile_name].to_numpy(), bins=bins)
+        frames.append(pd.DataFrame({
+            "Profile": profile_name,
+            "Battery Life From (Days)": edges[:-1],
+            "Battery Life To (Days)": edges[1:],
+            "Samples": counts,
+        }))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
@@ -0,0 +1,204 @@
+"""
+平行執行後端 (Execution Backend)
+
+把可以獨立計算的工作 (Use Case、Profile、sweep 的點、Monte Carlo 的批次、設定檔) 分給 process pool。
+pool 依 worker 數量建立一次後持續重複使用 (同一個 worker 數量的 backend 共用同一個 pool)，不會每次 map 都重新啟動 process。
+唯讀的共用資料 (ModelSnapshot、CompiledModel…) 以 context 傳入：同一個 context 物件只 pickle 一次，
+每個 worker 依 token 快取反序列化後的 context。pickle 後的 bytes 只附在新 context 的前幾個工作上，
+其餘工作只帶 token；還沒有這個 context 的 worker 回報後，再連同 bytes 重新送出該工作。
+worker 以 forkserver (不支援時用 spawn) 啟動，不會 fork Streamlit 的多執行緒 server process。
+
+是否值得平行由「預估的單一 process 執行時間」決定：呼叫端以實測的單位成本換算 work (秒)，
+backend 再依每個工作函數在目前的 process 中實際執行的時間校正這個預估，
+只有預估時間超過 min_parallel_seconds (遠大於分派工作與傳送 context 的成本) 時才交給 pool。
+
+worker 數量依序取自：ExecutionBackend(workers=…)、環境變數 POWER_MODEL_WORKERS、CPU 數量。
+"""
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import count
+
+WORKERS_ENV = 'POWER_MODEL_WORKERS'
+# 預估執行時間低於此值 (秒) 時在目前的 process 中執行。
+# 持續存在的 pool 分派一次工作約需數 ms，加上傳送大型模型的 context (pickle / unpickle) 約數十 ms
+DEFAULT_MIN_PARALLEL_SECONDS = 0.25
+# 實測時間校正預估值時，新的量測所佔的權重
+CALIBRATION_WEIGHT = 0.5
+# 每個 worker 保留的 context 數
+WORKER_CONTEXT_CACHE_SIZE = 4
+
+_pools = {}                 # worker 數量 → _WorkerPool
+_pools_lock = threading.Lock()
+_context_tokens = count(1)
+_worker_contexts = OrderedDict()   # (worker process 內) token → context
+
+
+def default_workers():
+    value = os.environ.get(WORKERS_ENV)
+    if value:
+        try:
+            return max(int(value), 1)
+        except ValueError:
+            pass
+    return os.cpu_count() or 1
+
+
+class _MissingContext:
+    """worker 沒有這個 token 的 context 且工作沒有附上 bytes 時的回傳值 (由呼叫端附上 bytes 重送)"""
+
+
+def _start_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def _run_item(task):
+    """worker 端：依 token 取得 (必要時反序列化) context，執行 fn(context, item)"""
+    fn, token, payload, item = task
+    context = _worker_contexts.get(token)
+    if context is None:
+        if payload is None:
+            return _MissingContext()
+        context = _worker_contexts[token] = pickle.loads(payload)
+        while len(_worker_contexts) > WORKER_CONTEXT_CACHE_SIZE:
+            _worker_contexts.popitem(last=False)
+    else:
+        _worker_contexts.move_to_end(token)
+    return fn(context, item)
+
+
+class _WorkerPool:
+    """持續存在的 ProcessPoolExecutor，以及最近一次傳送的 context (物件本身、token、pickle 後的 bytes)"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=_start_context())
+        self._context = None
+        self._token = None
+        self._payload = None
+        self._sent = False
+        self._lock = threading.Lock()
+
+    def context_payload(self, context):
+        """
+        同一個 context 物件只 pickle 一次。回傳 (token, bytes, 要附上 bytes 的工作數)：
+        新的 context 附在前 workers 個工作上，之後只在 worker 回報缺少時才附上。
+        """
+        with self._lock:
+            if self._token is None or context is not self._context:
+                self._context, self._token = context, next(_context_tokens)
+                self._payload = pickle.dumps(context, protocol=pickle.HIGHEST_PROTOCOL)
+                self._sent = False
+            n_with_payload = 0 if self._sent else self.workers
+            self._sent = True
+            return self._token, self._payload, n_with_payload
+
+    def map(self, fn, items, context):
+        token, payload, n_with_payload = self.context_payload(context)
+        futures = [self.executor.submit(_run_item, (fn, token, payload if i < n_with_payload else None, item))
+                   for i, item in enumerate(items)]
+        results = [future.result() for future in futures]
+        missing = [i for i, result in enumerate(results) if isinstance(result, _MissingContext)]
+        retries = [self.executor.submit(_run_item, (fn, token, payload, items[i])) for i in missing]
+        for i, future in zip(missing, retries):
+            results[i] = future.result()
+        return results
+
+
+def _get_pool(workers):
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = _pools[workers] = _WorkerPool(workers)
+        return pool
+
+
+def _discard_pool(pool):
+    with _pools_lock:
+        for workers, existing in list(_pools.items()):
+            if existing is pool:
+                del _pools[workers]
+    pool.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pools(keep=None):
+    """關閉 worker 數量不是 keep 的所有 pool (None 表示全部關閉；下一次需要平行時會重新建立)"""
+    with _pools_lock:
+        pools = [_pools.pop(workers) for workers in list(_pools) if workers != keep]
+    for pool in pools:
+        # 不取消已送出的工作：其他 session 正在執行的 map 仍會完成，之後 process 才結束
+        pool.executor.shutdown(wait=keep is None)
+
+
+def split_evenly(items, n_chunks):
+    """把 items 依序切成最多 n_chunks 段 (長度相差最多 1)"""
+    items = list(items)
+    n_chunks = max(min(n_chunks, len(items)), 1)
+    size, extra = divmod(len(items), n_chunks)
+    chunks = []
+    start = 0
+    for i in range(n_chunks):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+def split_ranges(n_items, n_chunks):
+    """把 range(n_items) 切成最多 n_chunks 個連續的 slice (用於 numpy 陣列的第一個維度)"""
+    n_chunks = max(min(n_chunks, n_items), 1)
+    bounds = [n_items * i // n_chunks for i in range(n_chunks + 1)]
+    return [slice(start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+class ExecutionBackend:
+    """
+    fn(context, item) 形式的平行 map。fn 必須是模組層級的函數 (可以被 pickle)。
+    work 為呼叫端預估在目前的 process 中執行所需的秒數 (None 表示一定值得平行)。
+    """
+
+    def __init__(self, workers=None, min_parallel_seconds=DEFAULT_MIN_PARALLEL_SECONDS):
+        self.workers = max(int(workers), 1) if workers else default_workers()
+        self.min_parallel_seconds = min_parallel_seconds
+        self._calibration = {}   # fn → 實際時間 / 預估時間
+
+    def estimated_seconds(self, fn, work):
+        """依先前在目前的 process 中實測的時間校正後的預估秒數"""
+        return work * self._calibration.get(fn, 1.0)
+
+    def worker_count(self, n_items, work=None, fn=None):
+        """這次 map 實際使用的 process 數 (1 表示在目前的 process 中執行)"""
+        if self.workers <= 1:
+            return 1
+        if work is not None and self.estimated_seconds(fn, work) < self.min_parallel_seconds:
+            return 1
+        return max(min(self.workers, n_items), 1)
+
+    def map(self, fn, items, context=None, work=None):
+        """依 items 的順序回傳 fn(context, item) 的結果；work 為整體的預估秒數"""
+        items = list(items)
+        if self.worker_count(len(items), work, fn) <= 1:
+            start = time.perf_counter()
+            results = [fn(context, item) for item in items]
+            if work:
+                measured = (time.perf_counter() - start) / work
+                previous = self._calibration.get(fn, measured)
+                self._calibration[fn] = previous + CALIBRATION_WEIGHT * (measured - previous)
+            return results
+        pool = _get_pool(self.workers)
+        try:
+            return pool.map(fn, items, context)
+        except BrokenProcessPool:
+            # worker 異常結束時 pool 無法再使用，下一次重新建立
+            _discard_pool(pool)
+            raise
+
+
+# 只在目前的 process 中執行 (預設值，行為與加入平行後端之前相同)
+IN_PROCESS = ExecutionBackend(workers=1)
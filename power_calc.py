@@ -0,0 +1,410 @@
+"""
+純計算核心 (Pure Calculation Core)
+
+不依賴 streamlit：輸入一份不可變的 ModelSnapshot 與 Use Case 名稱，
+回傳 PowerResult，不會修改任何 session_state 中的節點 dict。
+因此可以被快取、批次或多程序呼叫，也可以在沒有 Streamlit 的環境下匯入與量測。
+"""
+import copy
+import itertools
+from dataclasses import dataclass, field, replace
+from functools import cached_property
+
+import numpy as np
+
+from power_tree import PowerTree
+
+# 由計算產生、不屬於模型本身的節點欄位
+RESULT_FIELDS = ('power_consumption', 'output_voltage', 'efficiency', 'quiescent_current_uA', 'output_power_total', 'input_power')
+# 電源模式可選的「效率 vs 輸出電流」曲線：[[輸出電流 (mA), 效率 (0 ~ 1)], ...]
+EFFICIENCY_CURVE_KEY = 'efficiency_curve'
+# 輸出電流取 log 前的下限 (mA)，無負載時取曲線最低電流點的效率
+MIN_CURVE_CURRENT_mA = 1e-9
+# ModelSnapshot 的 section：節點 (拓撲) 為單一 section，其他以群組 / 電源 / Use Case 為單位
+NODES_SECTION = ('nodes', None)
+# 修訂編號在整個 process 內唯一，不同 snapshot 的相同編號代表同一份 section 副本
+_revision_counter = itertools.count(1)
+
+
+@dataclass(frozen=True)
+class EfficiencyCurve:
+    """
+    效率對輸出電流的內插表。電流軸取 log10 後線性內插 (DC-DC 效率曲線通常畫在對數電流軸上)，
+    超出曲線範圍時取端點的效率。
+    """
+    log_current: tuple
+    efficiency: tuple
+
+    @classmethod
+    def from_points(cls, points):
+        points = sorted((float(current_mA), float(efficiency)) for current_mA, efficiency in points)
+        if not points:
+            raise ValueError("效率曲線至少需要一個點")
+        if len(points) == 1:
+            points = points * 2
+        return cls(
+            tuple(np.log10(max(current_mA, MIN_CURVE_CURRENT_mA)) for current_mA, _ in points),
+            tuple(efficiency for _, efficiency in points),
+        )
+
+    def efficiency_at(self, output_current_mA):
+        return np.interp(np.log10(np.maximum(output_current_mA, MIN_CURVE_CURRENT_mA)), self.log_current, self.efficiency)
+
+
+def output_current_mA(output_power_mW, output_voltage):
+    """電源的輸出電流 (mA)；關閉 (電壓為 0) 時為 0"""
+    return output_power_mW / output_voltage if output_voltage > 0 else 0.0
+
+
+@dataclass(frozen=True)
+class ModelSnapshot:
+    """
+    計算所需的模型資料快照。建立時會深度複製，之後視為唯讀，
+    不會受到 session_state 後續修改的影響。
+    revisions = {section: 修訂編號}：由 SnapshotBuilder 建立時，內容沒有改變的 section 與上一份 snapshot
+    共用同一個副本與編號，快取可以依編號判斷哪些部分需要重新計算。
+    """
+    nodes: tuple
+    power_source_modes: dict
+    operating_modes: dict
+    use_cases: dict
+    revisions: dict = field(default_factory=dict, compare=False, repr=False)
+
+    @classmethod
+    def from_state(cls, state):
+        """由 session_state (或任何具有相同 key 的 mapping，例如讀入的設定檔) 建立快照"""
+        return cls(
+            nodes=tuple(copy.deepcopy(state['power_tree_data']['nodes'])),
+            power_source_modes=copy.deepcopy(state['power_source_modes']),
+            operating_modes=copy.deepcopy(state['operating_modes']),
+            use_cases=copy.deepcopy(state['use_cases']),
+        )
+
+    def sections(self):
+        """(section, 內容) 依 NODES_SECTION、operating_modes、power_source_modes、use_cases 的順序"""
+        yield NODES_SECTION, self.nodes
+        for kind in ('operating_modes', 'power_source_modes', 'use_cases'):
+            for key, value in getattr(self, kind).items():
+                yield (kind, key), value
+
+    def section_revisions(self):
+        """
+        所有 section 的修訂編號。直接以 from_state 建立的 snapshot 沒有記錄，
+        每個 section 取一個新的編號 (只與自己相同，不會命中其他 snapshot 的快取)。
+        """
+        for section, _ in self.sections():
+            if section not in self.revisions:
+                self.revisions[section] = next(_revision_counter)
+        return self.revisions
+
+    @cached_property
+    def tree(self):
+        return PowerTree(list(self.nodes))
+
+    @cached_property
+    def efficiency_curves(self):
+        """{(power source id, 模式名稱): EfficiencyCurve}，只包含設定了效率曲線的模式 (建立一次後重複使用)"""
+        return {
+            (ps_id, mode_name): EfficiencyCurve.from_points(params[EFFICIENCY_CURVE_KEY])
+            for ps_id, modes in self.power_source_modes.items()
+            for mode_name, params in modes.items()
+            if params.get(EFFICIENCY_CURVE_KEY)
+        }
+
+
+class SnapshotBuilder:
+    """
+    由會被直接修改的 mapping (session_state) 重複建立 ModelSnapshot。
+    每個 section 先與上一次的副本比較 (dict 比較在 C 層完成，成本遠低於深度複製)，
+    只有內容改變的 section 才重新複製並取得新的修訂編號，其他 section 與上一份 snapshot 共用副本。
+    所有 section 都沒有改變時回傳上一份 snapshot 本身。
+    """
+
+    def __init__(self):
+        self.snapshot = None
+        self._sections = {}   # section → (原始資料的比較用副本, snapshot 使用的副本, 修訂編號)
+
+    def _section(self, section, value, revisions, freeze=None):
+        entry = self._sections.get(section)
+        if entry is None or entry[0] != value:
+            copied = copy.deepcopy(value)
+            entry = (copied, freeze(copied) if freeze else copied, next(_revision_counter))
+        self._sections[section] = entry
+        revisions[section] = entry[2]
+        return entry[1]
+
+    def build(self, state):
+        revisions = {}
+        nodes = self._section(NODES_SECTION, state['power_tree_data']['nodes'], revisions, freeze=tuple)
+        sections = {
+            kind: {key: self._section((kind, key), value, revisions) for key, value in state[kind].items()}
+            for kind in ('operating_modes', 'power_source_modes', 'use_cases')
+        }
+        # 已刪除的群組 / 電源 / Use Case 不再保留副本
+        for section in [section for section in self._sections if section not in revisions]:
+            del self._sections[section]
+
+        previous = self.snapshot
+        if previous is not None and list(previous.revisions.items()) == list(revisions.items()):
+            return previous
+        snapshot = ModelSnapshot(nodes=nodes, revisions=revisions, **sections)
+        if previous is not None:
+            # 拓撲 / 電源模式沒有改變時沿用已建立的索引與效率曲線
+            if previous.revisions.get(NODES_SECTION) == revisions[NODES_SECTION] and 'tree' in previous.__dict__:
+                snapshot.__dict__['tree'] = previous.tree
+            ps_sections = [section for section in revisions if section[0] == 'power_source_modes']
+            if 'efficiency_curves' in previous.__dict__ and all(
+                previous.revisions.get(section) == revisions[section] for section in ps_sections
+            ) and len(ps_sections) == len(previous.power_source_modes):
+                snapshot.__dict__['efficiency_curves'] = previous.efficiency_curves
+        self.snapshot = snapshot
+        return snapshot
+
+
+@dataclass(frozen=True)
+class PowerResult:
+    """單一 Use Case 的計算結果 (各欄位皆為 node id → 數值)"""
+    use_case: str
+    total_power_mW: float
+    power_consumption: dict = field(default_factory=dict)     # component → mW
+    output_voltage: dict = field(default_factory=dict)        # power source → V
+    efficiency: dict = field(default_factory=dict)
+    quiescent_current_uA: dict = field(default_factory=dict)
+    output_power_total: dict = field(default_factory=dict)    # 只有可到達的 power source
+    input_power: dict = field(default_factory=dict)
+
+    def node_view(self, node):
+        """回傳套用此結果後的節點副本 (供圖表 / 表格顯示)"""
+        view = {k: v for k, v in node.items() if k not in RESULT_FIELDS}
+        node_id = node['id']
+        for name in RESULT_FIELDS:
+            values = getattr(self, name)
+            if node_id in values:
+                view[name] = values[node_id]
+        return view
+
+    def node_views(self, snapshot):
+        return {node['id']: self.node_view(node) for node in snapshot.nodes}
+
+
+def resolve_power_source_mode_name(snapshot, node, ps_settings):
+    """依 Use Case 設定取得電源模式名稱 (找不到時退回 'On' 模式)"""
+    ps_mode_name = ps_settings.get(node['id'], "On")
+    if ps_mode_name not in snapshot.power_source_modes.get(node['id'], {}):
+        ps_mode_name = "On"
+    return ps_mode_name
+
+
+def _resolve_rail_efficiency(snapshot, node_id, mode_name, output_power, output_voltage, efficiency):
+    """有效率曲線的電源模式：依目前的輸出電流由曲線取得效率並寫入 efficiency"""
+    curve = snapshot.efficiency_curves.get((node_id, mode_name))
+    if curve is not None:
+        efficiency[node_id] = float(curve.efficiency_at(output_current_mA(output_power, output_voltage[node_id])))
+
+
+def _rail_input_power(tree, node, output_power, output_voltage, efficiency, quiescent_current_uA):
+    """電源的輸入功耗 = 輸出功耗 / 效率 + 輸入電壓 × Iq (根節點以自身輸出電壓計算 Iq)"""
+    node_id = node['id']
+    node_efficiency = efficiency.get(node_id, 1.0)
+    input_power_from_load = output_power / node_efficiency if node_efficiency > 0 else 0
+
+    input_source_id = node.get('input_source_id')
+    if tree.get(input_source_id):
+        input_voltage = output_voltage.get(input_source_id, 0.0)
+    else:
+        input_voltage = output_voltage[node_id]
+    quiescent_power = input_voltage * (quiescent_current_uA.get(node_id, 0.0) / 1000.0)
+    return input_power_from_load + quiescent_power
+
+
+def _component_load(tree, node, power_consumption, output_voltage):
+    """元件對上游電源的負載 (上游電源關閉時為 0)"""
+    source_id = node.get('input_source_id')
+    if tree.get(source_id) and output_voltage.get(source_id, 0.0) == 0:
+        return 0.0
+    return power_consumption.get(node['id'], 0.0)
+
+
+def evaluate_use_case(snapshot, use_case_name):
+    """
+    計算單一 Use Case 的功耗 (與原本 apply_use_case + calculate_power 的語意相同)：
+      1. 依 Use Case 選擇各電源模式 (電壓 / 效率 / Iq)
+      2. 元件功耗 = 上游電壓 × Σ(ratio × 模式電流)
+      3. 依反向拓撲順序單次走訪，計算每個電源的輸出 / 輸入功耗
+         (電源的輸出功耗在走訪到它時已經確定，有效率曲線的模式在此時由輸出電流查出效率，不需要迭代)
+    """
+    tree = snapshot.tree
+    use_case = snapshot.use_cases[use_case_name]
+
+    output_voltage = {}
+    efficiency = {}
+    quiescent_current_uA = {}
+    ps_mode_names = {}
+    ps_settings = use_case.get("power_sources", {})
+    for node in snapshot.nodes:
+        if node['type'] == 'power_source':
+            ps_mode_names[node['id']] = resolve_power_source_mode_name(snapshot, node, ps_settings)
+            mode_params = snapshot.power_source_modes[node['id']][ps_mode_names[node['id']]]
+            output_voltage[node['id']] = mode_params['output_voltage']
+            efficiency[node['id']] = mode_params['efficiency']
+            quiescent_current_uA[node['id']] = mode_params['quiescent_current_uA']
+
+    power_consumption = {}
+    comp_settings = use_case.get("components", {})
+    for node in snapshot.nodes:
+        if node['type'] != 'component':
+            continue
+        group_ratios = comp_settings.get(node['group'])
+        if not group_ratios:
+            power_consumption[node['id']] = 0.0
+            continue
+        source_id = node.get('input_source_id')
+        source_node = tree.get(source_id)
+        current_voltage = 0.0
+        if source_node:
+            current_voltage = output_voltage.get(source_id, source_node.get('output_voltage', 0.0))
+
+        group_modes = snapshot.operating_modes.get(node['group'], {})
+        weighted_power = 0.0
+        for mode_name, ratio in group_ratios.items():
+            if ratio > 0:
+                current_uA = group_modes.get(mode_name, {}).get('currents_uA', {}).get(node['id'], 0.0)
+                weighted_power += current_voltage * (current_uA / 1000.0) * (ratio / 100.0)
+        power_consumption[node['id']] = weighted_power
+
+    output_power_total = {}
+    input_power = {}
+    node_power = {}
+    for node_id in reversed(tree.topological_order()):
+        node = tree.by_id[node_id]
+        if node['type'] == 'component':
+            node_power[node_id] = _component_load(tree, node, power_consumption, output_voltage)
+            continue
+
+        total_downstream_power = sum(node_power[child_id] for child_id in tree.children[node_id])
+        output_power_total[node_id] = total_downstream_power
+        _resolve_rail_efficiency(snapshot, node_id, ps_mode_names[node_id], total_downstream_power, output_voltage, efficiency)
+        node_power[node_id] = _rail_input_power(tree, node, total_downstream_power, output_voltage, efficiency, quiescent_current_uA)
+        input_power[node_id] = node_power[node_id]
+
+    return PowerResult(
+        use_case=use_case_name,
+        total_power_mW=sum(node_power[root_id] for root_id in tree.roots),
+        power_consumption=power_consumption,
+        output_voltage=output_voltage,
+        efficiency=efficiency,
+        quiescent_current_uA=quiescent_current_uA,
+        output_power_total=output_power_total,
+        input_power=input_power,
+    )
+
+
+def propagate_component_power(snapshot, result, node_id, new_power_mW):
+    """
+    單一元件功耗改變時的增量計算：
+    只沿著該元件到 Vsys 的上游路徑 (與 trace_power_to_root 相同的路徑) 重新計算，
+    走訪成本為 O(depth)，回傳新的 PowerResult (原本的 result 不會被修改)。
+    """
+    tree = snapshot.tree
+    node = tree.by_id[node_id]
+    power_consumption = dict(result.power_consumption)
+    old_load = _component_load(tree, node, power_consumption, result.output_voltage)
+    power_consumption[node_id] = new_power_mW
+    delta = _component_load(tree, node, power_consumption, result.output_voltage) - old_load
+
+    source_id = node.get('input_source_id')
+    if source_id is not None and source_id not in result.output_power_total:
+        # 無法到達 Vsys 的元件 (上游不存在或在循環上) 不影響總功耗
+        return replace(result, power_consumption=power_consumption)
+
+    output_power_total = dict(result.output_power_total)
+    input_power = dict(result.input_power)
+    efficiency = dict(result.efficiency)
+    ps_settings = snapshot.use_cases[result.use_case].get("power_sources", {})
+    total_power_mW = result.total_power_mW
+    current_id = source_id
+    while current_id is not None and delta != 0:
+        rail = tree.by_id[current_id]
+        if rail['type'] != 'power_source':
+            # 接在元件下的節點不計入 (與 evaluate_use_case 相同)
+            delta = 0
+            break
+        output_power_total[current_id] += delta
+        if snapshot.efficiency_curves:
+            mode_name = resolve_power_source_mode_name(snapshot, rail, ps_settings)
+            _resolve_rail_efficiency(snapshot, current_id, mode_name, output_power_total[current_id], result.output_voltage, efficiency)
+        new_input_power = _rail_input_power(
+            tree, rail, output_power_total[current_id],
+            result.output_voltage, efficiency, result.quiescent_current_uA
+        )
+        delta = new_input_power - input_power[current_id]
+        input_power[current_id] = new_input_power
+        current_id = tree.parent.get(current_id)
+    total_power_mW += delta
+
+    return replace(
+        result,
+        total_power_mW=total_power_mW,
+        power_consumption=power_consumption,
+        efficiency=efficiency,
+        output_power_total=output_power_total,
+        input_power=input_power,
+    )
+
+
+def propagate_mode_current_change(snapshot, result, group, mode_name, node_id, old_current_uA, new_current_uA):
+    """
+    operating_modes[group][mode_name]['currents_uA'][node_id] 由舊值改為新值時，
+    依此 Use Case 的 ratio 換算元件功耗變化，再以 propagate_component_power 更新上游路徑。
+    """
+    tree = snapshot.tree
+    node = tree.get(node_id)
+    group_ratios = snapshot.use_cases[result.use_case].get('components', {}).get(group)
+    ratio = (group_ratios or {}).get(mode_name, 0)
+    if node is None or node.get('group') != group or not group_ratios or not ratio > 0:
+        return result
+
+    source_id = node.get('input_source_id')
+    source_node = tree.get(source_id)
+    current_voltage = 0.0
+    if source_node:
+        current_voltage = result.output_voltage.get(source_id, source_node.get('output_voltage', 0.0))
+    delta_current_uA = new_current_uA - (old_current_uA or 0.0)
+    delta_power = current_voltage * (delta_current_uA / 1000.0) * (ratio / 100.0)
+    return propagate_component_power(snapshot, result, node_id, result.power_consumption.get(node_id, 0.0) + delta_power)
+
+
+def vsys_multipliers(snapshot, result):
+    """
+    每個節點的負載換算成 Vsys 功耗的倍率：從該節點到根節點路徑上 (不含根節點) 各節點 1/效率 的乘積。
+    依拓撲順序由上而下單次計算 (子節點倍率 = 上游倍率 / 自身效率)，
+    取代對每個負載各自往上追溯的 trace_power_to_root。
+    上游不存在的節點視為直接接在 Vsys；位於循環上的節點倍率為 0。
+    """
+    tree = snapshot.tree
+
+    def step(node_id, parent_multiplier):
+        efficiency = result.efficiency.get(node_id, 1.0)
+        return parent_multiplier / efficiency if efficiency > 0 else 0.0
+
+    multipliers = {}
+    for node_id in tree.topological_order():
+        parent_id = tree.parent[node_id]
+        multipliers[node_id] = 1.0 if parent_id is None else step(node_id, multipliers[parent_id])
+
+    # 無法從根節點到達的節點 (很少見)：往上找到已知倍率或斷開的上游後再往下套用
+    for start_id in tree.by_id:
+        if start_id in multipliers:
+            continue
+        path = []
+        on_path = set()
+        node_id = start_id
+        while node_id in tree.by_id and node_id not in multipliers and node_id not in on_path:
+            path.append(node_id)
+            on_path.add(node_id)
+            node_id = tree.parent.get(node_id)
+        base = 0.0 if node_id in on_path else multipliers.get(node_id, 1.0)
+        for node_id in reversed(path):
+            base = step(node_id, base)
+            multipliers[node_id] = base
+    return multipliers
@@ -0,0 +1,134 @@
+"""
+命令列批次工具 (Headless Batch Runner)
+
+讀取側邊欄「下載設定檔」所產生的 power_model_config.json / .pwrm (或整個資料夾的設定檔)，
+計算所有 Use Case 的功耗、每個 Profile 的電池壽命與平均功耗分佈，輸出成 CSV / JSON / Parquet。
+多個設定檔會交給 ExecutionBackend (process pool) 平行處理，不需要開啟瀏覽器。
+
+用法：
+    python power_cli.py power_model_config.json
+    python power_cli.py configs/ -o results --format parquet --jobs 8
+"""
+import argparse
+import importlib.util
+import os
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+from config_io import parse_config
+from parallel import WORKERS_ENV, ExecutionBackend
+from power_report import config_report
+
+OUTPUT_FORMATS = ('csv', 'json', 'parquet')
+CONFIG_SUFFIXES = ('.json', '.pwrm')
+PARQUET_ENGINES = ('pyarrow', 'fastparquet')
+
+
+def load_config(path):
+    """讀取設定檔 (.json 或 .pwrm，與側邊欄「讀取設定檔」相同的檢查)"""
+    with open(path, 'rb') as f:
+        return parse_config(f.read())
+
+
+def run_config_file(path):
+    """計算一個設定檔：回傳 (設定檔路徑, 結果表格, 錯誤訊息)"""
+    try:
+        return path, config_report(load_config(path)), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def _run_config_job(_, path):
+    return run_config_file(path)
+
+
+def write_table(df, path_without_suffix, output_format):
+    path = f"{path_without_suffix}.{output_format}"
+    if output_format == 'csv':
+        df.to_csv(path, index=False)
+    elif output_format == 'json':
+        df.to_json(path, orient='records', indent=2, force_ascii=False)
+    else:
+        df.to_parquet(path, index=False)
+    return path
+
+
+def missing_format_dependency(output_format):
+    """輸出格式缺少的套件說明 (不缺時回傳 None)；在計算前檢查，不會算完才失敗"""
+    if output_format == 'parquet' and not any(importlib.util.find_spec(engine) for engine in PARQUET_ENGINES):
+        return "輸出 parquet 需要安裝 pyarrow (pip install pyarrow) 或 fastparquet"
+    return None
+
+
+def output_names(config_paths):
+    """
+    每個設定檔的輸出資料夾名稱：預設為檔名 (不含副檔名)，
+    同名的 .json / .pwrm 同時存在時改用完整檔名，避免互相覆寫。
+    """
+    stems = [Path(path).stem for path in config_paths]
+    return {
+        path: Path(path).name if stems.count(stem) > 1 else stem
+        for path, stem in zip(config_paths, stems)
+    }
+
+
+def find_configs(target):
+    """單一檔案直接回傳；資料夾則回傳其中所有 .json / .pwrm 設定檔 (依名稱排序)"""
+    target = Path(target)
+    if target.is_dir():
+        return sorted(str(p) for p in target.iterdir() if p.suffix in CONFIG_SUFFIXES)
+    return [str(target)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute use case power, battery life and breakdown from power_model_config.json files.")
+    parser.add_argument("target", help="config file, or a directory of config files")
+    parser.add_argument("-o", "--output-dir", default="power_results", help="output directory (default: power_results)")
+    parser.add_argument("-f", "--format", choices=OUTPUT_FORMATS, default="csv", help="output format (default: csv)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help=f"worker processes for multiple configs (default: ${WORKERS_ENV} or CPU count)")
+    args = parser.parse_args(argv)
+
+    config_paths = find_configs(args.target)
+    if not config_paths:
+        print(f"找不到設定檔: {args.target}", file=sys.stderr)
+        return 2
+    missing = missing_format_dependency(args.format)
+    if missing:
+        print(missing, file=sys.stderr)
+        return 2
+    names = output_names(config_paths)
+
+    # 每個設定檔各自獨立，數量多於一個時一律值得平行
+    outcomes = ExecutionBackend(workers=args.jobs).map(_run_config_job, config_paths)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    summary_frames = []
+    failed = 0
+    for path, tables, error in outcomes:
+        if error:
+            failed += 1
+            print(f"[FAILED] {path}: {error}", file=sys.stderr)
+            continue
+        name = names[path]
+        config_dir = os.path.join(args.output_dir, name)
+        os.makedirs(config_dir, exist_ok=True)
+        try:
+            for table_name, df in tables.items():
+                write_table(df, os.path.join(config_dir, table_name), args.format)
+        except ImportError as e:
+            # Parquet 需要 pyarrow 或 fastparquet
+            print(f"無法輸出 {args.format}: {e}", file=sys.stderr)
+            return 2
+        summary_frames.append(tables["battery_life"].assign(config=name))
+        print(f"[OK] {path} -> {config_dir}")
+
+    if len(config_paths) > 1 and summary_frames:
+        summary_path = write_table(pd.concat(summary_frames, ignore_index=True), os.path.join(args.output_dir, "summary"), args.format)
+        print(f"Summary: {summary_path}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,332 @@
+"""
+功耗報表 (Power Reports)
+
+Vsys 功耗分佈、Profile 平均功耗分佈與電池壽命的計算，
+只依賴 ModelSnapshot / PowerResult 與 pandas，不依賴 streamlit，
+因此 Streamlit 介面與命令列批次工具 (power_cli.py) 共用同一份邏輯。
+"""
+import numpy as np
+import pandas as pd
+
+from batch_engine import evaluate_use_cases
+from parallel import IN_PROCESS, split_evenly
+from power_calc import ModelSnapshot, vsys_multipliers
+
+CONTRIBUTION_COLUMNS = ["source", "power_mW", "type"]
+DEFAULT_VSYS_VOLTAGE = 3.85
+# contribution_matrix 每個 Use Case 的分佈表 (DataFrame) 實測約 6.5 ~ 9 ms
+CONTRIBUTION_SECONDS_PER_USE_CASE = 7e-3
+
+
+def vsys_referred_contributions(result, snapshot):
+    """
+    每個元件群組與每個電源 Iq 損耗換算到 Vsys 的功耗。
+    Vsys 倍率 (路徑上 1/效率 的乘積) 由 vsys_multipliers 單次計算，
+    這裡只需要一次向量化相乘再依群組加總。
+    """
+    tree = snapshot.tree
+    multipliers = vsys_multipliers(snapshot, result)
+
+    # --- 1. 元件負載 (已包含工作功耗 + 上游效率損耗)，以 Group 為單位 ---
+    component_nodes = [
+        n for n in snapshot.nodes
+        if n['type'] == 'component' and result.power_consumption.get(n['id'], 0) > 0
+    ]
+    component_load_mW = np.array([result.power_consumption[n['id']] for n in component_nodes], dtype=float)
+    component_multiplier = np.array([multipliers.get(n.get('input_source_id'), 1.0) for n in component_nodes], dtype=float)
+    df_components = pd.DataFrame({
+        "source": [n['group'] for n in component_nodes],
+        "power_mW": component_load_mW * component_multiplier,
+        "type": "Component Load",
+    })
+
+    # --- 2. 靜態電流 (Iq) 損耗：輸入電壓 × Iq，從上游電源開始換算 ---
+    iq_nodes = [
+        n for n in snapshot.nodes
+        if n['type'] == 'power_source' and result.quiescent_current_uA.get(n['id'], 0.0) > 0
+    ]
+    iq_parent_ids = [n.get('input_source_id') if tree.get(n.get('input_source_id')) else None for n in iq_nodes]
+    input_voltage = np.array([
+        result.output_voltage.get(parent_id, 0.0) if parent_id else result.output_voltage.get(n['id'], 0.0)
+        for n, parent_id in zip(iq_nodes, iq_parent_ids)
+    ], dtype=float)
+    iq_mA = np.array([result.quiescent_current_uA[n['id']] for n in iq_nodes], dtype=float) / 1000.0
+    iq_multiplier = np.array([multipliers.get(parent_id, 1.0) for parent_id in iq_parent_ids], dtype=float)
+    df_losses = pd.DataFrame({
+        "source": [f"{n['label']} (Iq Loss)" for n in iq_nodes],
+        "power_mW": input_voltage * iq_mA * iq_multiplier,
+        "type": "Quiescent Loss",
+    })
+    df_losses = df_losses[df_losses['power_mW'] > 0.0001]
+
+    if df_components.empty and df_losses.empty:
+        return pd.DataFrame(columns=CONTRIBUTION_COLUMNS)
+
+    # --- 3. GroupBy：元件依群組加總，Iq 損耗每個電源各自一項 ---
+    if not df_components.empty:
+        df_components = df_components.groupby('source').agg(
+            power_mW=('power_mW', 'sum'),
+            type=('type', 'first')
+        ).reset_index()
+    return pd.concat([df_components, df_losses], ignore_index=True)
+
+
+def _contribution_frames(snapshot, result_items):
+    return [vsys_referred_contributions(result, snapshot).assign(use_case=name) for name, result in result_items]
+
+
+def contribution_matrix(snapshot, results, backend=None):
+    """
+    (use case × 貢獻來源) 的 Vsys 功耗矩陣，沒有該來源的 Use Case 為 NaN。
+    results = {use case 名稱: PowerResult}，回傳 (matrix, {來源: 類型})。
+    backend 為 parallel.ExecutionBackend 時，各 Use Case 的分佈分段交給多個 process 計算。
+    欄位順序：元件群組依名稱排序，之後是依節點順序的 Iq 損耗 (與單一 Use Case 的分佈表相同)。
+    """
+    use_case_names = list(results.keys())
+    backend = backend or IN_PROCESS
+    work = len(use_case_names) * CONTRIBUTION_SECONDS_PER_USE_CASE
+    chunks = split_evenly(list(results.items()), backend.worker_count(len(use_case_names), work, _contribution_frames))
+    chunk_frames = backend.map(_contribution_frames, chunks, context=snapshot, work=work)
+    frames = [frame for frames_of_chunk in chunk_frames for frame in frames_of_chunk]
+    if not frames:
+        return pd.DataFrame(), {}
+    df_all = pd.concat(frames, ignore_index=True).astype({'power_mW': float})
+    source_types = dict(zip(df_all['source'][::-1], df_all['type'][::-1])) # 保留第一次出現的類型
+
+    component_sources = sorted(df_all.loc[df_all['type'] == 'Component Load', 'source'].unique())
+    loss_sources = set(df_all.loc[df_all['type'] == 'Quiescent Loss', 'source'])
+    loss_sources = list(dict.fromkeys(
+        f"{n['label']} (Iq Loss)" for n in snapshot.nodes
+        if n['type'] == 'power_source' and f"{n['label']} (Iq Loss)" in loss_sources
+    ))
+    matrix = df_all.pivot_table(index='use_case', columns='source', values='power_mW', aggfunc='sum')
+    matrix = matrix.reindex(index=use_case_names, columns=component_sources + loss_sources)
+    return matrix, source_types
+
+
+def _vsys_multiplier(tree, efficiency, node_id):
+    """單一節點的 Vsys 倍率 (與 vsys_multipliers 相同)，只沿上游路徑計算 (O(depth))"""
+    multiplier = 1.0
+    while tree.parent.get(node_id) is not None:
+        node_efficiency = efficiency.get(node_id, 1.0)
+        if node_efficiency <= 0:
+            return 0.0
+        multiplier /= node_efficiency
+        node_id = tree.parent[node_id]
+    return multiplier
+
+
+def _subtree_contributions(snapshot, result, top_id):
+    """top_id 子樹中的節點在 vsys_referred_contributions 中的貢獻 {來源: mW} (與其相同的計入條件)"""
+    tree = snapshot.tree
+    parent_id = tree.parent[top_id]
+    multipliers = {parent_id: _vsys_multiplier(tree, result.efficiency, parent_id)}
+    contributions = {}
+    stack = [top_id]
+    while stack:
+        node_id = stack.pop()
+        node = tree.by_id[node_id]
+        parent_multiplier = multipliers[tree.parent[node_id]]
+        node_efficiency = result.efficiency.get(node_id, 1.0)
+        multipliers[node_id] = parent_multiplier / node_efficiency if node_efficiency > 0 else 0.0
+        if node['type'] == 'component':
+            load = result.power_consumption.get(node_id, 0)
+            if load > 0:
+                contributions[node['group']] = contributions.get(node['group'], 0.0) + load * parent_multiplier
+        elif result.quiescent_current_uA.get(node_id, 0.0) > 0:
+            loss = result.output_voltage.get(tree.parent[node_id], 0.0) * result.quiescent_current_uA[node_id] / 1000.0 * parent_multiplier
+            if loss > 0.0001:
+                label = f"{node['label']} (Iq Loss)"
+                contributions[label] = contributions.get(label, 0.0) + loss
+        stack.extend(tree.children.get(node_id, ()))
+    return contributions
+
+
+def _row_delta(snapshot, node, previous, updated):
+    """
+    一個 Use Case 的矩陣列在單一元件功耗改變後的變化：(修改前, 修改後) 的受影響貢獻 {來源: mW}。
+    上游效率沒有改變時只有該元件的一項 (功耗 × 上游路徑的 Vsys 倍率，O(depth))；
+    效率曲線使路徑上的效率改變時，重新計算最上層效率改變的電源以下的子樹。
+    元件無法到達 Vsys 時回傳 None。
+    """
+    tree = snapshot.tree
+    source_id = node.get('input_source_id')
+    if source_id not in previous.output_power_total:
+        return None
+    # 根節點 (Vsys) 的效率不在任何倍率中，只需要檢查根節點以下的電源
+    top_id = None
+    rail_id = source_id
+    while tree.parent.get(rail_id) is not None:
+        if previous.efficiency.get(rail_id) != updated.efficiency.get(rail_id):
+            top_id = rail_id
+        rail_id = tree.parent[rail_id]
+    if top_id is not None:
+        return _subtree_contributions(snapshot, previous, top_id), _subtree_contributions(snapshot, updated, top_id)
+
+    multiplier = _vsys_multiplier(tree, previous.efficiency, source_id)
+    group = node.get('group')
+    old_load = previous.power_consumption.get(node['id'], 0)
+    new_load = updated.power_consumption.get(node['id'], 0)
+    return (
+        {group: old_load * multiplier} if old_load > 0 else {},
+        {group: new_load * multiplier} if new_load > 0 else {},
+    )
+
+
+def update_contribution_matrix(matrix, snapshot, node_id, changes):
+    """
+    單一元件電流修改後，就地更新 contribution_matrix 中受影響的 Use Case。
+    changes = [(use case 名稱, 修改前 PowerResult, 修改後 PowerResult)] (propagate_mode_current_change 的前後結果)，
+    每一列只加上受影響來源的變化量 (見 _row_delta)；來源可能由有變無 (格子需要變成 NaN) 時重新計算該列。
+    出現矩陣中沒有的 Use Case 或來源時回傳 False (需要整個重建)。
+    """
+    node = snapshot.tree.get(node_id)
+    if node is None:
+        return False
+    for name, previous, updated in changes:
+        if name not in matrix.index:
+            return False
+        if updated.power_consumption.get(node_id) == previous.power_consumption.get(node_id) and updated.efficiency == previous.efficiency:
+            continue
+        delta = _row_delta(snapshot, node, previous, updated)
+        if delta is not None:
+            old, new = delta
+            cells = {source: matrix.at[name, source] for source in new if source in matrix.columns}
+            if not (old.keys() - new.keys()) and len(cells) == len(new) and not any(np.isnan(v) for v in cells.values()):
+                for source, value in new.items():
+                    matrix.at[name, source] = cells[source] + value - old.get(source, 0.0)
+                continue
+        row = vsys_referred_contributions(updated, snapshot)
+        if not set(row['source']) <= set(matrix.columns):
+            return False
+        matrix.loc[name] = row.groupby('source')['power_mW'].sum().astype(float).reindex(matrix.columns)
+    return True
+
+
+def profile_breakdown(matrix, source_types, profile_data):
+    """
+    一個 User Profile 的「加權平均」功耗分佈。
+    平均功耗 = 各 Use Case 秒數向量 × (use case × 貢獻來源) 功耗矩陣 / 總秒數。
+    """
+    total_seconds = sum(profile_data.values())
+    if total_seconds == 0:
+        total_seconds = 86400 # 避免除以零
+
+    # 只計入秒數 > 0 的 Use Case
+    seconds = pd.Series(profile_data, dtype=float)
+    seconds = seconds[(seconds > 0) & seconds.index.isin(matrix.index)]
+    profile_matrix = matrix.loc[seconds.index]
+    present = profile_matrix.notna().to_numpy()
+    used_columns = present.any(axis=0)
+    if not used_columns.any():
+        return pd.DataFrame(columns=CONTRIBUTION_COLUMNS)
+
+    # 能量 (mW-s) = 秒數 × 功耗，總能量再除以總時間換算回「平均功耗 (mW)」
+    avg_power = seconds.to_numpy() @ profile_matrix.fillna(0.0).to_numpy() / total_seconds
+
+    # 依 Profile 中第一次出現的順序排列 (與逐一累加時相同)
+    first_seen = present.argmax(axis=0)
+    columns = np.flatnonzero(used_columns)
+    columns = columns[np.argsort(first_seen[columns], kind='stable')]
+    sources = profile_matrix.columns[columns]
+    return pd.DataFrame({
+        "source": sources,
+        "power_mW": avg_power[columns],
+        "type": [source_types.get(source, "Unknown") for source in sources],
+    })
+
+
+def vsys_voltage_of(result):
+    """電池 (Vsys) 電壓，用來把平均功耗換算成平均電流"""
+    return result.output_voltage.get("battery", DEFAULT_VSYS_VOLTAGE)
+
+
+def profile_battery_life(profile_name, profile_data, power_per_use_case, battery_capacity_mAh, vsys_voltage):
+    """一個 User Profile 的平均功耗 / 平均電流 / 電池壽命 (Battery Life Estimation 表格的一列)"""
+    total_energy_mW_s = sum(power_per_use_case.get(uc_name, 0) * seconds for uc_name, seconds in profile_data.items())
+    total_seconds_in_profile = sum(profile_data.values())
+
+    avg_power_mW = total_energy_mW_s / total_seconds_in_profile if total_seconds_in_profile > 0 else 0
+    avg_current_mA = avg_power_mW / vsys_voltage if vsys_voltage > 0 else 0
+
+    if avg_current_mA > 0:
+        battery_life_days = (battery_capacity_mAh / avg_current_mA) / 24
+    else:
+        battery_life_days = 0
+
+    return {
+        "Profile": profile_name,
+        "Battery Life (Days)": battery_life_days,
+        "Avg. Power (mW)": avg_power_mW,
+        "Avg. Current (uA)": avg_current_mA * 1000.0
+    }
+
+
+def profile_battery_life_batch(total_power_mW, vsys_voltage, battery_capacity_mAh, user_profiles, use_case_names):
+    """
+    profile_battery_life 的向量化版本，用於 sweep / Monte Carlo 的多個樣本。
+    total_power_mW (N × U)、vsys_voltage (N,)、battery_capacity_mAh (N,) 或純量；
+    回傳 (平均功耗, 電池壽命天數)，shape 皆為 (N × Profile)。
+    """
+    # Profile 平均功耗 = 總功耗 (N × U) × 秒數 (U × Profile) / 總秒數
+    profile_names = list(user_profiles.keys())
+    seconds = np.array([
+        [user_profiles[p].get(uc_name, 0) for p in profile_names] for uc_name in use_case_names
+    ], dtype=float).reshape(len(use_case_names), len(profile_names))
+    total_seconds = np.array([sum(user_profiles[p].values()) for p in profile_names], dtype=float)
+    energy = total_power_mW @ seconds
+    avg_power = np.divide(energy, total_seconds, out=np.zeros_like(energy), where=total_seconds > 0)
+    vsys_voltage = np.asarray(vsys_voltage, dtype=float)[:, np.newaxis]
+    avg_current_mA = np.divide(avg_power, vsys_voltage, out=np.zeros_like(avg_power), where=vsys_voltage > 0)
+    capacity = np.broadcast_to(np.asarray(battery_capacity_mAh, dtype=float), avg_current_mA.shape[:1])[:, np.newaxis]
+    battery_life_days = np.divide(
+        np.broadcast_to(capacity, avg_current_mA.shape), avg_current_mA, out=np.zeros_like(avg_current_mA), where=avg_current_mA > 0
+    ) / 24
+    return avg_power, battery_life_days
+
+
+def config_report(config, backend=None):
+    """
+    計算一份設定檔 (parse_config 讀入的 dict) 的報表，回傳 {表格名稱: DataFrame}：
+    use_cases (每個 Use Case 的功耗)、battery_life (每個 Profile 的電池壽命)、breakdown (每個 Profile 的平均功耗分佈)。
+    """
+    snapshot = ModelSnapshot.from_state(config)
+    results = evaluate_use_cases(snapshot, backend=backend)
+    if not results:
+        raise ValueError("設定檔中沒有任何 Use Case")
+    # 與介面相同：以第一個 (預設選取的) Use Case 的 Vsys 電壓換算電流
+    vsys_voltage = vsys_voltage_of(next(iter(results.values())))
+
+    df_use_cases = pd.DataFrame([
+        {
+            "Use Case": name,
+            "Total Power (mW)": result.total_power_mW,
+            "Vsys Current (uA)": result.total_power_mW / vsys_voltage * 1000.0 if vsys_voltage > 0 else 0.0,
+        }
+        for name, result in results.items()
+    ])
+
+    power_per_use_case = {name: result.total_power_mW for name, result in results.items()}
+    dou_specs = config.get('profile_dou_specs', {})
+    battery_rows = []
+    for profile_name, profile_data in config['user_profiles'].items():
+        row = profile_battery_life(profile_name, profile_data, power_per_use_case, config.get('battery_capacity_mAh', 0.0), vsys_voltage)
+        row["DOU Spec (Days)"] = dou_specs.get(profile_name, 7.0)
+        row["Meets Spec"] = row["Battery Life (Days)"] >= row["DOU Spec (Days)"]
+        battery_rows.append(row)
+    df_battery = pd.DataFrame(battery_rows, columns=[
+        "Profile", "Battery Life (Days)", "Avg. Power (mW)", "Avg. Current (uA)", "DOU Spec (Days)", "Meets Spec"
+    ])
+
+    matrix, source_types = contribution_matrix(snapshot, results, backend=backend)
+    breakdown_frames = []
+    for profile_name, profile_data in config['user_profiles'].items():
+        df = profile_breakdown(matrix, source_types, profile_data)
+        total_power = df['power_mW'].sum()
+        df['percentage'] = df['power_mW'] / total_power if total_power > 0 else 0.0
+        breakdown_frames.append(df.assign(profile=profile_name))
+    df_breakdown = pd.concat(breakdown_frames, ignore_index=True) if breakdown_frames else pd.DataFrame()
+    if not df_breakdown.empty:
+        df_breakdown = df_breakdown[["profile", "source", "type", "power_mW", "percentage"]]
+
+    return {"use_cases": df_use_cases, "battery_life": df_battery, "breakdown": df_breakdown}
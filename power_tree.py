@@ -0,0 +1,143 @@
+"""
+Power Tree 索引圖模型 (Indexed Power Tree Graph)
+
+將 power_tree_data['nodes'] 建立成 id→node、parent、children 索引與拓撲順序，
+取代原本 get_node_by_id 的線性搜尋。節點 dict 本身不複製，
+PowerTree 只持有與 session_state 相同的 list / dict 參考。
+"""
+from collections import deque
+
+
+class PowerTree:
+    """
+    power_tree_data['nodes'] 的索引。
+    所有會改變節點 id 或 input_source_id 的操作都必須透過
+    add_node / update_node，索引才會保持同步。
+    """
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.version = 0
+        self.rebuild()
+
+    # ---
+    # 索引建立
+    # ---
+    def rebuild(self):
+        """從 nodes list 重新建立所有索引 (O(n))"""
+        self.by_id = {n['id']: n for n in self.nodes}
+        self.parent = {}
+        self.children = {n['id']: [] for n in self.nodes}
+        for node in self.nodes:
+            self._link(node)
+        self._topo_order = None
+        self._cycle_nodes = None
+        self.version += 1
+
+    def _link(self, node):
+        parent_id = node.get('input_source_id')
+        self.parent[node['id']] = parent_id
+        if parent_id is not None:
+            # children 依照 nodes list 的順序排列 (與原本的線性掃描一致)
+            self.children.setdefault(parent_id, []).append(node['id'])
+
+    def _touch(self):
+        self._topo_order = None
+        self._cycle_nodes = None
+        self.version += 1
+
+    def is_synced_with(self, nodes):
+        """nodes list 是否仍是這個索引所建立的同一份資料"""
+        return self.nodes is nodes and len(self.by_id) == len(nodes)
+
+    # ---
+    # 查詢 (Queries)
+    # ---
+    def get(self, node_id):
+        if node_id is None:
+            return None
+        return self.by_id.get(node_id)
+
+    def parent_of(self, node_id):
+        return self.get(self.parent.get(node_id))
+
+    def children_of(self, node_id):
+        return [self.by_id[child_id] for child_id in self.children.get(node_id, ())]
+
+    def ancestors(self, node_id):
+        """由下往上依序回傳 node_id 的所有上游節點 (遇到循環時停止)"""
+        seen = {node_id}
+        parent_id = self.parent.get(node_id)
+        while parent_id is not None and parent_id not in seen:
+            parent = self.by_id.get(parent_id)
+            if parent is None:
+                return
+            yield parent
+            seen.add(parent_id)
+            parent_id = self.parent.get(parent_id)
+
+    @property
+    def roots(self):
+        return [n['id'] for n in self.nodes if n.get('input_source_id') is None]
+
+    def topological_order(self):
+        """
+        由根節點開始的拓撲順序 (上游一定排在下游之前)。
+        無法從根節點到達的節點 (上游不存在或形成循環) 不會出現在結果中。
+        """
+        if self._topo_order is None:
+            order = []
+            queue = deque(self.roots)
+            while queue:
+                node_id = queue.popleft()
+                order.append(node_id)
+                queue.extend(self.children.get(node_id, ()))
+            self._topo_order = order
+        return self._topo_order
+
+    def find_cycles(self):
+        """回傳所有位於循環依賴上的節點 id (只需檢查無法從根節點到達的節點)"""
+        if self._cycle_nodes is None:
+            reachable = set(self.topological_order())
+            visited = set()
+            cycle_nodes = []
+            for start_id in self.by_id:
+                if start_id in reachable or start_id in visited:
+                    continue
+                path = []
+                position = {}
+                node_id = start_id
+                while node_id in self.by_id and node_id not in reachable and node_id not in visited:
+                    if node_id in position:
+                        cycle_nodes.extend(path[position[node_id]:])
+                        break
+                    position[node_id] = len(path)
+                    path.append(node_id)
+                    node_id = self.parent.get(node_id)
+                visited.update(path)
+            self._cycle_nodes = cycle_nodes
+        return self._cycle_nodes
+
+    # ---
+    # 修改 (Mutations)
+    # ---
+    def add_node(self, node):
+        self.nodes.append(node)
+        self.by_id[node['id']] = node
+        self.children.setdefault(node['id'], [])
+        self._link(node)
+        self._touch()
+
+    def add_nodes(self, new_nodes):
+        for node in new_nodes:
+            self.add_node(node)
+
+    def update_node(self, node_id, **changes):
+        """更新節點欄位；若 input_source_id 改變則重建 parent / children 索引"""
+        node = self.by_id[node_id]
+        reparent = 'input_source_id' in changes and changes['input_source_id'] != node.get('input_source_id')
+        node.update(changes)
+        if reparent:
+            self.rebuild()
+        return node
+
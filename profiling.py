@@ -0,0 +1,144 @@
+"""
+執行時間分析 (Per-Rerun Profiling)
+
+選用的量測層：開啟後記錄一次 rerun 中每個區段 (span) 的時間與每個函數的呼叫次數，
+可以顯示在側邊欄的 Debug 面板，也可以匯出成 Chrome trace 格式 (chrome://tracing、Perfetto 皆可開啟)。
+
+    profiling.start()                       # rerun 開始
+    with profiling.span("Tab: Battery"):    # 任意區段
+        ...
+    @profiling.instrument()                 # 函數：時間 + 呼叫次數
+    def calculate_power(...): ...
+    profiler = profiling.stop()             # rerun 結束，取得記錄
+
+沒有呼叫 start() 時 span / instrument 只多一次判斷，不記錄任何資料。
+目前的 Profiler 存在 thread-local 中 (Streamlit 每個 session 的 script 在各自的 thread 執行)，
+交給 ExecutionBackend 的 worker process 不會被記錄，只會以呼叫它的區段時間呈現。
+"""
+import functools
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import pandas as pd
+
+_state = threading.local()
+
+
+class Profiler:
+    """一次 rerun 的記錄：spans = [(名稱, 類別, 開始 ns, 時間 ns, 深度)]、counts = {函數名稱: 呼叫次數}"""
+
+    def __init__(self, label="rerun"):
+        self.label = label
+        self.started_ns = time.perf_counter_ns()
+        self.finished_ns = None
+        self.wall_time = time.time()
+        self.spans = []
+        self.counts = Counter()
+        self._depth = 0
+
+    @contextmanager
+    def span(self, name, category="block"):
+        start = time.perf_counter_ns()
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            self.spans.append((name, category, start, time.perf_counter_ns() - start, self._depth))
+
+    def finish(self):
+        if self.finished_ns is None:
+            self.finished_ns = time.perf_counter_ns()
+        return self
+
+    @property
+    def total_ms(self):
+        end = self.finished_ns if self.finished_ns is not None else time.perf_counter_ns()
+        return (end - self.started_ns) / 1e6
+
+    def summary(self):
+        """依名稱彙總的 DataFrame (依總時間由大到小)：Name / Category / Calls / Total (ms) / Max (ms) / Share"""
+        rows = {}
+        for name, category, _, duration_ns, _ in self.spans:
+            row = rows.setdefault(name, {"Name": name, "Category": category, "Calls": 0, "Total (ms)": 0.0, "Max (ms)": 0.0})
+            row["Calls"] += 1
+            row["Total (ms)"] += duration_ns / 1e6
+            row["Max (ms)"] = max(row["Max (ms)"], duration_ns / 1e6)
+        df = pd.DataFrame(list(rows.values()), columns=["Name", "Category", "Calls", "Total (ms)", "Max (ms)"])
+        total_ms = self.total_ms
+        df["Share"] = df["Total (ms)"] / total_ms if total_ms > 0 else 0.0
+        return df.sort_values("Total (ms)", ascending=False, kind='stable').reset_index(drop=True)
+
+    def trace_events(self, pid=1, origin_ns=None):
+        """Chrome trace 的 complete event ("ph": "X") 與呼叫次數的 counter event；時間單位為 us"""
+        origin_ns = self.started_ns if origin_ns is None else origin_ns
+        events = [{
+            "name": self.label, "cat": "rerun", "ph": "X", "pid": pid, "tid": 1,
+            "ts": (self.started_ns - origin_ns) / 1e3, "dur": self.total_ms * 1e3,
+        }]
+        for name, category, start_ns, duration_ns, depth in self.spans:
+            events.append({
+                "name": name, "cat": category, "ph": "X", "pid": pid, "tid": 1,
+                "ts": (start_ns - origin_ns) / 1e3, "dur": duration_ns / 1e3, "args": {"depth": depth},
+            })
+        if self.counts:
+            events.append({
+                "name": "calls", "ph": "C", "pid": pid, "tid": 1,
+                "ts": (self.started_ns - origin_ns) / 1e3, "args": dict(self.counts),
+            })
+        return events
+
+
+def start(label="rerun"):
+    """開始記錄 (取代目前 thread 上尚未結束的記錄)"""
+    _state.profiler = Profiler(label)
+    return _state.profiler
+
+
+def stop():
+    """結束記錄並回傳 Profiler (沒有在記錄時回傳 None)"""
+    profiler = getattr(_state, 'profiler', None)
+    _state.profiler = None
+    return profiler.finish() if profiler is not None else None
+
+
+def active():
+    return getattr(_state, 'profiler', None)
+
+
+@contextmanager
+def span(name, category="block"):
+    profiler = getattr(_state, 'profiler', None)
+    if profiler is None:
+        yield
+        return
+    with profiler.span(name, category):
+        yield
+
+
+def instrument(name=None, category="function"):
+    """函數 decorator：記錄每次呼叫的時間與呼叫次數 (名稱預設為函數名稱)"""
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profiler = getattr(_state, 'profiler', None)
+            if profiler is None:
+                return fn(*args, **kwargs)
+            profiler.counts[span_name] += 1
+            with profiler.span(span_name, category):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def chrome_trace(profilers):
+    """多次 rerun 的記錄合併成一個 Chrome trace JSON (bytes)，時間軸以第一次 rerun 的開始為 0"""
+    profilers = [p for p in profilers if p is not None]
+    origin_ns = min((p.started_ns for p in profilers), default=0)
+    events = [event for p in profilers for event in p.trace_events(origin_ns=origin_ns)]
+    return json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}, ensure_ascii=False).encode("utf-8")
@@ -0,0 +1,249 @@
+"""
+Use Case 結果快取 (Content-Hash Result Cache)
+
+快取 key 只由「真正影響該 Use Case 結果」的資料組成：
+  - Use Case 本身的 ratio 與電源模式設定
+  - 它所選用的電源模式參數 (電壓 / 效率 / Iq)
+  - ratio > 0 的 component group 的 operating-mode 電流
+  - power tree 拓撲 (id / type / group / input_source_id)
+因此修改某一個 group 的電流，只有使用該 group 的 Use Case 需要重新計算；
+切換主題、展開 expander 等不影響模型的 rerun 則全部命中快取。
+各部分的雜湊依 ModelSnapshot 的 section 修訂編號 (見 SnapshotBuilder) 快取，
+沒有改變的 section 不會重新雜湊，命中快取的成本與模型大小幾乎無關。
+
+單一電流被修改時 (apply_current_edit)，受影響的 Use Case 會由修改前的快取結果
+沿上游路徑增量推導 (O(depth))，不需要整棵樹重新計算。
+"""
+import hashlib
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from power_calc import NODES_SECTION, PowerResult, propagate_mode_current_change, resolve_power_source_mode_name
+
+# 不影響計算結果的欄位 (例如備註) 不列入雜湊
+_IGNORED_KEYS = ('note',)
+
+
+def content_digest(obj):
+    """對 JSON 相容資料計算穩定的雜湊值 (與 dict 順序無關)"""
+    payload = json.dumps(obj, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def group_digest(modes, currents_override=None):
+    """一個 component group 所有模式電流的雜湊；currents_override = {mode: currents_uA} 可替換部分模式"""
+    currents = {mode: data.get('currents_uA', {}) for mode, data in modes.items()}
+    currents.update(currents_override or {})
+    return content_digest(currents)
+
+
+def _group_term(group, digest):
+    """use case key 中一個 group 的項 (128-bit 整數)，各項以 XOR 合併，順序無關且可以逐項替換"""
+    return int.from_bytes(hashlib.blake2b(f"{group}={digest}".encode('utf-8'), digest_size=16).digest(), 'big')
+
+
+class ModelDigests:
+    """
+    ModelSnapshot 的分段雜湊：拓撲、各 group、各電源的模式與各 Use Case 的 key 依 section 的修訂編號快取，
+    可以跨 snapshot 重複使用。新的 snapshot 只有修訂編號改變的 section 需要重新雜湊，
+    也只有依賴這些 section 的 Use Case 需要重新組合 key。
+    Use Case 使用的各 group 雜湊以 XOR 累積，單一 group 改變時每個 Use Case 只需要替換一項 (O(1))。
+    """
+
+    def __init__(self):
+        self._snapshot = None
+        self._revisions = {}
+        self._section_digests = {}   # section → 雜湊 (拓撲 / group 為字串，電源為 {模式名稱: 字串})
+        self._parts = {}             # use case 名稱 → [設定與電源部分的雜湊, 使用的 group, group 項的 XOR]
+        self._stale_groups = {}      # use case 名稱 → {group: 累積在 XOR 中的舊雜湊}
+        self._keys = {}              # use case 名稱 → key
+        self._dependents = {}        # section → {依賴它的 use case 名稱}
+
+    def sync(self, snapshot):
+        """切換到新的 snapshot：捨棄修訂編號改變的 section 雜湊與依賴它們的 Use Case key"""
+        if snapshot is self._snapshot:
+            return
+        revisions = snapshot.section_revisions()
+        changed = [section for section, revision in revisions.items() if self._revisions.get(section) != revision]
+        changed += [section for section in self._revisions if section not in revisions]
+        for section in changed:
+            old_digest = self._section_digests.pop(section, None)
+            kind, group = section
+            for name in self._dependents.pop(section, ()):
+                self._keys.pop(name, None)
+                stale = self._stale_groups.setdefault(name, {})
+                parts = self._parts.get(name)
+                if kind == 'operating_modes' and parts and group in parts[1] and (group in stale or old_digest is not None):
+                    # group 電流改變：設定與電源部分不變，記下 XOR 中的舊雜湊，組合 key 時再替換
+                    stale.setdefault(group, old_digest)
+                else:
+                    self._parts.pop(name, None)
+                    self._stale_groups.pop(name, None)
+        self._snapshot = snapshot
+        self._revisions = dict(revisions)
+
+    def _section_digest(self, section, compute):
+        digest = self._section_digests.get(section)
+        if digest is None:
+            digest = self._section_digests[section] = compute()
+        return digest
+
+    def topology(self, snapshot):
+        return self._section_digest(NODES_SECTION, lambda: content_digest([
+            (n['id'], n['type'], n.get('group'), n.get('input_source_id')) for n in snapshot.nodes
+        ]))
+
+    def group(self, snapshot, group):
+        modes = snapshot.operating_modes.get(group)
+        if modes is None:
+            return None
+        return self._section_digest(('operating_modes', group), lambda: group_digest(modes))
+
+    def power_source_modes(self, snapshot, ps_id):
+        return self._section_digest(('power_source_modes', ps_id), lambda: {
+            mode_name: content_digest({k: v for k, v in params.items() if k not in _IGNORED_KEYS})
+            for mode_name, params in snapshot.power_source_modes.get(ps_id, {}).items()
+        })
+
+    def _use_case_parts(self, snapshot, use_case_name):
+        parts = self._parts.get(use_case_name)
+        if parts is None:
+            use_case = snapshot.use_cases[use_case_name]
+            comp_settings = use_case.get('components', {})
+            ps_settings = use_case.get('power_sources', {})
+            used_groups = frozenset(
+                group for group, ratios in comp_settings.items()
+                if ratios and any(ratio > 0 for ratio in ratios.values())
+            )
+            ps_parts = []
+            for node in snapshot.nodes:
+                if node['type'] == 'power_source':
+                    mode_name = resolve_power_source_mode_name(snapshot, node, ps_settings)
+                    ps_parts.append(f"{node['id']}={self.power_source_modes(snapshot, node['id']).get(mode_name)}")
+            settings = '\n'.join([content_digest([use_case_name, comp_settings]), self.topology(snapshot), *ps_parts])
+            group_terms = 0
+            for group in used_groups:
+                group_terms ^= _group_term(group, self.group(snapshot, group))
+            parts = self._parts[use_case_name] = [settings, used_groups, group_terms]
+
+            sections = [NODES_SECTION, ('use_cases', use_case_name)]
+            sections += [('operating_modes', group) for group in used_groups]
+            sections += [('power_source_modes', ps_id) for ps_id in snapshot.power_source_modes]
+            for section in sections:
+                self._dependents.setdefault(section, set()).add(use_case_name)
+        else:
+            for group, old_digest in self._stale_groups.pop(use_case_name, {}).items():
+                parts[2] ^= _group_term(group, old_digest) ^ _group_term(group, self.group(snapshot, group))
+                self._dependents.setdefault(('operating_modes', group), set()).add(use_case_name)
+        return parts
+
+    def use_case_key(self, snapshot, use_case_name, group_digests=None):
+        """group_digests 可替換部分 group 的雜湊 (用來重建修改前的 key，不會寫入快取)"""
+        self.sync(snapshot)
+        if not group_digests and use_case_name in self._keys:
+            return self._keys[use_case_name]
+        settings, used_groups, group_terms = self._use_case_parts(snapshot, use_case_name)
+        for group, digest in (group_digests or {}).items():
+            if group in used_groups:
+                group_terms ^= _group_term(group, self.group(snapshot, group)) ^ _group_term(group, digest)
+        key = hashlib.blake2b(f"{settings}\n{group_terms:032x}".encode('utf-8'), digest_size=16).hexdigest()
+        if not group_digests:
+            self._keys[use_case_name] = key
+        return key
+
+
+@dataclass(frozen=True)
+class IncrementalUpdate:
+    """apply_current_edit 增量更新的一個 Use Case"""
+    use_case: str
+    old_key: str
+    new_key: str
+    previous: PowerResult     # 修改前
+    updated: PowerResult      # 修改後
+
+
+class PowerResultCache:
+    """以內容雜湊為 key 的 PowerResult LRU 快取"""
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.incremental_updates = 0
+        self._entries = OrderedDict()
+        self.digests = ModelDigests()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        result = self._entries.get(key)
+        if result is not None:
+            self._entries.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.digests = ModelDigests()
+
+    def apply_current_edit(self, snapshot, group, mode_name, node_id, old_current_uA, new_current_uA):
+        """
+        snapshot 已包含修改後的電流。將該電流換回舊值重建修改前的 key，
+        只有與修改前狀態完全一致的快取結果才會被增量更新，並以新的 key 存回快取。
+        回傳增量更新的 IncrementalUpdate list (呼叫端可據此更新衍生的表格，例如貢獻矩陣)。
+        """
+        modes = snapshot.operating_modes.get(group, {})
+        if mode_name not in modes:
+            return []
+        reverted = dict(modes[mode_name].get('currents_uA', {}))
+        if old_current_uA is None:
+            reverted.pop(node_id, None)
+        else:
+            reverted[node_id] = old_current_uA
+        old_group_digest = group_digest(modes, {mode_name: reverted})
+
+        updates = []
+        for name in snapshot.use_cases:
+            new_key = self.digests.use_case_key(snapshot, name)
+            if new_key in self._entries:
+                continue
+            old_key = self.digests.use_case_key(snapshot, name, group_digests={group: old_group_digest})
+            previous = self.get(old_key)
+            if previous is None:
+                continue
+            updated = propagate_mode_current_change(
+                snapshot, previous, group, mode_name, node_id, old_current_uA, new_current_uA
+            )
+            self.put(new_key, updated)
+            updates.append(IncrementalUpdate(name, old_key, new_key, previous, updated))
+        self.incremental_updates += len(updates)
+        return updates
+
+    def get_results(self, snapshot, use_case_names, compute):
+        """
+        回傳 {use case 名稱: PowerResult}。
+        只有快取中沒有的 Use Case 會交給 compute(missing_names) 一次計算。
+        """
+        keys = {name: self.digests.use_case_key(snapshot, name) for name in use_case_names}
+        results = {}
+        missing = []
+        for name, key in keys.items():
+            result = self.get(key)
+            if result is None:
+                missing.append(name)
+            else:
+                results[name] = result
+        self.hits += len(results)
+        self.misses += len(missing)
+        if missing:
+            for name, result in compute(missing).items():
+                self.put(keys[name], result)
+                results[name] = result
+        return {name: results[name] for name in use_case_names}
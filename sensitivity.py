@@ -0,0 +1,146 @@
+"""
+靈敏度分析 (Sensitivity Report)
+
+每個 Profile 的電池壽命對每個模型參數的偏微分 d(days)/d(parameter)：
+  - operating mode 的元件電流 currents_uA
+  - 電源模式的 efficiency 與 quiescent_current_uA
+
+以批次引擎的語意直接解析計算，不需要對每個參數重新計算：
+  總功耗 P_u = Σ 元件功耗 × M(元件所接的 rail) + Σ rail 的 Iq 損耗 × M(上游 rail)
+  M(s) = rail s 與其所有上游 rail 的 1/效率 乘積 (無法到達的 rail 為 0)
+  Profile 平均功耗 = Σ_u 秒數權重 × P_u，電池壽命 L = 容量 × Vsys / (24 × 平均功耗)
+  dL/dθ = -L / 平均功耗 × d(平均功耗)/dθ
+
+排名使用「參數變動 +1% 時電池壽命的變化 (天)」，不同單位的參數因此可以互相比較。
+有效率曲線的電源模式，效率參數視為整條曲線的倍率 (與 CompiledModel.evaluate 相同)；
+負載改變時曲線斜率的影響不計入，為一階近似。
+"""
+import numpy as np
+import pandas as pd
+
+from batch_engine import compile_model
+from power_report import DEFAULT_VSYS_VOLTAGE
+
+SENSITIVITY_COLUMNS = [
+    "Profile", "Parameter", "Target", "Value", "d(Days)/d(Value)", "Days per +1%",
+]
+
+
+def _rail_multipliers(compiled, efficiency):
+    """
+    每個 Use Case 下每個 rail 的 M(s) 與 M(上游) (U × S)。
+    rail_levels 由深到淺排列，反向走訪即為由根節點往下。
+    """
+    inv_efficiency = np.divide(1.0, efficiency, out=np.zeros_like(efficiency), where=efficiency > 0)
+    multiplier = np.zeros_like(efficiency)
+    parent_multiplier = np.zeros_like(efficiency)
+    for level, _ in reversed(compiled.rail_levels):
+        parents = compiled.rail_parent[level]
+        has_parent = parents >= 0
+        upstream = np.where(has_parent, multiplier[:, np.where(has_parent, parents, 0)], 1.0)
+        parent_multiplier[:, level] = upstream
+        multiplier[:, level] = upstream * inv_efficiency[:, level]
+    return multiplier, parent_multiplier
+
+
+def profile_weights(compiled, user_profiles):
+    """(Profile × U) 的秒數權重 (每列總和為 1，沒有秒數的 Profile 為 0)"""
+    profile_names = list(user_profiles.keys())
+    seconds = np.array([
+        [user_profiles[p].get(uc_name, 0) for uc_name in compiled.use_case_names] for p in profile_names
+    ], dtype=float).reshape(len(profile_names), len(compiled.use_case_names))
+    total_seconds = np.array([sum(user_profiles[p].values()) for p in profile_names], dtype=float)[:, np.newaxis]
+    return np.divide(seconds, total_seconds, out=np.zeros_like(seconds), where=total_seconds > 0)
+
+
+def average_power_gradients(compiled, batch, weights, m_index, c_index):
+    """
+    每個 Profile 平均功耗 (mW) 對參數的偏微分：
+    回傳 (d_current (Profile × K，K 為 (m_index, c_index) 指定的電流格子), d_efficiency (Profile × P), d_iq (Profile × P))。
+    """
+    voltage = batch.rail_voltage
+    efficiency = batch.rail_efficiency
+    multiplier, parent_multiplier = _rail_multipliers(compiled, efficiency)
+
+    # 元件：dP_u / d(current[m, c]) = ratio[u, m] × V(u, c) / 1000 × M(u, rail_c)
+    attached = compiled.component_rail >= 0
+    rail_of_component = np.where(attached, compiled.component_rail, 0)
+    component_gain = np.where(attached, voltage[:, rail_of_component] * multiplier[:, rail_of_component], 0.0) / 1000.0
+    # 只算需要的 (m, c) 格子，不建立 Profile × M × C 的陣列
+    d_current = weights @ (compiled.ratios[:, m_index] * component_gain[:, c_index])
+
+    # 電源：input = output / eff + V_in × Iq，換算到 Vsys 時再乘上 M(上游)
+    has_parent = compiled.rail_parent >= 0
+    input_voltage = np.where(has_parent, voltage[:, np.where(has_parent, compiled.rail_parent, 0)], voltage)
+    d_input_d_efficiency = np.divide(
+        -batch.rail_output_power_mW, efficiency ** 2, out=np.zeros_like(efficiency), where=efficiency > 0
+    )
+    # 有效率曲線的模式：效率參數是整條曲線的倍率，d(效率)/d(參數) = 查到的效率 / 參數
+    nominal = compiled.ps_mode_efficiency[compiled.rail_mode]
+    curve_gain = np.where(
+        compiled.rail_has_curve, np.divide(efficiency, nominal, out=np.zeros_like(efficiency), where=nominal > 0), 1.0
+    )
+    d_efficiency_by_rail = d_input_d_efficiency * curve_gain * parent_multiplier   # (U × S)
+    d_iq_by_rail = input_voltage / 1000.0 * parent_multiplier
+
+    # 依每個 Use Case 選用的電源模式加總到 (Profile × P)
+    n_modes = len(compiled.ps_mode_keys)
+    modes = compiled.rail_mode.ravel()
+    d_efficiency = np.array([
+        np.bincount(modes, weights=(w[:, np.newaxis] * d_efficiency_by_rail).ravel(), minlength=n_modes) for w in weights
+    ]).reshape(len(weights), n_modes)
+    d_iq = np.array([
+        np.bincount(modes, weights=(w[:, np.newaxis] * d_iq_by_rail).ravel(), minlength=n_modes) for w in weights
+    ]).reshape(len(weights), n_modes)
+    return d_current, d_efficiency, d_iq
+
+
+def sensitivity_report(snapshot, user_profiles, battery_capacity_mAh, vsys_voltage=DEFAULT_VSYS_VOLTAGE):
+    """
+    所有 Profile × 參數的電池壽命靈敏度 (長格式 DataFrame，依 |Days per +1%| 由大到小排列)。
+    元件電流只列出屬於該模式所在群組的元件。
+    """
+    compiled = compile_model(snapshot)
+    batch = compiled.evaluate()
+    weights = profile_weights(compiled, user_profiles)
+    mode_group = np.array([group for group, _ in compiled.mode_keys], dtype=object)
+    m_index, c_index = np.nonzero(mode_group[:, np.newaxis] == np.array(compiled.component_groups, dtype=object)[np.newaxis, :])
+    d_current, d_efficiency, d_iq = average_power_gradients(compiled, batch, weights, m_index, c_index)
+
+    avg_power = weights @ batch.total_power_mW
+    battery_life = np.divide(
+        battery_capacity_mAh * vsys_voltage, 24.0 * avg_power, out=np.zeros_like(avg_power), where=avg_power > 0
+    )
+    # dL / d(平均功耗) = -L / 平均功耗
+    life_per_power = -np.divide(battery_life, avg_power, out=np.zeros_like(avg_power), where=avg_power > 0)
+
+    labels = {n['id']: n.get('label') or n.get('endpoint') or n['id'] for n in snapshot.nodes}
+    endpoints = {n['id']: n.get('endpoint', n['id']) for n in snapshot.nodes if n['type'] == 'component'}
+    current_targets = [
+        f"{compiled.mode_keys[m][0]} / {compiled.mode_keys[m][1]} / {endpoints.get(compiled.component_ids[c], compiled.component_ids[c])}"
+        for m, c in zip(m_index, c_index)
+    ]
+    ps_targets = [f"{labels.get(ps_id, ps_id)} / {mode_name}" for ps_id, mode_name in compiled.ps_mode_keys]
+
+    parameters = [
+        ("Current (uA)", current_targets, compiled.mode_currents_uA[m_index, c_index], d_current),
+        ("Efficiency", ps_targets, compiled.ps_mode_efficiency, d_efficiency),
+        ("Iq (uA)", ps_targets, compiled.ps_mode_iq_uA, d_iq),
+    ]
+    frames = []
+    for p, profile_name in enumerate(user_profiles):
+        for kind, targets, values, d_power in parameters:
+            derivative = life_per_power[p] * d_power[p]
+            frames.append(pd.DataFrame({
+                "Profile": profile_name,
+                "Parameter": kind,
+                "Target": targets,
+                "Value": values,
+                "d(Days)/d(Value)": derivative,
+                "Days per +1%": derivative * values * 0.01,
+            }))
+    if not frames:
+        return pd.DataFrame(columns=SENSITIVITY_COLUMNS)
+    df = pd.concat(frames, ignore_index=True)
+    order = np.argsort(-df["Days per +1%"].abs().to_numpy(), kind='stable')
+    return df.iloc[order].reset_index(drop=True)
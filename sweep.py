@@ -0,0 +1,157 @@
+"""
+參數掃描 (Parameter Sweep)
+
+讓任一模型參數在一個範圍 (或兩個參數的網格) 內變化，
+以批次引擎一次計算所有掃描點的 Use Case 功耗，再換算每個 Profile 的電池壽命。
+可掃描的參數：
+  - battery_capacity_mAh
+  - 電源模式的 efficiency / quiescent_current_uA
+  - operating mode 的元件電流 (uA)
+"""
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from batch_engine import compile_model
+from parallel import IN_PROCESS, split_ranges
+from power_report import DEFAULT_VSYS_VOLTAGE, profile_battery_life_batch
+
+# kind → 說明文字
+PARAMETER_KINDS = {
+    'battery_capacity': "Battery Capacity (mAh)",
+    'power_source': "Power Source Mode Parameter",
+    'mode_current': "Operating Mode Current (uA)",
+}
+POWER_SOURCE_FIELDS = ('efficiency', 'quiescent_current_uA')
+# 介面中一次掃描 (含網格) 的點數上限
+MAX_SWEEP_POINTS = 20000
+# 批次計算的實測成本：每個 (點 × Use Case × (元件 + rail + 改變的 mode 電流)) 約 8 ~ 14 ns
+SECONDS_PER_ELEMENT = 1e-8
+
+
+@dataclass
+class SweepParameter:
+    """
+    一個掃描參數。target 依 kind 而定：
+      battery_capacity : ()
+      power_source     : (power source id, 模式名稱, 'efficiency' 或 'quiescent_current_uA')
+      mode_current     : (group, 模式名稱, component id)
+    """
+    kind: str
+    values: np.ndarray
+    target: tuple = field(default_factory=tuple)
+
+    @property
+    def label(self):
+        if self.kind == 'battery_capacity':
+            return "battery_capacity_mAh"
+        return "/".join(str(part) for part in self.target)
+
+
+def sweep_values(start, stop, steps):
+    """start ~ stop 之間均勻分佈的 steps 個數值"""
+    return np.linspace(float(start), float(stop), max(int(steps), 1))
+
+
+def batch_vsys_voltage(compiled, batch, n_points, vsys_use_case=None):
+    """每個樣本的 Vsys 電壓：vsys_use_case (預設第一個 Use Case) 下 battery 的輸出電壓"""
+    u = compiled.use_case_names.index(vsys_use_case) if vsys_use_case in compiled.use_case_names else 0
+    if 'battery' in compiled.rail_ids and compiled.use_case_names:
+        return np.broadcast_to(batch.rail_voltage[..., u, compiled.rail_ids.index('battery')], (n_points,))
+    return np.full(n_points, DEFAULT_VSYS_VOLTAGE)
+
+
+def evaluation_work(compiled, n_points, n_current_changes=0):
+    """
+    以 n_points 組參數計算 compiled 的預估秒數 (供 ExecutionBackend 判斷是否值得平行)。
+    n_current_changes：每個點改變的 mode 電流格數 (見 CompiledModel.component_currents_uA)。
+    """
+    per_use_case = (len(compiled.component_ids) + len(compiled.rail_ids) + n_current_changes) * SECONDS_PER_ELEMENT
+    return n_points * len(compiled.use_case_names) * per_use_case
+
+
+def _evaluate_points(context, item):
+    """
+    一段掃描點的 (總功耗 N × U, Vsys 電壓 N)；也是 ExecutionBackend 的工作函數。
+    current_changes = (mode 索引, component 索引, 數值 N × K)，在這一段內才換算成元件電流。
+    """
+    compiled, vsys_use_case = context
+    overrides, current_changes, n_points = item
+    if current_changes is not None:
+        overrides = dict(overrides, component_currents_uA=compiled.component_currents_uA(*current_changes))
+    batch = compiled.evaluate(**overrides)
+    total_power = np.broadcast_to(batch.total_power_mW, (n_points, len(compiled.use_case_names)))
+    return total_power, batch_vsys_voltage(compiled, batch, n_points, vsys_use_case)
+
+
+def run_sweep(snapshot, user_profiles, battery_capacity_mAh, parameters, vsys_use_case=None, backend=None):
+    """
+    計算所有掃描點 (多個參數時為網格) 每個 Profile 的電池壽命。
+    vsys_use_case：用來取得 Vsys 電壓的 Use Case (介面中為目前選取的 Use Case)，預設為第一個。
+    backend：parallel.ExecutionBackend，掃描點很多時分段平行計算。
+    回傳長格式 DataFrame：每個參數一欄 + Profile / Avg. Power (mW) / Battery Life (Days)。
+    """
+    compiled = compile_model(snapshot)
+    grids = np.meshgrid(*[np.asarray(p.values, dtype=float) for p in parameters], indexing='ij')
+    points = [grid.ravel() for grid in grids]
+    n_points = points[0].size if points else 1
+
+    # 只有會改變模型的參數需要建立 batch 陣列；只掃描電池容量時模型只計算一次。
+    # mode 電流只記錄改變的格子 ((m, c) → 數值)，不建立 N × M × C 的陣列
+    overrides = {}
+    current_cells = {}
+    capacity = np.full(n_points, float(battery_capacity_mAh))
+    for parameter, values in zip(parameters, points):
+        if parameter.kind == 'battery_capacity':
+            capacity = values
+        elif parameter.kind == 'power_source':
+            ps_id, mode_name, field_name = parameter.target
+            if field_name not in POWER_SOURCE_FIELDS:
+                raise ValueError(f"無法掃描的電源參數: {field_name}")
+            name = 'ps_mode_efficiency' if field_name == 'efficiency' else 'ps_mode_iq_uA'
+            if name not in overrides:
+                overrides[name] = np.repeat(getattr(compiled, name)[np.newaxis], n_points, axis=0)
+            overrides[name][:, compiled.ps_mode_keys.index((ps_id, mode_name))] = values
+        elif parameter.kind == 'mode_current':
+            group, mode_name, node_id = parameter.target
+            m = compiled.mode_keys.index((group, mode_name))
+            c = compiled.component_ids.index(node_id)
+            current_cells[m, c] = values
+        else:
+            raise ValueError(f"未知的掃描參數類型: {parameter.kind}")
+
+    # 掃描點分段交給 backend (只掃描電池容量時沒有 batch 陣列，計算一次即可)；
+    # 每段的點數同時受記憶體上限限制
+    backend = backend or IN_PROCESS
+    work = evaluation_work(compiled, n_points, len(current_cells))
+    n_chunks = 1
+    if overrides or current_cells:
+        n_chunks = max(
+            backend.worker_count(n_points, work, _evaluate_points),
+            -(-n_points // compiled.points_per_batch(len(current_cells))),
+        )
+    cell_modes = [m for m, _ in current_cells]
+    cell_components = [c for _, c in current_cells]
+    cell_values = np.stack(list(current_cells.values()), axis=-1) if current_cells else None
+    items = [
+        (
+            {name: values[chunk] for name, values in overrides.items()},
+            (cell_modes, cell_components, cell_values[chunk]) if current_cells else None,
+            chunk.stop - chunk.start,
+        )
+        for chunk in split_ranges(n_points, n_chunks)
+    ]
+    evaluated = backend.map(_evaluate_points, items, context=(compiled, vsys_use_case), work=work)
+    total_power = np.concatenate([chunk_power for chunk_power, _ in evaluated], axis=0)
+    vsys_voltage = np.concatenate([chunk_vsys for _, chunk_vsys in evaluated], axis=0)
+    profile_names = list(user_profiles.keys())
+    avg_power, battery_life_days = profile_battery_life_batch(
+        total_power, vsys_voltage, capacity, user_profiles, compiled.use_case_names
+    )
+
+    columns = {parameter.label: np.repeat(values, len(profile_names)) for parameter, values in zip(parameters, points)}
+    columns["Profile"] = np.tile(profile_names, n_points)
+    columns["Avg. Power (mW)"] = avg_power.ravel()
+    columns["Battery Life (Days)"] = battery_life_days.ravel()
+    return pd.DataFrame(columns)
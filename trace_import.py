@@ -0,0 +1,194 @@
+"""
+電流波形匯入 (Power-Analyzer Trace Ingestion)
+
+由電源分析儀的長時間電流波形 (數百萬點以上，CSV 或 raw binary) 推導各 operating mode 的平均電流：
+  1. 分段讀取波形：raw binary 以 np.memmap 映射，CSV 以 pandas chunksize 讀取，
+     每次只有 CHUNK_SAMPLES 個樣本在記憶體中，數 GB 的檔案也只需要固定大小的記憶體
+  2. 單次走訪同時計算「固定時間窗的平均電流」(畫圖檢查用) 與「使用者標記的區間平均」
+  3. 同一個模式可以標記多個區間，以樣本數加權平均
+  4. 結果整理成 current_import 的電流表格式，由 apply_current_rows 寫入 operating_modes
+
+時間軸：CSV 有時間欄位時使用該欄位 (需遞增)，否則與 raw binary 相同，以 樣本索引 / 取樣率 計算。
+"""
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from current_import import CURRENT_TABLE_COLUMNS
+
+TRACE_FORMATS = {'csv': "CSV", 'binary': "Raw Binary"}
+BINARY_DTYPES = ('int16', 'int32', 'float32', 'float64')
+# 電流單位 → uA 的倍率
+CURRENT_UNITS = {'A': 1e6, 'mA': 1e3, 'uA': 1.0, 'nA': 1e-3}
+CHUNK_SAMPLES = 1_000_000
+# 時間窗平均最多輸出的點數 (超過時請加大時間窗)
+MAX_WINDOWS = 500_000
+
+
+@dataclass(frozen=True)
+class TraceSource:
+    """
+    一個波形檔的讀取設定。
+    raw 數值 × scale 為 unit 單位的電流；raw binary 可以是多通道交錯排列 (channels / channel)。
+    """
+    path: str
+    format: str = 'csv'
+    sample_rate_hz: float = 100_000.0
+    unit: str = 'A'
+    scale: float = 1.0
+    current_column: str = None        # CSV：電流欄位名稱 (None 表示最後一欄)
+    time_column: str = None           # CSV：時間欄位名稱 (秒)，None 表示依取樣率計算
+    dtype: str = 'float32'            # raw binary
+    channels: int = 1
+    channel: int = 0
+    header_bytes: int = 0
+    little_endian: bool = True
+
+
+@dataclass(frozen=True)
+class TraceInterval:
+    """波形中屬於某個 operating mode 的區間 [start_s, end_s)"""
+    mode: str
+    start_s: float
+    end_s: float
+
+
+@dataclass
+class TraceScan:
+    n_samples: int = 0
+    start_s: float = np.nan
+    end_s: float = np.nan
+    windows: pd.DataFrame = None                            # Time (s) / Avg. Current (uA) / Samples
+    interval_sums: np.ndarray = field(default_factory=lambda: np.zeros(0))
+    interval_counts: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+
+    def interval_averages(self):
+        """每個區間的平均電流 (uA)，區間內沒有樣本時為 NaN"""
+        return np.divide(
+            self.interval_sums, self.interval_counts,
+            out=np.full(len(self.interval_sums), np.nan), where=self.interval_counts > 0
+        )
+
+
+def _binary_chunks(source, chunk_samples):
+    dtype = np.dtype(source.dtype).newbyteorder('<' if source.little_endian else '>')
+    size = Path(source.path).stat().st_size - source.header_bytes
+    n_frames = max(size, 0) // (dtype.itemsize * source.channels)
+    if n_frames == 0:
+        return
+    data = np.memmap(source.path, dtype=dtype, mode='r', offset=source.header_bytes, shape=(n_frames, source.channels))
+    for start in range(0, n_frames, chunk_samples):
+        # 只把目前這段轉成 float64，memmap 的其他部分由作業系統視需要換頁
+        yield start, np.asarray(data[start:start + chunk_samples, source.channel], dtype=float), None
+
+
+def _csv_chunks(source, chunk_samples):
+    start = 0
+    for chunk in pd.read_csv(source.path, chunksize=chunk_samples, skipinitialspace=True):
+        current_column = source.current_column or chunk.columns[-1]
+        if current_column not in chunk.columns:
+            raise ValueError(f"CSV 中沒有電流欄位: {current_column}")
+        if source.time_column and source.time_column not in chunk.columns:
+            raise ValueError(f"CSV 中沒有時間欄位: {source.time_column}")
+        currents = pd.to_numeric(chunk[current_column], errors='coerce').to_numpy(dtype=float)
+        times = pd.to_numeric(chunk[source.time_column], errors='coerce').to_numpy(dtype=float) if source.time_column else None
+        yield start, currents, times
+        start += len(chunk)
+
+
+def iter_trace(source, chunk_samples=CHUNK_SAMPLES):
+    """
+    逐段產生 (時間 (s), 電流 (uA))；無法解析的樣本 (NaN) 會被略過。
+    """
+    if source.format == 'binary':
+        chunks = _binary_chunks(source, chunk_samples)
+    elif source.format == 'csv':
+        chunks = _csv_chunks(source, chunk_samples)
+    else:
+        raise ValueError(f"未知的波形格式: {source.format}")
+    to_uA = source.scale * CURRENT_UNITS[source.unit]
+    for start, raw, times in chunks:
+        if times is None:
+            times = (start + np.arange(len(raw))) / source.sample_rate_hz
+        valid = ~(np.isnan(raw) | np.isnan(times))
+        if not valid.all():
+            raw, times = raw[valid], times[valid]
+        if len(raw):
+            yield times, raw * to_uA
+
+
+def scan_trace(source, intervals=(), window_s=None, chunk_samples=CHUNK_SAMPLES):
+    """
+    單次走訪波形：計算每個區間的電流總和 / 樣本數，以及 (window_s 不為 None 時) 每個時間窗的平均電流。
+    每段以 cumsum 取得區間總和，每個區間的成本與區間長度無關。
+    """
+    starts = np.array([interval.start_s for interval in intervals], dtype=float)
+    ends = np.array([interval.end_s for interval in intervals], dtype=float)
+    scan = TraceScan(interval_sums=np.zeros(len(intervals)), interval_counts=np.zeros(len(intervals), dtype=np.int64))
+    window_pieces = []
+    first_window = None
+    last_time = -np.inf
+    for times, currents in iter_trace(source, chunk_samples):
+        if times[0] < last_time or np.any(np.diff(times) < 0):
+            raise ValueError("波形的時間必須遞增")
+        last_time = times[-1]
+        if scan.n_samples == 0:
+            scan.start_s = float(times[0])
+        scan.end_s = float(times[-1])
+        scan.n_samples += len(currents)
+
+        if len(intervals):
+            cumulative = np.r_[0.0, np.cumsum(currents)]
+            lo = np.searchsorted(times, starts, side='left')
+            hi = np.searchsorted(times, ends, side='left')
+            scan.interval_sums += cumulative[hi] - cumulative[lo]
+            scan.interval_counts += hi - lo
+
+        if window_s:
+            window_id = np.floor(times / window_s).astype(np.int64)
+            if first_window is None:
+                first_window = int(window_id[0])
+            if window_id[-1] - first_window >= MAX_WINDOWS:
+                raise ValueError(f"時間窗數量超過 {MAX_WINDOWS}，請加大時間窗")
+            offset = int(window_id[0])
+            window_pieces.append((
+                offset,
+                np.bincount(window_id - offset, weights=currents),
+                np.bincount(window_id - offset),
+            ))
+
+    if window_pieces:
+        n_windows = window_pieces[-1][0] + len(window_pieces[-1][1]) - first_window
+        sums = np.zeros(n_windows)
+        counts = np.zeros(n_windows, dtype=np.int64)
+        # 相鄰兩段可能落在同一個時間窗，累加即可合併
+        for offset, piece_sums, piece_counts in window_pieces:
+            sums[offset - first_window:offset - first_window + len(piece_sums)] += piece_sums
+            counts[offset - first_window:offset - first_window + len(piece_counts)] += piece_counts
+        has_samples = counts > 0
+        scan.windows = pd.DataFrame({
+            "Time (s)": (first_window + np.flatnonzero(has_samples)) * window_s,
+            "Avg. Current (uA)": sums[has_samples] / counts[has_samples],
+            "Samples": counts[has_samples],
+        })
+    elif window_s:
+        scan.windows = pd.DataFrame(columns=["Time (s)", "Avg. Current (uA)", "Samples"])
+    return scan
+
+
+def mode_current_table(scan, intervals, group, endpoint, note=""):
+    """
+    依區間平均整理成電流表 (CURRENT_TABLE_COLUMNS)：同一模式的多個區間以樣本數加權平均，
+    沒有任何樣本的模式不列入。
+    """
+    totals = {}
+    for interval, total, count in zip(intervals, scan.interval_sums, scan.interval_counts):
+        mode_total, mode_count = totals.get(interval.mode, (0.0, 0))
+        totals[interval.mode] = (mode_total + total, mode_count + int(count))
+    rows = [
+        (group, mode, endpoint, total / count, note)
+        for mode, (total, count) in totals.items() if count > 0
+    ]
+    return pd.DataFrame(rows, columns=CURRENT_TABLE_COLUMNS)
@@ -0,0 +1,234 @@
+"""
+Power Tree 圖表 (Graphviz DOT) 產生與快取
+
+先把每個節點要顯示的文字 (已四捨五入到顯示位數) 整理成 label data，
+以它的內容雜湊作為 key 快取 DOT source：拓撲、主題、群組顏色或顯示數值沒有變化時，
+不需要重新建立 graphviz.Digraph。
+
+大型 Power Tree 可以用 TreeDetail 設定細節層級：只顯示某個 rail 以下的子樹、
+把同一 rail 下同一 group 的 component 合併成一個節點、
+並以功耗由大到小展開節點，低於門檻或超過節點數上限的分支合併成一個 "Other" 節點，
+送進 layout engine 的節點數因此有上限。
+"""
+import heapq
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+
+import graphviz
+
+from result_cache import content_digest
+
+# 主題 → (背景, 邊線, 文字, 表格框線) 顏色
+THEME_COLORS = {
+    "Dark": {"graph_bgcolor": "black", "edge_color": "white", "font_color": "#CCCCCC", "table_border_color": "white"},
+    "Light": {"graph_bgcolor": "white", "edge_color": "black", "font_color": "#555555", "table_border_color": "black"},
+}
+
+
+@dataclass(frozen=True)
+class TreeDetail:
+    """
+    Power Tree 圖表的細節層級 (Level of Detail)。
+    預設值 (全部關閉) 時圖表與完整的 Power Tree 相同。
+    """
+    focus_id: str = None           # 只顯示此 rail 以下的子樹 (None = 全部)
+    collapse_groups: bool = False  # 同一 rail 下同一 group 的 component 合併成一個節點
+    min_power_mW: float = 0.0      # 功耗低於此值的分支合併到 "Other"
+    max_nodes: int = None          # 最多展開的節點數 (None = 不限制)
+
+    @property
+    def is_full(self):
+        return self.focus_id is None and not self.collapse_groups and self.min_power_mW <= 0 and self.max_nodes is None
+
+
+def _branch_power(view):
+    """節點 (連同其下游) 對上游造成的負載 (mW)"""
+    if view['type'] == 'power_source':
+        return view.get('input_power', view.get('output_power_total', 0.0))
+    return view.get('power_consumption', 0.0)
+
+
+def _summary_view(node_id, parent_id, group, endpoint, power_mW):
+    return {'id': node_id, 'type': 'component', 'group': group, 'endpoint': endpoint,
+            'input_source_id': parent_id, 'power_consumption': power_mW}
+
+
+def reduce_node_views(tree, node_views, detail):
+    """
+    依 TreeDetail 縮減 node_views (id → 套用結果的節點)。
+    由根節點 (或 focus rail) 開始以功耗由大到小展開 (best-first)，
+    被截掉的分支依上游 rail 合併成一個 "Other" 節點 ("Other" 節點也計入 max_nodes)；起點本身一定會保留。
+    回傳的 dict 保持原本節點的順序，合併產生的節點排在最後。
+    """
+    children = {}
+    for node_id in tree.topological_order():
+        child_views = [node_views[c] for c in tree.children.get(node_id, ()) if c in node_views]
+        if detail.collapse_groups:
+            rails = [v for v in child_views if v['type'] == 'power_source']
+            groups = defaultdict(list)
+            for view in child_views:
+                if view['type'] == 'component':
+                    groups[view['group']].append(view)
+            merged = []
+            for group, members in groups.items():
+                if len(members) == 1:
+                    merged.append(members[0])
+                    continue
+                merged.append(_summary_view(
+                    f"{node_id}::group::{group}", node_id, group, f"{len(members)} endpoints",
+                    sum(_branch_power(v) for v in members)
+                ))
+            child_views = rails + merged
+        children[node_id] = child_views
+
+    if detail.focus_id in node_views:
+        start = [node_views[detail.focus_id]]
+    else:
+        start = [node_views[r] for r in tree.roots if r in node_views]
+
+    # "Other" 節點也計入 max_nodes：有子節點還沒展開 (在 heap 中) 或已被截掉的上游各預留一個位置
+    kept = {}
+    hidden = defaultdict(list)
+    reserved = set()
+    queued = defaultdict(int)
+    heap = []
+    counter = 0
+
+    def expand(view):
+        nonlocal counter
+        kept[view['id']] = view
+        for child in children.get(view['id'], ()):
+            heapq.heappush(heap, (-_branch_power(child), counter, child))
+            counter += 1
+            queued[view['id']] += 1
+            reserved.add(view['id'])
+
+    for view in start:
+        expand(view)
+    while heap:
+        neg_power, _, view = heapq.heappop(heap)
+        parent_id = view['input_source_id']
+        queued[parent_id] -= 1
+        # 展開後上游不再需要 "Other" 時釋放它的預留位置
+        releases_parent = queued[parent_id] == 0 and parent_id not in hidden
+        if detail.max_nodes is not None:
+            total = len(kept) + 1 + len(reserved) - releases_parent + bool(children.get(view['id']))
+            over_budget = total > detail.max_nodes
+        else:
+            over_budget = False
+        if over_budget or -neg_power < detail.min_power_mW:
+            hidden[parent_id].append(view)
+            continue
+        if releases_parent:
+            reserved.discard(parent_id)
+        expand(view)
+
+    reduced = {node_id: kept[node_id] for node_id in node_views if node_id in kept}
+    for view in kept.values():
+        if view['id'] not in reduced:
+            reduced[view['id']] = view
+    summaries = {
+        parent_id: sum(_branch_power(v) for v in views) for parent_id, views in hidden.items()
+    }
+    if detail.max_nodes is not None:
+        # 只有 max_nodes 小到連起點與它的 "Other" 都放不下時才需要捨棄，保留功耗較大的
+        room = max(detail.max_nodes - len(reduced), 0)
+        allowed = set(sorted(summaries, key=summaries.get, reverse=True)[:room])
+        summaries = {parent_id: power for parent_id, power in summaries.items() if parent_id in allowed}
+    for parent_id, power in summaries.items():
+        reduced[f"{parent_id}::other"] = _summary_view(
+            f"{parent_id}::other", parent_id, "Other", f"{len(hidden[parent_id])} hidden", power
+        )
+    # 起點一定會保留，因此上限為 max(max_nodes, 起點數)
+    assert detail.max_nodes is None or len(reduced) <= max(detail.max_nodes, len(start))
+    return reduced
+
+
+def power_tree_label_data(snapshot, result, theme, group_colors, detail=None):
+    """整理圖表上所有會顯示的內容 (節點文字、顏色、邊線標籤)，同時作為快取 key 的來源"""
+    node_views = result.node_views(snapshot)
+    if detail is not None and not detail.is_full:
+        node_views = reduce_node_views(snapshot.tree, node_views, detail)
+    nodes = list(node_views.values())
+
+    rails = []
+    for node in [n for n in nodes if n['type'] == 'power_source']:
+        pin_str = f"Pin: {node.get('input_power', 0):.2f}mW" if node.get('input_source_id') else "Pin: N/A"
+        pout_str = f"Pout: {node.get('output_power_total', 0):.2f}mW"
+        eff_str = f"eff: {node.get('efficiency', 1.0) * 100:.0f}%" if node.get('efficiency', 0) > 0 else "eff: N/A"
+        iq_str = f"Iq: {node.get('quiescent_current_uA', 0.0):.1f}uA"
+        rails.append((node['id'], node['label'], f'{pin_str} &nbsp;|&nbsp; {pout_str}<BR/>{eff_str}<BR/>{iq_str}'))
+
+    components = []
+    for node in sorted([n for n in nodes if n['type'] == 'component'], key=lambda x: x['group']):
+        power_details = f"Power: {node.get('power_consumption', 0):.2f}mW"
+        components.append((
+            node['id'], node['group'], group_colors.get(node['group'], "#CCCCCC"), f'{node["endpoint"]}<BR/>{power_details}'
+        ))
+
+    edges = []
+    for node in nodes:
+        if node.get('input_source_id'):
+            source = node_views.get(node['input_source_id'])
+            if source:
+                voltage = source.get('output_voltage', 0)
+                power = node.get('input_power', 0) if node['type'] == 'power_source' else node.get('power_consumption', 0)
+                current_mA = power / voltage if voltage > 0 else 0
+                edges.append((node['input_source_id'], node['id'], f"{voltage:.2f} V\n{current_mA * 1000.0:.1f} uA"))
+
+    return {"theme": theme, "rails": rails, "components": components, "edges": edges}
+
+
+def build_power_tree_dot(label_data):
+    """由 label data 建立 Power Tree 的 DOT source"""
+    colors = THEME_COLORS.get(label_data["theme"], THEME_COLORS["Light"])
+    table_border_color = colors["table_border_color"]
+
+    dot = graphviz.Digraph(comment='Power Tree')
+    dot.attr(rankdir='LR', splines='line', ranksep='0.5', nodesep='0.15', center='true', bgcolor=colors["graph_bgcolor"])
+    dot.attr('edge', color=colors["edge_color"], fontname='Arial', fontsize='10', fontcolor=colors["font_color"])
+
+    for node_id, label, details_html in label_data["rails"]:
+        table = (f'<TABLE BORDER="0" CELLBORDER="1" CELLSPACING="0" CELLPADDING="5" COLOR="{table_border_color}">'
+                 f'<TR><TD BGCOLOR="#2196F3" ALIGN="CENTER"><B><FONT COLOR="white">{label}</FONT></B></TD></TR>'
+                 f'<TR><TD ALIGN="CENTER" BGCOLOR="#FFFFFF"><FONT COLOR="black">{details_html}</FONT></TD></TR>'
+                 f'</TABLE>')
+        dot.node(node_id, label=f'<{table}>', shape='none')
+
+    with dot.subgraph(name='cluster_components') as c:
+        c.attr(rank='sink', style='invis')
+        for node_id, group, group_color, combined_details in label_data["components"]:
+            table = (f'<TABLE BORDER="0" CELLBORDER="1" CELLSPACING="0" CELLPADDING="5" COLOR="{table_border_color}">'
+                     f'<TR><TD BGCOLOR="{group_color}" ALIGN="CENTER"><B><FONT COLOR="white">{group}</FONT></B></TD></TR>'
+                     f'<TR><TD ALIGN="CENTER" BGCOLOR="#FFFFFF"><FONT COLOR="black">{combined_details}</FONT></TD></TR>'
+                     f'</TABLE>')
+            c.node(node_id, label=f'<{table}>', shape='none')
+
+    for source_id, node_id, edge_label in label_data["edges"]:
+        dot.edge(source_id, node_id, label=edge_label, tailport='e', headport='w')
+
+    return dot.source
+
+
+class PowerTreeRenderCache:
+    """以 label data 內容雜湊為 key 的 DOT source LRU 快取"""
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get_dot(self, label_data):
+        key = content_digest(label_data)
+        dot_source = self._entries.get(key)
+        if dot_source is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return dot_source
+        self.misses += 1
+        dot_source = build_power_tree_dot(label_data)
+        self._entries[key] = dot_source
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return dot_source
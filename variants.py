@@ -0,0 +1,187 @@
+"""
+設定檔版本比較 (Variant Comparison)
+
+一次載入多份設定檔 (例如同一產品的不同 BOM / 韌體版本)，全部交給批次引擎計算，
+把每個 Profile 的電池壽命、每個 Use Case 的功耗、每個功耗來源 (群組 / Iq 損耗) 的平均功耗
+並排成寬表格，並計算相對於基準版本的差異，找出退步最多的項目。
+
+每份設定檔的計算結果以「只包含影響計算的欄位」的內容雜湊快取：
+重新上傳、改名或只修改備註的設定檔不會重新計算，十幾份大型設定檔之間切換基準版本也只是表格運算。
+"""
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from parallel import IN_PROCESS
+from power_report import config_report
+from result_cache import content_digest
+
+# 影響計算結果的設定檔欄位 (備註、顏色等不列入雜湊)
+COMPUTED_KEYS = (
+    'power_tree_data', 'operating_modes', 'power_source_modes', 'use_cases',
+    'battery_capacity_mAh', 'user_profiles', 'profile_dou_specs',
+)
+_IGNORED_NODE_KEYS = ('note',)
+
+# config_report 的實測成本 (見 _report_seconds)
+REPORT_SECONDS = 0.1
+REPORT_SECONDS_PER_USE_CASE_NODE = 4.5e-6
+
+# 各比較表格：(report 表格名稱, 索引欄位, 數值欄位, 數值越大越好)
+COMPARISONS = {
+    'battery_life': ('battery_life', ['Profile'], 'Battery Life (Days)', True),
+    'use_cases': ('use_cases', ['Use Case'], 'Total Power (mW)', False),
+    'breakdown': ('breakdown', ['profile', 'source'], 'power_mW', False),
+}
+DELTA_SUFFIX = " Δ"
+DELTA_PCT_SUFFIX = " Δ%"
+REGRESSION_COLUMNS = ["Comparison", "Metric", "Item", "Variant", "Baseline", "Value", "Δ", "Δ%"]
+
+
+def config_digest(config):
+    """設定檔中影響計算結果的內容雜湊"""
+    computed = {key: config.get(key) for key in COMPUTED_KEYS}
+    computed['power_tree_data'] = [
+        {k: v for k, v in node.items() if k not in _IGNORED_NODE_KEYS}
+        for node in config.get('power_tree_data', {}).get('nodes', [])
+    ]
+    return content_digest(computed)
+
+
+def _report_seconds(config):
+    """config_report 的預估秒數：實測每份約 0.1 s 固定成本 (DataFrame 組裝)，加上每個 (Use Case × 節點) 約 4.5 us"""
+    n_nodes = len(config.get('power_tree_data', {}).get('nodes', []))
+    return REPORT_SECONDS + n_nodes * max(len(config.get('use_cases', {})), 1) * REPORT_SECONDS_PER_USE_CASE_NODE
+
+
+def _report_job(_context, config):
+    """ExecutionBackend 的工作函數：計算一份設定檔，錯誤以字串回傳"""
+    try:
+        return config_report(config), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+class VariantReportCache:
+    """以 config_digest 為 key 的 config_report 結果 LRU 快取"""
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_reports(self, configs, backend=None, digests=None):
+        """
+        configs = {版本名稱: 設定檔 dict}，回傳 {版本名稱: (報表 dict 或 None, 錯誤訊息或 None)}。
+        只有快取中沒有的設定檔會交給 backend 計算 (內容相同的設定檔只計算一次)。
+        digests = {版本名稱: config_digest}：呼叫端已算好的雜湊 (例如每個上傳檔案只算一次)，沒有的才重新計算。
+        """
+        digests = digests or {}
+        keys = {name: digests.get(name) or config_digest(config) for name, config in configs.items()}
+        missing = {}
+        for name, key in keys.items():
+            if self.get(key) is None and key not in missing:
+                missing[key] = configs[name]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            work = sum(_report_seconds(config) for config in missing.values())
+            entries = (backend or IN_PROCESS).map(_report_job, list(missing.values()), work=work)
+            for key, entry in zip(missing, entries):
+                self.put(key, entry)
+        return {name: self._entries[key] for name, key in keys.items()}
+
+
+def compare_table(reports, baseline, comparison):
+    """
+    一種比較 (COMPARISONS 的 key) 的寬表格：每個版本一欄，
+    非基準版本另外有相對於基準的差值 (「版本 Δ」) 與百分比 (「版本 Δ%」) 欄位。
+    某個版本沒有的項目 (例如新增的 Use Case) 為 NaN。
+    """
+    table, index, value, _ = COMPARISONS[comparison]
+    columns = {}
+    for name, report in reports.items():
+        df = report[table]
+        columns[name] = df.set_index(index)[value].astype(float) if not df.empty else pd.Series(dtype=float)
+    wide = pd.DataFrame(columns)
+    if baseline not in wide.columns:
+        return wide
+    base = wide[baseline]
+    for name in reports:
+        if name == baseline:
+            continue
+        delta = wide[name] - base
+        wide[name + DELTA_SUFFIX] = delta
+        wide[name + DELTA_PCT_SUFFIX] = np.divide(
+            delta, base.abs(), out=np.full(len(delta), np.nan), where=(base.abs() > 0).to_numpy()
+        )
+    return wide
+
+
+def regression_scores(wide, comparison):
+    """
+    每個 Δ% 欄位的「退步量」(正數表示比基準差)：電池壽命變短、功耗變高。
+    """
+    higher_is_better = COMPARISONS[comparison][3]
+    deltas = wide[[c for c in wide.columns if c.endswith(DELTA_PCT_SUFFIX)]]
+    return -deltas if higher_is_better else deltas
+
+
+def worst_regressions(reports, baseline, top_n=10):
+    """
+    所有比較表格中退步最多的項目 (長格式，依 Δ% 由大到小)：
+    Comparison / Item / Variant / Baseline / Value / Δ / Δ%。
+    每個比較表格只取出前 top_n 個退步的格子再查詢數值，不逐格建立列。
+    """
+    frames = []
+    for comparison, (_, _, value, _) in COMPARISONS.items():
+        wide = compare_table(reports, baseline, comparison)
+        scores = regression_scores(wide, comparison)
+        if scores.empty:
+            continue
+        # 依 (版本, 項目) 的順序攤平，分數相同時維持這個順序
+        flat = scores.to_numpy(dtype=float).ravel(order='F')
+        regressed = np.flatnonzero(flat > 0)
+        regressed = regressed[np.argsort(-flat[regressed], kind='stable')[:top_n]]
+        rows, columns = regressed % len(scores), regressed // len(scores)
+        variants = [column[:-len(DELTA_PCT_SUFFIX)] for column in scores.columns[columns]]
+        values = wide.to_numpy(dtype=float)
+
+        def lookup(names):
+            return values[rows, wide.columns.get_indexer(names)]
+
+        frames.append(pd.DataFrame({
+            "Comparison": comparison,
+            "Metric": value,
+            "Item": [" / ".join(item) if isinstance(item, tuple) else item for item in scores.index[rows]],
+            "Variant": variants,
+            "Baseline": lookup([baseline] * len(rows)),
+            "Value": lookup(variants),
+            "Δ": lookup([variant + DELTA_SUFFIX for variant in variants]),
+            "Δ%": lookup([variant + DELTA_PCT_SUFFIX for variant in variants]),
+            "_score": flat[regressed],
+        }))
+    if not frames:
+        return pd.DataFrame(columns=REGRESSION_COLUMNS)
+    df = pd.concat(frames, ignore_index=True).sort_values("_score", ascending=False, kind='stable')
+    return df.drop(columns="_score").head(top_n).reset_index(drop=True)